@@ -1 +1,23 @@
-__version__ = '0.1a'
\ No newline at end of file
+__version__ = '0.1a'
+
+
+def render(form, style=None, overrides=None, context=None):
+    """
+    Renders form without parsing templates, see forme.shortcuts.render.
+
+    """
+    from forme import shortcuts
+    return shortcuts.render(form, style, overrides, context)
+
+
+def render_field(form, name, style=None, overrides=None, context=None):
+    """
+    Renders single field of form, see forme.shortcuts.render_field.
+
+    """
+    from forme import shortcuts
+    return shortcuts.render_field(form, name, style, overrides, context)
+
+
+# Dj1.7+
+default_app_config = 'forme.apps.FormeConfig'
@@ -0,0 +1,14 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+from django.apps import AppConfig
+
+
+class FormeConfig(AppConfig):
+    name = 'forme'
+    verbose_name = 'Forme'
+
+    def ready(self):
+        from forme import loader, settings
+        if settings.FORME_WARMUP:
+            loader.styles.warmup(threads=settings.FORME_WARMUP_THREADS)
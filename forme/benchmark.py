@@ -0,0 +1,343 @@
+# coding: utf-8
+"""
+Benchmark of parsing and rendering forms of various sizes and styles.
+
+Usage::
+
+  $ python -m forme.benchmark --output results.json
+  $ python -m forme.benchmark --baseline results.json --threshold 0.2
+
+Each scenario is measured in three phases:
+ - parse: parsing template (parse cache is cleared before each sample)
+ - first_render: first render of freshly parsed template
+ - render: steady state render of the same template
+
+When Jinja2 is installed, all scenarios are measured with Jinja2 templates
+too (scenarios prefixed by ``jinja2:``), so both engines render the same
+forms.
+
+Results are written as JSON with percentiles in milliseconds. When baseline
+is given, command fails if median time of any phase is slower by more than
+threshold.
+
+"""
+from __future__ import unicode_literals, print_function, absolute_import
+import json
+import platform
+import sys
+from optparse import OptionParser
+from timeit import default_timer
+
+import django
+from django.conf import settings
+
+import forme
+
+WIDGETS = ('text', 'email', 'integer', 'checkbox', 'select', 'multiple',
+           'date', 'textarea', 'hidden')
+
+OVERRIDES_TEMPLATE = '''{% load forme %}
+{% forme form using %}
+  {% hiddenfields %}
+  {% nonfielderrors %}
+  {% fieldset "FIELDS" using %}
+    <fieldset>
+      {% field using %}
+        <div class="row">{% errors %}{% label %}{% input %}</div>
+      {% endfield %}
+    </fieldset>
+  {% endfieldset %}
+  {% fieldset "REST" replace %}
+    {% field using %}
+      <p>{% label %}{% input using %}<span>{{ field }}</span>{% endinput %}</p>
+    {% endfield %}
+  {% endfieldset %}
+  {% label using %}<b>{{ label.label }}</b>{% endlabel %}
+  {% errors using %}<ul>{{ errors }}</ul>{% enderrors %}
+{% endforme %}
+'''
+
+
+def make_field(index):
+    from django import forms
+
+    choices = [(str(i), 'Choice {0}'.format(i)) for i in range(20)]
+    widget = WIDGETS[index % len(WIDGETS)]
+    if widget == 'text':
+        return forms.CharField(max_length=100)
+    elif widget == 'email':
+        return forms.EmailField()
+    elif widget == 'integer':
+        return forms.IntegerField(min_value=0)
+    elif widget == 'checkbox':
+        return forms.BooleanField(required=False)
+    elif widget == 'select':
+        return forms.ChoiceField(choices=choices)
+    elif widget == 'multiple':
+        return forms.MultipleChoiceField(choices=choices)
+    elif widget == 'date':
+        return forms.DateField()
+    elif widget == 'textarea':
+        return forms.CharField(widget=forms.Textarea)
+    else:
+        return forms.CharField(widget=forms.HiddenInput)
+
+
+def make_form_class(size):
+    """
+    Returns form class with *size* fields of mixed widget types.
+
+    """
+    from django import forms
+
+    fields = {}
+    for index in range(size):
+        fields['field_{0:04d}'.format(index)] = make_field(index)
+    return type(str('Form{0}'.format(size)), (forms.Form,), fields)
+
+
+def get_scenarios():
+    """
+    Returns list of (name, template source, context factory).
+
+    """
+    from django.forms.formsets import formset_factory
+
+    scenarios = []
+    for size in (10, 100, 1000):
+        form_class = make_form_class(size)
+        scenarios.append((
+            'fields-{0}'.format(size), '{% load forme %}{% forme form %}',
+            lambda form_class=form_class: {'form': form_class()}))
+
+    form_class = make_form_class(100)
+    scenarios.append((
+        'bound-100', '{% load forme %}{% forme form %}',
+        lambda: {'form': form_class(data={})}))
+
+    form_class = make_form_class(100)
+    fields = [name for name, field in sorted(form_class.base_fields.items())
+              if not field.widget.is_hidden]
+    source = (OVERRIDES_TEMPLATE.replace('FIELDS', ' '.join(fields[:50]))
+              .replace('REST', ' '.join(fields[50:])))
+    scenarios.append((
+        'overrides-100', source, lambda: {'form': form_class()}))
+
+    formset_class = formset_factory(make_form_class(10), extra=20)
+    scenarios.append((
+        'formset-20x10', '{% load forme %}{% forme formset %}',
+        lambda: {'formset': formset_class()}))
+    return scenarios
+
+
+def percentile(values, percent):
+    """
+    Returns percentile of values using nearest-rank method.
+
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    rank = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+
+def get_stats(times):
+    times = [time * 1000 for time in times]
+    return {
+        'n': len(times),
+        'min': min(times),
+        'mean': sum(times) / len(times),
+        'p50': percentile(times, 50),
+        'p90': percentile(times, 90),
+        'p99': percentile(times, 99),
+        'max': max(times),
+    }
+
+
+def measure(func, repeat, setup=None):
+    """
+    Returns list of times of *repeat* calls of func. When *setup* is given,
+    its result is passed to func and it isn't measured.
+
+    """
+    times = []
+    for i in range(repeat):
+        args = (setup(),) if setup is not None else ()
+        start = default_timer()
+        func(*args)
+        times.append(default_timer() - start)
+    return times
+
+
+def get_jinja_environment():
+    """
+    Returns Jinja2 environment with forme tags, None when Jinja2 isn't
+    installed.
+
+    """
+    try:
+        from jinja2 import Environment, PackageLoader
+    except ImportError:
+        return None
+    return Environment(loader=PackageLoader('forme', 'jinja2'),
+                       extensions=['forme.jinja.FormeExtension'])
+
+
+def run_scenario(source, context_factory, repeat, environment=None):
+    """
+    Measures scenario rendered by Django templates or by Jinja2 templates
+    of *environment*.
+
+    """
+    from django.template import Context, Template
+    from forme.parser import get_parse_cache
+
+    if environment is None:
+        def parse():
+            parse_cache = get_parse_cache()
+            if parse_cache is not None:
+                parse_cache.clear()
+            return Template(source)
+
+        def make_context():
+            return Context(context_factory())
+    else:
+        source = source.replace('{% load forme %}', '')
+        extension = environment.extensions['forme.jinja.FormeExtension']
+
+        def parse():
+            extension.nodes.clear()
+            return environment.from_string(source)
+
+        make_context = context_factory
+
+    def setup_first():
+        return parse(), make_context()
+
+    def render_first(args):
+        tmpl, context = args
+        tmpl.render(context)
+
+    tmpl = parse()
+    tmpl.render(make_context())
+
+    return {
+        'parse': get_stats(measure(parse, repeat)),
+        'first_render': get_stats(measure(render_first, repeat, setup_first)),
+        'render': get_stats(measure(tmpl.render, repeat, make_context)),
+    }
+
+
+def run(repeat=20, names=None):
+    """
+    Runs all scenarios (or only the ones in *names*) with both template
+    engines. Returns dict with versions and stats of each phase of each
+    scenario.
+
+    """
+    # Load styles before measuring
+    from forme import loader
+    loader.styles.warmup()
+
+    environment = get_jinja_environment()
+    engines = [('', None)]
+    if environment is not None:
+        extension = environment.extensions['forme.jinja.FormeExtension']
+        extension.styles.warmup()
+        engines.append(('jinja2:', environment))
+
+    results = {}
+    for prefix, engine in engines:
+        for name, source, context_factory in get_scenarios():
+            name = prefix + name
+            if names and name not in names:
+                continue
+            results[name] = run_scenario(source, context_factory, repeat,
+                                         engine)
+
+    meta = {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'forme': forme.__version__,
+        'repeat': repeat,
+    }
+    if environment is not None:
+        import jinja2
+        meta['jinja2'] = jinja2.__version__
+    return {'meta': meta, 'results': results}
+
+
+def compare(results, baseline, threshold=0.2, stat='p50'):
+    """
+    Compares results with baseline. Returns list of regressions as tuples
+    (scenario, phase, baseline time, current time).
+
+    """
+    regressions = []
+    for name, phases in sorted(results['results'].items()):
+        for phase, stats in sorted(phases.items()):
+            try:
+                base = baseline['results'][name][phase][stat]
+            except KeyError:
+                continue
+            if stats[stat] > base * (1 + threshold):
+                regressions.append((name, phase, base, stats[stat]))
+    return regressions
+
+
+def format_results(results):
+    lines = ['{0:<22} {1:<13} {2:>10} {3:>10} {4:>10}'.format(
+        'Scenario', 'Phase', 'p50 ms', 'p90 ms', 'p99 ms')]
+    for name, phases in sorted(results['results'].items()):
+        for phase in ('parse', 'first_render', 'render'):
+            stats = phases[phase]
+            lines.append('{0:<22} {1:<13} {2:>10.3f} {3:>10.3f} {4:>10.3f}'
+                         .format(name, phase, stats['p50'], stats['p90'],
+                                 stats['p99']))
+    return '\n'.join(lines)
+
+
+def setup():
+    if not settings.configured:
+        settings.configure(INSTALLED_APPS=('forme',))
+    if hasattr(django, 'setup'):
+        # Dj1.7+
+        django.setup()
+
+
+def main(argv=None):
+    option_parser = OptionParser(usage='%prog [options] [scenario ...]')
+    option_parser.add_option('-n', '--repeat', type='int', default=20,
+                             help='Number of samples of each phase.')
+    option_parser.add_option('-o', '--output',
+                             help='Write results as JSON to file.')
+    option_parser.add_option('-b', '--baseline',
+                             help='Compare results with JSON file.')
+    option_parser.add_option('-t', '--threshold', type='float', default=0.2,
+                             help='Allowed slowdown compared to baseline, '
+                                  '0.2 means 20%.')
+    options, names = option_parser.parse_args(argv)
+
+    setup()
+    results = run(repeat=options.repeat, names=names)
+    print(format_results(results))
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as baseline:
+            regressions = compare(results, json.load(baseline),
+                                  options.threshold)
+        for name, phase, base, current in regressions:
+            print('Regression: {0} {1} {2:.3f} ms -> {3:.3f} ms'
+                  .format(name, phase, base, current))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,208 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import threading
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Py2.6
+    from django.utils.datastructures import SortedDict as OrderedDict
+
+from forme.context import missing
+
+
+class LRUCache(object):
+    """
+    In-process cache which evicts least recently used values when number of
+    values or their total length exceeds the limits. Values must support
+    len() only when size is limited. *on_evict* is called with list of
+    evicted values.
+
+    """
+    def __init__(self, max_entries=None, max_size=None, on_evict=None):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.on_evict = on_evict
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.pop(key, missing)
+            if value is missing:
+                return default
+            # Most recently used values are kept at the end.
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        evicted = []
+        with self._lock:
+            previous = self._data.pop(key, missing)
+            if previous is not missing:
+                self.size -= self._size(previous)
+
+            if self.max_size and self._size(value) > self.max_size:
+                evicted.append(value)
+            else:
+                self._data[key] = value
+                self.size += self._size(value)
+            while ((self.max_entries and len(self._data) > self.max_entries) or
+                   (self.max_size and self.size > self.max_size)):
+                oldest = next(iter(self._data))
+                evicted.append(self._data.pop(oldest))
+                self.size -= self._size(evicted[-1])
+
+        # Outside of lock, callback may use the cache.
+        if evicted and self.on_evict is not None:
+            self.on_evict(evicted)
+
+    def discard(self, test):
+        """
+        Removes values whose keys pass test.
+
+        """
+        with self._lock:
+            for key in [key for key in self._data if test(key)]:
+                self.size -= self._size(self._data.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def _size(self, value):
+        return len(value) if self.max_size else 0
+
+
+class FragmentCache(object):
+    """
+    Cache of rendered forms. Backend is either LRUCache or Django cache.
+    Counts hits and misses of all lookups.
+
+    """
+    key_prefix = 'forme:'
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def make_key(self, key):
+        return self.key_prefix + key
+
+    def get(self, key):
+        value = self.backend.get(self.make_key(key))
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(self.make_key(key), value)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+        }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+
+class PlanCache(FragmentCache):
+    """
+    In-process cache of render plans keyed by shape of form, see
+    forme.context.RenderPlan. Stats include number of cached plans.
+
+    """
+    def __init__(self, max_entries=None):
+        super(PlanCache, self).__init__(LRUCache(max_entries=max_entries))
+
+    def make_key(self, key):
+        return key
+
+    def stats(self):
+        stats = super(PlanCache, self).stats()
+        stats['size'] = len(self.backend)
+        stats['max_entries'] = self.backend.max_entries
+        return stats
+
+    def clear(self):
+        self.backend.clear()
+
+    def discard(self, test):
+        self.backend.discard(test)
+
+
+def get_django_cache(name):
+    try:
+        from django.core.cache import caches
+    except ImportError:
+        # Dj1.4 - Dj1.6
+        from django.core.cache import get_cache
+        return get_cache(name)
+    return caches[name]
+
+
+def create_cache(name=None):
+    """
+    Returns fragment cache with backend given by name (see FORME_CACHE
+    setting), None when cache is disabled.
+
+    """
+    from forme import settings
+    if name is None:
+        name = settings.FORME_CACHE
+    if not name:
+        return None
+
+    if name == 'lru':
+        backend = LRUCache(settings.FORME_CACHE_MAX_ENTRIES,
+                           settings.FORME_CACHE_MAX_SIZE)
+    else:
+        backend = get_django_cache(name)
+    return FragmentCache(backend)
+
+
+_fragments = missing
+
+
+def get_cache():
+    """
+    Returns fragment cache configured in settings, None when it's disabled.
+
+    """
+    global _fragments
+    if _fragments is missing:
+        _fragments = create_cache()
+    return _fragments
+
+
+_plans = missing
+
+
+def get_plan_cache():
+    """
+    Returns cache of render plans, None when it's disabled.
+
+    """
+    global _plans
+    if _plans is missing:
+        from forme import settings
+        if settings.FORME_PLAN_CACHE:
+            _plans = PlanCache(settings.FORME_PLAN_CACHE)
+        else:
+            _plans = None
+    return _plans
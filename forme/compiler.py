@@ -0,0 +1,360 @@
+# coding: utf-8
+"""
+Compiler of styles into Python render functions.
+
+Forms rendered by ``{% forme form %}`` without inline templates are rendered
+only by templates of the style. Such style is compiled once into a function,
+which renders the same output as nodes: static text is joined into
+constants, fields are iterated directly and variables pushed by forme tags
+are local variables instead of context lookups.
+
+Only templates consisting of text, comments, ``{{ variable }}`` without
+filters and attributes, simple ``for`` loops and forme tags without targets
+are compiled. Other styles are rendered by nodes.
+
+"""
+from __future__ import unicode_literals
+import re
+import threading
+
+from django import template
+from django.template import defaulttags
+from django.utils import six
+from django.utils.safestring import mark_safe
+
+try:
+    from django.template.base import render_value_in_context
+except ImportError:
+    # Dj1.4 - Dj1.5
+    from django.template.base import (
+        _render_value_in_context as render_value_in_context)
+
+from forme.context import Label, LazyList, get_form_fields, update_context
+from forme.nodes import FormeNodeBase
+from forme.styles import Default, Style
+from forme.widgets import cached_options
+
+identifier_re = re.compile(r'^\w+$')
+
+# Nodes which always render empty string.
+empty_nodes = (defaulttags.CommentNode, defaulttags.LoadNode)
+
+# Locks of styles which are being compiled, by id of style.
+_compile_locks = {}
+_lock = threading.Lock()
+
+
+class NotCompilable(Exception):
+    pass
+
+
+def render_variable(value, variable, context):
+    """
+    Renders value of variable the same way as VariableNode.
+
+    """
+    if callable(value):
+        # Let Django decide whether to call it.
+        value = variable.resolve({variable.var: value})
+    return render_value_in_context(value, context)
+
+
+def resolve_sequence(value, variable):
+    """
+    Returns sequence iterated by ForNode.
+
+    """
+    if callable(value):
+        value = variable.resolve({variable.var: value})
+    if value is None:
+        return []
+    if not hasattr(value, '__len__'):
+        value = list(value)
+    return value
+
+
+def render_node(node, context, push):
+    """
+    Renders node with variables pushed into context. Compiled code uses it
+    when node refuses to render (e.g. missing field), so the same error is
+    raised.
+
+    """
+    with update_context(context, push):
+        return node.render(context)
+
+
+class StyleCompiler(object):
+    """
+    Generates source of render function of style. Function is called with
+    context, rendered form and cache of select options (see
+    forme.widgets.ChoicesCache) and returns the same output as style's forme
+    template rendered by nodes.
+
+    """
+    max_depth = 30
+
+    def __init__(self, style):
+        self.style = style
+        # Context used for template lookups, which depend only on style.
+        self.context = template.Context({'forme_style': style})
+        self.namespace = {
+            'Label': Label,
+            'LazyList': LazyList,
+            'cached_options': cached_options,
+            'get_form_fields': get_form_fields,
+            'mark_safe': mark_safe,
+            'render_node': render_node,
+            'render_variable': render_variable,
+            'resolve_sequence': resolve_sequence,
+        }
+        self.lines = []
+        self.text = []
+        self.counter = 0
+
+    def compile(self):
+        flat = self.style.flatten()
+        if flat.variables:
+            raise NotCompilable('Style has variable targets.')
+
+        self.emit(0, 'def render(context, form, choices_cache):')
+        self.emit(1, 'output = []')
+        self.emit(1, 'append = output.append')
+        self.emit(1, 'fields = get_form_fields(context, form)')
+        self.compile_template(flat.get(('forme', Default)),
+                              {'form': 'form', 'forme_fields': 'fields'}, 1, 0)
+        self.flush(1)
+        self.emit(1, "return mark_safe(''.join(output))")
+
+        source = '\n'.join(self.lines)
+        six.exec_(compile(source, '<forme style>', 'exec'), self.namespace)
+        render = self.namespace['render']
+        render.source = source
+        return render
+
+    def emit(self, indent, line):
+        self.lines.append('    ' * indent + line)
+
+    def flush(self, indent):
+        if self.text:
+            self.emit(indent, 'append({0})'.format(
+                self.constant(''.join(self.text))))
+            self.text = []
+
+    def name(self, prefix):
+        self.counter += 1
+        return '{0}_{1}'.format(prefix, self.counter)
+
+    def constant(self, value):
+        name = self.name('const')
+        self.namespace[name] = value
+        return name
+
+    def compile_template(self, tmpl, scope, indent, depth):
+        if isinstance(tmpl, Style):
+            tmpl = tmpl.template
+        # Empty templates of styles render None.
+        if not tmpl or depth > self.max_depth:
+            raise NotCompilable('Missing template.')
+
+        for node in tmpl:
+            self.compile_node(node, scope, indent, depth)
+
+    def compile_block(self, tmpl, scope, indent, depth):
+        """
+        Compiles template as body of block statement.
+
+        """
+        lines = len(self.lines)
+        self.compile_template(tmpl, scope, indent, depth)
+        self.flush(indent)
+        if len(self.lines) == lines:
+            self.emit(indent, 'pass')
+
+    def compile_node(self, node, scope, indent, depth):
+        if isinstance(node, template.TextNode):
+            self.text.append(node.s)
+        elif isinstance(node, empty_nodes):
+            pass
+        elif isinstance(node, template.VariableNode):
+            value, variable = self.get_variable(node.filter_expression, scope)
+            self.flush(indent)
+            self.emit(indent, 'append(render_variable({0}, {1}, context))'
+                      .format(value, variable))
+        elif isinstance(node, defaulttags.ForNode):
+            self.compile_for(node, scope, indent, depth)
+        elif isinstance(node, FormeNodeBase):
+            if node.target:
+                raise NotCompilable('Targets are resolved by nodes.')
+            method = getattr(self, 'compile_' + node.tag_name, None)
+            if method is None:
+                raise NotCompilable(node)
+            method(node, scope, indent, depth + 1)
+        else:
+            raise NotCompilable(node)
+
+    def get_variable(self, expression, scope):
+        """
+        Returns names of local variable and Variable object of expression,
+        which must be single variable pushed by forme tags or loop.
+
+        """
+        variable = expression.var
+        if (expression.filters or
+                not isinstance(variable, template.Variable) or
+                not variable.lookups or len(variable.lookups) != 1 or
+                variable.translate or variable.lookups[0] not in scope):
+            raise NotCompilable(expression)
+        return scope[variable.lookups[0]], self.constant(variable)
+
+    def get_template(self, node):
+        """
+        Returns template of node, which doesn't depend on context.
+
+        """
+        if node.nodelist:
+            return node.nodelist
+        if node.templates is None:
+            node.build_templates()
+        for templates in (node.templates, node.root.styles.flatten(),
+                          self.style.flatten()):
+            if templates.variables:
+                raise NotCompilable('Style has variable targets.')
+        return node.find_node_template(self.context)
+
+    def require(self, node, name, scope, indent):
+        """
+        Returns local variable which node reads from context. Node renders
+        itself (and fails) when the variable is empty.
+
+        """
+        if name not in scope:
+            raise NotCompilable(node)
+        self.flush(indent)
+        self.emit(indent, 'if not {0}:'.format(scope[name]))
+        self.emit(indent + 1, 'render_node({0}, context, {{{1!r}: {2}}})'
+                  .format(self.constant(node), str(name), scope[name]))
+        return scope[name]
+
+    def push(self, node, tmpl, scope, name, value, indent):
+        """
+        Returns scope with variable, which is assigned only when template
+        reads it. Values which are local variables already aren't assigned.
+
+        """
+        if not node.reads_variable(tmpl, name):
+            return scope
+        if identifier_re.match(value):
+            local = value
+        else:
+            local = self.name(name)
+            self.emit(indent, '{0} = {1}'.format(local, value))
+        scope = dict(scope)
+        scope[name] = local
+        return scope
+
+    def compile_for(self, node, scope, indent, depth):
+        if (len(node.loopvars) != 1 or node.is_reversed or
+                node.nodelist_empty):
+            raise NotCompilable(node)
+        value, variable = self.get_variable(node.sequence, scope)
+        item = self.name('item')
+        self.flush(indent)
+        self.emit(indent, 'for {0} in resolve_sequence({1}, {2}):'
+                  .format(item, value, variable))
+        scope = dict(scope)
+        scope[node.loopvars[0]] = item
+        self.compile_block(node.nodelist_loop, scope, indent + 1, depth + 1)
+
+    def compile_hiddenfields(self, node, scope, indent, depth):
+        self.require(node, 'form', scope, indent)
+        tmpl = self.get_template(node)
+        fields = scope['forme_fields']
+        self.emit(indent, 'if {0}.has_hidden_fields():'.format(fields))
+        scope = self.push(node, tmpl, scope, 'hidden_fields',
+                          'LazyList(lambda: {0}.hidden_fields)'.format(fields),
+                          indent + 1)
+        self.compile_block(tmpl, scope, indent + 1, depth)
+
+    def compile_nonfielderrors(self, node, scope, indent, depth):
+        form = self.require(node, 'form', scope, indent)
+        tmpl = self.get_template(node)
+        errors = self.name('errors')
+        self.emit(indent, '{0} = {1}.non_field_errors()'.format(errors, form))
+        self.emit(indent, 'if {0}:'.format(errors))
+        scope = self.push(node, tmpl, scope, 'non_field_errors', errors,
+                          indent + 1)
+        self.compile_block(tmpl, scope, indent + 1, depth)
+
+    def compile_fieldset(self, node, scope, indent, depth):
+        self.require(node, 'form', scope, indent)
+        tmpl = self.get_template(node)
+        fieldset = self.name('fieldset')
+        self.emit(indent, '{0} = {1}.fieldset'.format(
+            fieldset, scope['forme_fields']))
+        scope = dict(scope)
+        scope['fieldset'] = fieldset
+        self.compile_template(tmpl, scope, indent, depth)
+
+    def compile_field(self, node, scope, indent, depth):
+        fieldset = self.require(node, 'fieldset', scope, indent)
+        tmpl = self.get_template(node)
+        field = self.name('field')
+        self.emit(indent, 'for {0} in {1}:'.format(field, fieldset))
+        scope = dict(scope)
+        scope['field'] = field
+        self.compile_block(tmpl, scope, indent + 1, depth)
+
+    def compile_errors(self, node, scope, indent, depth):
+        field = self.require(node, 'field', scope, indent)
+        tmpl = self.get_template(node)
+        errors = self.name('errors')
+        self.emit(indent, '{0} = {1}.get_errors({2})'
+                  .format(errors, scope['forme_fields'], field))
+        self.emit(indent, 'if {0}:'.format(errors))
+        scope = self.push(node, tmpl, scope, 'errors', errors, indent + 1)
+        self.compile_block(tmpl, scope, indent + 1, depth)
+
+    def compile_label(self, node, scope, indent, depth):
+        field = self.require(node, 'field', scope, indent)
+        tmpl = self.get_template(node)
+        scope = self.push(node, tmpl, scope, 'label',
+                          'Label.create({0})'.format(field), indent)
+        self.compile_template(tmpl, scope, indent, depth)
+
+    def compile_input(self, node, scope, indent, depth):
+        if 'field' not in scope:
+            raise NotCompilable(node)
+        tmpl = self.get_template(node)
+        self.flush(indent)
+        self.emit(indent, 'with cached_options({0}, choices_cache):'
+                  .format(scope['field']))
+        self.compile_block(tmpl, scope, indent + 1, depth)
+
+
+def get_renderer(style):
+    """
+    Returns compiled render function of style, None when style can't be
+    compiled. Function is compiled once and stored in style.
+
+    """
+    # Forme tags without inline templates overlay the shared style without
+    # any changes.
+    while style.base is not None and style.is_empty():
+        style = style.base
+
+    # Each style is compiled once, concurrent renders of the same style wait
+    # for it.
+    if getattr(style, 'renderer', None) is None:
+        with _lock:
+            lock = _compile_locks.setdefault(id(style), threading.Lock())
+        with lock:
+            if getattr(style, 'renderer', None) is None:
+                try:
+                    style.renderer = StyleCompiler(style).compile()
+                except NotCompilable:
+                    style.renderer = False
+        with _lock:
+            if _compile_locks.get(id(style)) is lock:
+                del _compile_locks[id(style)]
+    return style.renderer or None
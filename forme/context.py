@@ -1,25 +1,262 @@
 # coding: utf-8
 from __future__ import unicode_literals
-from collections import namedtuple
-from contextlib import contextmanager
 
 from django.utils.encoding import python_2_unicode_compatible
+from django.utils.functional import cached_property
 
+missing = object()
 
-@contextmanager
-def update_context(context, push):
-    context.update(push)
-    yield
-    context.pop()
+
+class RenderFrame(dict):
+    """
+    Context dict pushed once by forme tag. Nested forme nodes set their
+    variables (fieldset, field, label, …) directly in the frame instead of
+    pushing new dicts into context.
+
+    """
+    def __init__(self, *args, **kwargs):
+        super(RenderFrame, self).__init__(*args, **kwargs)
+        # Resolved variable targets of styles, see Templates.resolve.
+        self.targets = {}
+
+
+class update_context(object):
+    """
+    Pushes variables into context. Context is restored afterwards, even when
+    exception is raised.
+
+    When render frame is on top of context, variables are set directly
+    in it.
+
+    """
+    def __init__(self, context, push):
+        self.context = context
+        self.push = push
+
+    def __enter__(self):
+        dicts = self.context.dicts
+        self.depth = len(dicts)
+        frame = dicts[-1]
+        if isinstance(frame, RenderFrame):
+            self.frame = frame
+            self.saved = [(key, frame.get(key, missing)) for key in self.push]
+            frame.update(self.push)
+        else:
+            self.frame = None
+            self.context.update(self.push)
+
+    def __exit__(self, *exc_info):
+        del self.context.dicts[self.depth:]
+        if self.frame is not None:
+            for key, value in self.saved:
+                if value is missing:
+                    del self.frame[key]
+                else:
+                    self.frame[key] = value
+
+
+class render_frame(update_context):
+    """
+    Pushes new render frame into context.
+
+    """
+    def __enter__(self):
+        self.depth = len(self.context.dicts)
+        self.frame = None
+        self.context.dicts.append(RenderFrame(self.push))
+
+
+class bind_template(object):
+    """
+    Binds rendered template to context like Template.render. Render context
+    is pushed and on Dj1.8+ template is bound to context, e.g. so
+    RequestContext runs context processors.
+
+    """
+    def __init__(self, template, context):
+        self.template = template
+        self.context = context
+
+    def __enter__(self):
+        render_context = self.context.render_context
+        if hasattr(render_context, 'push_state'):
+            # Dj1.11+
+            self.state = render_context.push_state(self.template)
+            self.state.__enter__()
+        else:
+            self.state = None
+            render_context.push()
+
+        self.binding = None
+        if getattr(self.context, 'template', missing) is None:
+            # Dj1.8+, only top level template is bound.
+            self.binding = self.context.bind_template(self.template)
+            self.binding.__enter__()
+            self.context.template_name = self.template.name
+
+    def __exit__(self, *exc_info):
+        if self.binding is not None:
+            self.binding.__exit__(*exc_info)
+        if self.state is not None:
+            self.state.__exit__(*exc_info)
+        else:
+            self.context.render_context.pop()
 
 
 @python_2_unicode_compatible
-class Label(namedtuple('LabelDict', 'id label tag')):
+class Label(object):
+    """
+    Label of field. Attributes are evaluated lazily on first access, so
+    label tag is rendered only when template uses it.
+
+    """
+    def __init__(self, field):
+        self.field = field
+
     def __str__(self):
         return self.tag
 
+    def __eq__(self, other):
+        return (isinstance(other, Label)
+                and (self.id, self.label, self.tag)
+                == (other.id, other.label, other.tag))
+
+    def __ne__(self, other):
+        return not self == other
+
     @classmethod
     def create(cls, field):
-        return cls(id=field.id_for_label,
-                   label=field.label,
-                   tag=field.label_tag())
+        return cls(field)
+
+    @cached_property
+    def id(self):
+        return self.field.id_for_label
+
+    @cached_property
+    def label(self):
+        return self.field.label
+
+    @cached_property
+    def tag(self):
+        return self.field.label_tag()
+
+
+@python_2_unicode_compatible
+class LazyList(object):
+    """
+    List which is evaluated on first access.
+
+    """
+    def __init__(self, func):
+        self.func = func
+
+    def __str__(self):
+        return '{0}'.format(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    @cached_property
+    def items(self):
+        return list(self.func())
+
+
+class Fieldset(list):
+    """
+    List of bound fields. Index of fields by name is built on first access
+    and shared by all field nodes rendering this fieldset.
+
+    """
+    @cached_property
+    def index(self):
+        return dict((field.name, field) for field in self)
+
+
+class RenderPlan(object):
+    """
+    Structure of render which depends only on shape of form: order of
+    fields, hidden and visible fields and templates of nodes. Plan is shared
+    by renders of all forms with the same shape, see FormeNode.get_plan.
+
+    """
+    def __init__(self, form, style=None):
+        self.names = list(form.fields)
+        self.hidden = [name for name, field in form.fields.items()
+                       if field.widget.is_hidden]
+        hidden = set(self.hidden)
+        self.visible = [name for name in self.names if name not in hidden]
+        # Style of forme tag, templates of nodes are cached only when they
+        # don't depend on context variables.
+        self.style = style
+        if style is not None and style.flatten().variables:
+            self.style = None
+        # Templates of nodes, filled while rendering. Lookups are
+        # idempotent, concurrent renders may only store the same template.
+        self.templates = {}
+
+
+class FormFields(object):
+    """
+    Bound fields of form, created once per render by forme tag and shared by
+    all nodes rendering the form. Each bound field and its errors are
+    computed only once.
+
+    """
+    def __init__(self, form, plan=None):
+        self.form = form
+        self.plan = plan if plan is not None else RenderPlan(form)
+        self.index = {}
+        self.errors = {}
+
+    def __getitem__(self, name):
+        try:
+            return self.index[name]
+        except KeyError:
+            # Form raises error for unknown fields.
+            field = self.index[name] = self.form[name]
+            return field
+
+    def __iter__(self):
+        return iter(self.fieldset)
+
+    @cached_property
+    def fieldset(self):
+        return Fieldset(self[name] for name in self.plan.names)
+
+    @cached_property
+    def hidden_fields(self):
+        return [self[name] for name in self.plan.hidden]
+
+    @cached_property
+    def visible_fields(self):
+        return [self[name] for name in self.plan.visible]
+
+    def has_hidden_fields(self):
+        return bool(self.plan.hidden)
+
+    def get_errors(self, field):
+        if getattr(field, 'form', None) is not self.form:
+            return getattr(field, 'errors', None)
+        try:
+            return self.errors[field.name]
+        except KeyError:
+            errors = self.errors[field.name] = field.errors
+            return errors
+
+
+def get_form_fields(context, form):
+    """
+    Returns bound fields of form pushed by forme tag, new ones when form
+    isn't rendered by forme tag.
+
+    """
+    fields = context.get('forme_fields')
+    if fields is None or fields.form is not form:
+        fields = FormFields(form)
+    return fields
@@ -0,0 +1,367 @@
+# coding: utf-8
+"""
+Jinja2 extension providing forme tags.
+
+Tags have the same syntax as Django template tags::
+
+  env = Environment(loader=PackageLoader('forme', 'jinja2'),
+                    extensions=['forme.jinja.FormeExtension'])
+  env.from_string('{% forme form %}').render(form=form)
+
+Tags are parsed by the same grammar and into the same nodes as Django
+template tags, so styles are resolved and forms rendered by the same code.
+Templates of tags are translated into Django nodes when possible (text,
+``{{ variable }}`` and simple ``for`` loops), so styles are compiled by
+forme.compiler as well. Other parts of templates are compiled by Jinja2 and
+read variables pushed by forme tags from context.
+
+Styles configured in ``FORME_STYLES`` are loaded from templates of Jinja2
+environment.
+
+"""
+from __future__ import unicode_literals, absolute_import
+import hashlib
+import threading
+
+from django import template
+from django.template import defaulttags
+from django.utils.encoding import force_text
+from jinja2 import nodes
+from jinja2.exceptions import TemplateRuntimeError
+from jinja2.ext import Extension
+from jinja2.parser import Parser
+from markupsafe import Markup
+
+from forme import loader, settings
+from forme.cache import LRUCache
+from forme.context import update_context
+from forme.nodes import FormeNode, node_factory, tag_map
+from forme.parser import parse_action, parse_style, parse_target
+
+# Name of Jinja2 variable with Django context of rendered forme tag.
+context_variable = '_forme_context'
+
+
+def get_context_reference():
+    # Jinja2 < 2.11 passes context without local variables (e.g. loops).
+    return getattr(nodes, 'DerivedContextReference', nodes.ContextReference)()
+
+
+class ContextProxy(object):
+    """
+    Read-only mapping of Django context, used as parent of Jinja2 context,
+    so templates read variables pushed by forme tags. Globals of Jinja2
+    template are looked up last.
+
+    """
+    def __init__(self, context, globals):
+        self.context = context
+        self.globals = globals
+
+    def __contains__(self, key):
+        return (key == context_variable or key in self.context or
+                key in self.globals)
+
+    def __getitem__(self, key):
+        if key == context_variable:
+            return self.context
+        try:
+            return self.context[key]
+        except KeyError:
+            return self.globals[key]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        keys = set(self.globals)
+        for variables in self.context.dicts:
+            keys.update(variables)
+        keys.add(context_variable)
+        return list(keys)
+
+
+class JinjaNode(template.Node):
+    """
+    Renders part of Jinja2 template, which can't be translated into Django
+    nodes.
+
+    """
+    def __init__(self, tmpl):
+        self.template = tmpl
+
+    def __repr__(self):
+        return '<Jinja node>'
+
+    def render(self, context):
+        tmpl = self.template
+        jinja_context = tmpl.new_context(ContextProxy(context, tmpl.globals),
+                                         shared=True)
+        return ''.join(tmpl.root_render_func(jinja_context))
+
+
+class ParserState(object):
+    """
+    Forme tags parsed by Jinja2 parser.
+
+    """
+    def __init__(self):
+        # Depth of nested forme tags.
+        self.depth = 0
+        # Output nodes of parsed tags by their id, (output, node, key)
+        self.markers = {}
+        # Top level forme nodes
+        self.nodes = []
+        # Source of parsed template, see FormeExtension.preprocess.
+        self.source = None
+
+
+def get_state(parser):
+    state = getattr(parser, 'forme_state', None)
+    if state is None:
+        state = parser.forme_state = ParserState()
+    return state
+
+
+class FormeExtension(Extension):
+    """
+    Jinja2 extension with forme tags. Each tag is parsed into forme node,
+    which is rendered by Django context built from Jinja2 context.
+
+    Nodes of top level tags are kept in extension by signature, identical
+    tags in all templates share one node tree (see FormeParser.parse).
+    Number of nodes is limited by FORME_JINJA_CACHE_MAX_ENTRIES. Compiled
+    templates pass their source to forme tags, so nodes which were evicted
+    or weren't parsed in this process (templates loaded from bytecode
+    cache) are parsed again.
+
+    """
+    tags = set(tag_map)
+
+    def __init__(self, environment):
+        super(FormeExtension, self).__init__(environment)
+        self.nodes = LRUCache(
+            max_entries=settings.FORME_JINJA_CACHE_MAX_ENTRIES)
+        self.styles = loader.StyleRegistry(load_style=self.load_style)
+        self._local = threading.local()
+
+    def preprocess(self, source, name, filename=None):
+        # Called right before template is parsed.
+        self._local.source = source
+        return source
+
+    def parse(self, parser):
+        token = next(parser.stream)
+        tag_name, lineno = token.value, token.lineno
+
+        parts = []
+        while parser.stream.current.type != 'block_end':
+            parts.append(self.parse_part(parser))
+        signature = [tag_name] + parts
+        action, paired = parse_action(tag_name, parts)
+        style = parse_style(tag_name, parts)
+        target = parse_target(parts)
+
+        state = get_state(parser)
+        if state.source is None:
+            state.source = getattr(self._local, 'source', None)
+        body = []
+        if paired:
+            state.depth += 1
+            try:
+                body = parser.parse_statements(['name:end' + tag_name],
+                                               drop_needle=True)
+            finally:
+                state.depth -= 1
+
+        # Node tree depends on default style too.
+        if tag_name == 'forme' and target:
+            signature.append(settings.FORME_DEFAULT_STYLE)
+        key = hashlib.sha1(repr((signature, self.dump(body, state))
+                                ).encode('utf-8')).hexdigest()
+
+        # Nested tags are linked to their parents, so they can't be shared.
+        node = self.nodes.get(key) if not state.depth else None
+        if node is None:
+            try:
+                nodelist = self.translate(body, parser) if body else None
+                kwargs = {'style_target': style} if style is not None else {}
+                node = node_factory(tag_name, target, action, nodelist,
+                                    styles_config=self.styles, **kwargs)
+            except template.TemplateSyntaxError as e:
+                parser.fail(force_text(e), lineno)
+            node.signature = key
+            if not state.depth:
+                self.nodes.set(key, node)
+
+        output = nodes.Output([self.call_method(
+            '_render', [nodes.Const(key), nodes.Const(state.source),
+                        get_context_reference()],
+            lineno=lineno)], lineno=lineno)
+        state.markers[id(output)] = (output, node, key)
+        if not state.depth:
+            state.nodes.append(node)
+        return output
+
+    def dump(self, item, state):
+        """
+        Returns structure of parsed body as nested tuples. Nested forme tags
+        are replaced by their keys, source of template passed to them isn't
+        part of the structure, so identical tags in different templates have
+        the same key.
+
+        """
+        if isinstance(item, nodes.Node):
+            marker = state.markers.get(id(item))
+            if marker is not None:
+                return marker[2]
+            return (item.__class__.__name__,) + tuple(
+                (name, self.dump(value, state))
+                for name, value in item.iter_fields())
+        elif isinstance(item, (list, tuple)):
+            return [self.dump(value, state) for value in item]
+        return item
+
+    def parse_part(self, parser):
+        """
+        Returns part of tag as it would be written in Django template tag,
+        i.e. either quoted string or variable.
+
+        """
+        token = parser.stream.current
+        if token.type == 'string':
+            next(parser.stream)
+            return '"{0}"'.format(token.value)
+        elif token.type == 'name':
+            next(parser.stream)
+            names = [token.value]
+            while parser.stream.skip_if('dot'):
+                names.append(parser.stream.expect('name').value)
+            return '.'.join(names)
+        parser.fail('Unexpected token "{0}" in forme tag'.format(token),
+                    token.lineno)
+
+    def translate(self, body, parser):
+        """
+        Returns nodelist of forme tag. Nested forme tags are replaced by
+        their nodes, other nodes are translated into Django nodes or
+        compiled by Jinja2.
+
+        """
+        state = get_state(parser)
+        nodelist = template.NodeList()
+        fragment = []
+
+        for item in self.iter_items(body, state):
+            marker = state.markers.get(id(item))
+            if marker is not None:
+                node = marker[1]
+            else:
+                node = self.translate_node(item, parser)
+
+            if node is None:
+                fragment.append(item)
+                continue
+            if fragment:
+                nodelist.append(self.compile_fragment(fragment, parser))
+                fragment = []
+            nodelist.append(node)
+
+        if fragment:
+            nodelist.append(self.compile_fragment(fragment, parser))
+        return nodelist
+
+    def iter_items(self, body, state):
+        """
+        Yields statements and expressions of output nodes.
+
+        """
+        for item in body:
+            if (isinstance(item, nodes.Output) and
+                    id(item) not in state.markers):
+                for expression in item.nodes:
+                    yield expression
+            else:
+                yield item
+
+    def translate_node(self, item, parser):
+        """
+        Returns Django node which renders the same output as Jinja2 node,
+        None if there isn't any.
+
+        """
+        if isinstance(item, nodes.TemplateData):
+            return template.TextNode(item.data)
+        elif isinstance(item, nodes.Name) and self.is_variable(item):
+            return template.VariableNode(
+                template.FilterExpression(item.name, None))
+        elif (isinstance(item, nodes.For) and
+                isinstance(item.target, nodes.Name) and
+                self.is_variable(item.target) and
+                isinstance(item.iter, nodes.Name) and
+                self.is_variable(item.iter) and
+                not item.else_ and item.test is None and
+                not item.recursive):
+            nodelist = self.translate(item.body, parser)
+            if any(isinstance(node, JinjaNode) for node in nodelist):
+                return None
+            return defaulttags.ForNode(
+                [item.target.name],
+                template.FilterExpression(item.iter.name, None),
+                False, nodelist)
+        return None
+
+    def is_variable(self, item):
+        # Output of expressions is finalized by Jinja2 only.
+        return (self.environment.finalize is None and
+                not item.name.startswith('_') and item.name != 'loop')
+
+    def compile_fragment(self, items, parser):
+        state = get_state(parser)
+        body = [nodes.Output([item], lineno=item.lineno)
+                if isinstance(item, nodes.Expr) else item
+                for item in items]
+        tree = nodes.Template(body, lineno=1)
+        tree.set_environment(self.environment)
+
+        # Forme tags nested in other Jinja2 tags are rendered on their own.
+        for output in tree.find_all(nodes.Output):
+            marker = state.markers.get(id(output))
+            if marker is not None and self.nodes.get(marker[2]) is None:
+                self.nodes.set(marker[2], marker[1])
+
+        code = self.environment.compile(tree, parser.name, parser.filename)
+        tmpl = self.environment.template_class.from_code(
+            self.environment, code, self.environment.make_globals(None))
+        return JinjaNode(tmpl)
+
+    def load_style(self, template_name):
+        source, filename, uptodate = self.environment.loader.get_source(
+            self.environment, template_name)
+        parser = Parser(self.environment, source, template_name, filename)
+        parser.parse()
+        forme_nodes = [node for node in get_state(parser).nodes
+                       if isinstance(node, FormeNode)]
+        return loader.get_style(forme_nodes, template_name)
+
+    def _render(self, key, source, context):
+        node = self.nodes.get(key)
+        if node is None:
+            # Evicted or compiled by another process, parse template again.
+            Parser(self.environment, source, context.name).parse()
+            node = self.nodes.get(key)
+        if node is None:
+            raise TemplateRuntimeError(
+                'Forme tag {0} isn\'t defined by source of template {1}.'
+                .format(key, context.name))
+
+        django_context = context.get(context_variable)
+        if django_context is None:
+            django_context = template.Context(
+                dict(context.get_all()),
+                autoescape=context.eval_ctx.autoescape)
+            return Markup(node.render(django_context))
+
+        # Nested in Jinja2 tag (e.g. loop), push its local variables.
+        with update_context(django_context, dict(context.vars)):
+            return Markup(node.render(django_context))
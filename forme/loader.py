@@ -1,23 +1,68 @@
 # coding: utf-8
 from __future__ import unicode_literals
 import copy
+import gc
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+from multiprocessing.pool import ThreadPool
+from timeit import default_timer
 
-from django.template import Template, loader
-from django.utils.functional import SimpleLazyObject
+import django
+from django.template import (Node, NodeList, Template, TemplateDoesNotExist,
+                             TextNode, defaulttags, loader)
+from django.utils import six
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.six.moves import cPickle as pickle
 
-from forme import settings
+try:
+    from importlib import import_module
+except ImportError:
+    # Py2.6
+    from django.utils.importlib import import_module
+
+import forme
+from forme import compiler, settings
+from forme.cache import LRUCache, get_plan_cache
 from forme.exceptions import FormeInvalidTemplate
-from forme.nodes import FormeNode
+from forme.nodes import FormeNode, FormeNodeBase
+from forme.parser import get_parse_cache
+from forme.styles import Style
 
 
-def load_style(template_name):
+def load_style(template_name, compact=None):
+    """
+    Returns style defined by template. Templates of style are compacted
+    when *compact* is True (FORME_COMPACT_STYLES by default), see
+    compact_style.
+
+    """
     # template_name can be either path to template of Template object
     if isinstance(template_name, Template):
         template = template_name
     else:
         template = loader.get_template(template_name)
-    forme_node = template.nodelist.get_nodes_by_type(FormeNode)
+    forme_nodes = template.nodelist.get_nodes_by_type(FormeNode)
+    if compact is None:
+        compact = settings.FORME_COMPACT_STYLES
+    if compact:
+        # Template is shared, e.g. by cached template loader or parse cache.
+        memo = {}
+        forme_nodes = [copy_template(node, memo) for node in forme_nodes]
+    style = get_style(forme_nodes, template_name)
+    if compact:
+        compact_style(style)
+    return style
+
 
+def get_style(forme_node, template_name):
+    """
+    Returns style defined by forme nodes found in style template. Template
+    must contain exactly one forme tag.
+
+    """
     if not forme_node:
         raise FormeInvalidTemplate('"forme" tag not found in {tmpl}'
                                    .format(tmpl=template_name))
@@ -26,27 +71,624 @@ def load_style(template_name):
             'Only one "forme" tag can be present. {count} found in {tmpl}'
             .format(count=len(forme_node), tmpl=template_name))
 
-    return forme_node[0].styles
+    style = forme_node[0].styles
+    style.signature = forme_node[0].signature
+    return style
+
+
+def copy_template(value, memo):
+    """
+    Returns copy of nodes, nodelists and styles, which can be modified
+    without affecting the original template. Other objects (variables,
+    filter expressions, origins, …) are shared with the original.
+
+    """
+    key = id(value)
+    if key in memo:
+        return memo[key]
+
+    if isinstance(value, (Node, Style)):
+        result = memo[key] = copy.copy(value)
+        for name, item in value.__dict__.items():
+            setattr(result, name, copy_template(item, memo))
+        if isinstance(value, FormeNodeBase):
+            # Tables of templates refer to copied styles, see FormeNode.
+            result.templates = None
+        if isinstance(value, FormeNode):
+            result.empty_forms = LRUCache(
+                max_entries=value.max_empty_forms)
+            result.cacheable = None
+        if isinstance(value, Style):
+            result._flat = None
+            result.renderer = None
+            result._overlays = {}
+    elif isinstance(value, dict):
+        result = memo[key] = copy.copy(value)
+        for name, item in value.items():
+            result[name] = copy_template(item, memo)
+    elif isinstance(value, list):
+        result = memo[key] = copy.copy(value)
+        result[:] = [copy_template(item, memo) for item in value]
+    elif type(value) is tuple:
+        result = memo[key] = tuple(copy_template(item, memo)
+                                   for item in value)
+    else:
+        result = value
+    return result
+
+
+# Nodes whose nodelists are compacted too. Output of other tags (e.g. filter
+# tag or custom tags rendering <pre> or JavaScript) might depend on
+# whitespace.
+compactable_nodes = (FormeNodeBase,) + tuple(
+    getattr(defaulttags, name) for name in (
+        'AutoEscapeControlNode', 'ForNode', 'IfChangedNode', 'IfEqualNode',
+        'IfNode', 'SpacelessNode', 'WithNode')
+    if hasattr(defaulttags, name))
+
+
+def compact_nodelist(nodelist):
+    """
+    Removes comments from nodelist, collapses whitespace-only text into
+    single whitespace and merges adjacent text into one node. Nodelists of
+    compactable nodes are compacted too, nodelists are modified in place.
+
+    """
+    nodes = []
+    for node in nodelist:
+        if isinstance(node, defaulttags.CommentNode):
+            continue
+        if isinstance(node, TextNode):
+            text = node.s
+            if nodes and isinstance(nodes[-1], TextNode):
+                text = nodes[-1].s + text
+                node = nodes.pop()
+            if not text.strip():
+                text = '\n' if '\n' in text else ' '
+            if text != node.s:
+                node = copy.copy(node)
+                node.s = text
+        elif isinstance(node, compactable_nodes):
+            compact_children(node.__dict__.values())
+        nodes.append(node)
+    nodelist[:] = nodes
+
+
+def compact_children(values):
+    for value in values:
+        if isinstance(value, NodeList):
+            compact_nodelist(value)
+        elif isinstance(value, (list, tuple)):
+            compact_children(value)
+
+
+def compact_style(style):
+    """
+    Compacts templates of style and styles of nested forme tags, so nodes
+    render fewer text nodes and less whitespace. Markup is the same except
+    whitespace between tags, which mustn't matter (e.g. inside <pre>).
+    Templates are modified in place, load_style compacts their copy.
+
+    """
+    seen = set()
+    nodes = []
+    nodelists = [tmpl.template for tmpl in style.flatten().values()]
+    while nodelists:
+        nodelist = nodelists.pop()
+        if nodelist is None or id(nodelist) in seen:
+            continue
+        seen.add(id(nodelist))
+
+        compact_nodelist(nodelist)
+        for node in nodelist.get_nodes_by_type(FormeNodeBase):
+            nodes.append(node)
+            for tmpl in node.styles.flatten().values():
+                nodelists.append(tmpl.template)
+
+    # Templates of nested nodes are looked up in compacted styles.
+    for node in nodes:
+        node.build_templates()
+
+
+def get_template_loaders():
+    try:
+        from django.template.engine import Engine
+    except ImportError:
+        # Dj1.4 - Dj1.7
+        from django.conf import settings as django_settings
+        template_loaders = [loader.find_template_loader(name)
+                            for name in django_settings.TEMPLATE_LOADERS]
+    else:
+        template_loaders = Engine.get_default().template_loaders
+
+    for template_loader in template_loaders:
+        # Cached loader only wraps other loaders.
+        for template_loader in getattr(template_loader, 'loaders',
+                                       [template_loader]):
+            if template_loader is not None:
+                yield template_loader
+
+
+def get_template_source(template_name):
+    """
+    Returns source of template, None when template can't be found.
+
+    """
+    for template_loader in get_template_loaders():
+        try:
+            if hasattr(template_loader, 'get_contents'):
+                # Dj1.9+
+                for origin in template_loader.get_template_sources(
+                        template_name):
+                    try:
+                        return template_loader.get_contents(origin)
+                    except TemplateDoesNotExist:
+                        pass
+            else:
+                source, origin = template_loader.load_template_source(
+                    template_name)
+                return source
+        except TemplateDoesNotExist:
+            pass
+    return None
+
+
+def get_digest(source):
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+def get_included_templates(style):
+    """
+    Returns names of templates which were loaded when templates of style
+    were parsed, e.g. by {% include "name" %} on Dj1.4 - Dj1.6.
+
+    """
+    names = set()
+    seen = set()
+    nodelists = [tmpl.template for tmpl in style.flatten().values()]
+    while nodelists:
+        nodelist = nodelists.pop()
+        if nodelist is None or id(nodelist) in seen:
+            continue
+        seen.add(id(nodelist))
+
+        for node in nodelist.get_nodes_by_type(Node):
+            for value in node.__dict__.values():
+                if isinstance(value, Template):
+                    if value.name:
+                        names.add(value.name)
+                    nodelists.append(value.nodelist)
+            if isinstance(node, FormeNodeBase):
+                for tmpl in node.styles.flatten().values():
+                    nodelists.append(tmpl.template)
+    return names
+
+
+class CompiledStyles(object):
+    """
+    On-disk cache of compiled styles, so processes don't have to parse style
+    templates again. Files are keyed by template source, Python, Django and
+    forme versions. When file is missing or can't be loaded, template is
+    parsed as usual. Styles which can't be serialized (e.g. templates with
+    operators in if tags) are parsed every time.
+
+    Files are signed by SECRET_KEY, files which weren't written by cache
+    are never unpickled. Sources of templates included when style was parsed
+    are stored with style, style is parsed again when any of them changed.
+
+    """
+    key_salt = 'forme.loader.CompiledStyles'
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_path(self, source):
+        key = hashlib.sha1(source.encode('utf-8'))
+        for version in (sys.version, django.get_version(), forme.__version__,
+                        pickle.HIGHEST_PROTOCOL,
+                        settings.FORME_COMPACT_STYLES):
+            key.update('\n{0}'.format(version).encode('utf-8'))
+        filename = 'forme-style-{0}.pickle'.format(key.hexdigest())
+        return os.path.join(self.directory, filename)
+
+    def sign(self, data):
+        return salted_hmac(self.key_salt, data).hexdigest().encode('ascii')
+
+    def load(self, template_name):
+        if isinstance(template_name, Template):
+            return load_style(template_name)
+
+        source = get_template_source(template_name)
+        if source is None:
+            return load_style(template_name)
+
+        path = self.get_path(source)
+        try:
+            with open(path, 'rb') as cache_file:
+                style = self.unpickle(cache_file.read())
+        except Exception:
+            # Missing or broken file, parse template.
+            style = None
+        if style is not None:
+            return style
+
+        style = load_style(Template(source, name=template_name))
+        self.save(path, style)
+        return style
+
+    def unpickle(self, data):
+        """
+        Returns style stored in file, None when file isn't signed or
+        included templates changed.
+
+        """
+        signature = self.sign(b'')
+        signature, data = data[:len(signature)], data[len(signature):]
+        if not constant_time_compare(signature, self.sign(data)):
+            return None
+
+        included, style = pickle.loads(data)
+        for name, digest in included.items():
+            source = get_template_source(name)
+            if source is None or get_digest(source) != digest:
+                return None
+        return style
+
+    def save(self, path, style):
+        included = {}
+        for name in get_included_templates(style):
+            source = get_template_source(name)
+            if source is None:
+                return
+            included[name] = get_digest(source)
+
+        try:
+            data = pickle.dumps((included, style), pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return
+        data = self.sign(data) + data
+
+        # Write file atomically, other processes might be reading it.
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        except (IOError, OSError):
+            return
+
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(data)
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            os.remove(tmp_path)
+
+
+class LoadedStyle(object):
+    """
+    Style loaded at render time, with approximate size in memory.
+
+    """
+    def __init__(self, style, size):
+        self.style = style
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+
+def get_style_size(style):
+    """
+    Returns approximate size of style in memory in bytes: nodes of its
+    templates, their text and source of compiled function.
+
+    """
+    size = sys.getsizeof(style)
+    renderer = getattr(style, 'renderer', None)
+    if renderer:
+        size += sys.getsizeof(renderer.source)
+
+    seen = set()
+    nodelists = [tmpl.template for tmpl in style.flatten().values()]
+    while nodelists:
+        nodelist = nodelists.pop()
+        if nodelist is None or id(nodelist) in seen:
+            continue
+        seen.add(id(nodelist))
+
+        for node in nodelist.get_nodes_by_type(Node):
+            size += sys.getsizeof(node) + sys.getsizeof(node.__dict__)
+            if isinstance(node, TextNode):
+                size += sys.getsizeof(node.s)
+            elif isinstance(node, FormeNodeBase):
+                for tmpl in node.styles.flatten().values():
+                    nodelists.append(tmpl.template)
+    return size
+
+
+def release_styles(styles):
+    """
+    Removes render plans and nodes of forme.render which use any of styles
+    from caches.
+
+    """
+    def uses_styles(style):
+        return (isinstance(style, Style) and
+                any(style.extends(base) for base in styles))
+
+    plans = get_plan_cache()
+    if plans is not None:
+        # Plans are keyed by form class, fields and style.
+        plans.discard(lambda key: uses_styles(key[2]))
+
+    parse_cache = get_parse_cache()
+    if parse_cache is not None:
+        parse_cache.discard(lambda key: (
+            isinstance(key, tuple) and key[0] == 'forme.shortcuts' and
+            uses_styles(key[1])))
+
+
+class StyleRegistry(object):
+    """
+    Registry of configured styles, maps style name to style. Each style is
+    loaded exactly once, either when it's looked up for the first time or
+    by warmup.
+
+    Styles are loaded from Django templates unless *load_style* function is
+    given (e.g. styles of Jinja2 environment).
+
+    Styles selected at render time (see get_style) which aren't configured
+    are loaded by template name and kept in LRU cache limited by
+    FORME_STYLE_CACHE_MAX_ENTRIES and FORME_STYLE_CACHE_MAX_SIZE.
+
+    """
+    def __init__(self, styles_config=None, load_style=None):
+        self._config = styles_config
+        self._load_style = load_style
+        self._styles = {}
+        self._loaded = None
+        self._lock = threading.Lock()
+        self._style_locks = {}
+
+    @property
+    def config(self):
+        if self._config is None:
+            return settings.FORME_STYLES
+        return self._config
+
+    @property
+    def loaded(self):
+        """
+        LRU cache of styles loaded at render time.
+
+        """
+        if self._loaded is None:
+            self._loaded = LRUCache(settings.FORME_STYLE_CACHE_MAX_ENTRIES,
+                                    settings.FORME_STYLE_CACHE_MAX_SIZE,
+                                    on_evict=self.release)
+        return self._loaded
+
+    def release(self, evicted):
+        """
+        Removes render plans and nodes (see forme.render) of evicted styles
+        from caches, so the styles are released.
+
+        """
+        release_styles([loaded.style for loaded in evicted])
+
+    def __getitem__(self, name):
+        try:
+            return self._styles[name]
+        except KeyError:
+            self.load(name)
+            return self._styles[name]
+
+    def __contains__(self, name):
+        return name in self.config
+
+    def __iter__(self):
+        return iter(self.config)
+
+    def __len__(self):
+        return len(self.config)
+
+    def keys(self):
+        return list(self.config)
+
+    def values(self):
+        return [self[name] for name in self.config]
+
+    def items(self):
+        return [(name, self[name]) for name in self.config]
+
+    def is_loaded(self, name):
+        return name in self._styles
+
+    def get_lock(self, name):
+        with self._lock:
+            return self._style_locks.setdefault(name, threading.Lock())
+
+    def load_template(self, template_name):
+        if self._load_style is not None:
+            return self._load_style(template_name)
+        elif settings.FORME_STYLE_CACHE_DIR:
+            compiled = CompiledStyles(settings.FORME_STYLE_CACHE_DIR)
+            return compiled.load(template_name)
+        return load_style(template_name)
+
+    def load(self, name):
+        """
+        Loads style unless it's already loaded. Returns time spent loading
+        in seconds.
+
+        """
+        # Each style is loaded by single thread, others wait for it.
+        with self.get_lock(name):
+            if name in self._styles:
+                return 0.0
+
+            start = default_timer()
+            self._styles[name] = self.load_template(self.config[name])
+            return default_timer() - start
+
+    def get_style(self, name):
+        """
+        Returns style selected at render time. Name is either name of
+        configured style or name of style template, such styles are loaded
+        and compiled once and evicted when they're least recently used.
+
+        """
+        if name in self.config:
+            return self[name]
+
+        loaded = self.loaded.get(name)
+        if loaded is None:
+            # Each style is loaded and compiled by single thread, others
+            # wait for it.
+            lock = self.get_lock(name)
+            with lock:
+                loaded = self.loaded.get(name)
+                if loaded is None:
+                    style = self.load_template(name)
+                    if settings.FORME_COMPILE_STYLES:
+                        compiler.get_renderer(style)
+                    loaded = LoadedStyle(style, get_style_size(style))
+                    self.loaded.set(name, loaded)
+            with self._lock:
+                if self._style_locks.get(name) is lock:
+                    del self._style_locks[name]
+        return loaded.style
+
+    def stats(self):
+        """
+        Returns number of configured styles which are loaded, number of
+        styles loaded at render time and their approximate size in bytes.
+
+        """
+        return {
+            'styles': len(self._styles),
+            'loaded': len(self.loaded),
+            'loaded_size': self.loaded.size,
+        }
+
+    def warmup(self, threads=None):
+        """
+        Loads all configured styles, optionally in pool of threads. Returns
+        dict mapping style name to load time in seconds.
+
+        """
+        names = list(self.config)
+        if threads and threads > 1:
+            pool = ThreadPool(threads)
+            try:
+                times = pool.map(self.load, names)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            times = [self.load(name) for name in names]
+        return dict(zip(names, times))
 
 
 def preload_styles(styles_config=None):
-    if not styles_config:
-        styles_config = settings.FORME_STYLES
+    """
+    Returns registry of styles, see StyleRegistry.
 
-    # Py2.6
-    styles = {}
-    for name, tmpl in styles_config.items():
-        styles[name] = SimpleLazyObject(lambda: load_style(tmpl))
-    # return {name: SimpleLazyObject(lambda: load_style(tmpl))
-    #         for name, tmpl in styles_config.items()}
-    return styles
+    """
+    return StyleRegistry(styles_config)
 
 
 def get_default_style(styles_config=None):
+    """
+    Returns empty style which overlays the default one. Default style is
+    shared, all changes are written to the overlay.
+
+    """
     if not styles_config:
         styles_config = styles
-    return copy.deepcopy(styles_config[settings.FORME_DEFAULT_STYLE])
+    return Style(base=styles_config[settings.FORME_DEFAULT_STYLE])
+
+
+_resolver = None
+
+
+def get_style_resolver():
+    """
+    Returns function selecting style of rendered forms (FORME_STYLE_RESOLVER
+    setting, either function or its dotted path), None when it isn't set.
+
+    """
+    global _resolver
+    resolver = settings.FORME_STYLE_RESOLVER
+    if isinstance(resolver, six.string_types):
+        if _resolver is None or _resolver[0] != resolver:
+            module, name = resolver.rsplit('.', 1)
+            _resolver = resolver, getattr(import_module(module), name)
+        resolver = _resolver[1]
+    return resolver
+
+
+def prepare_nodes(nodelists, seen=None):
+    """
+    Computes all lazily computed data of forme nodes in nodelists and
+    templates of their styles, so it isn't computed in each process.
+
+    """
+    if seen is None:
+        seen = set()
+    nodelists = list(nodelists)
+    while nodelists:
+        nodelist = nodelists.pop()
+        if nodelist is None or id(nodelist) in seen:
+            continue
+        seen.add(id(nodelist))
+
+        for node in nodelist.get_nodes_by_type(FormeNodeBase):
+            if node.templates is None:
+                node.build_templates()
+            if isinstance(node, FormeNode) and node.cacheable is None:
+                node.cacheable = node.templates_read_form_only()
+
+            for style in node.styles.flatten().values():
+                style.flatten()
+                nodelists.append(style.template)
+
+
+def preload(template_names=(), threads=None, freeze=True):
+    """
+    Loads all styles and given templates, e.g. in master process before
+    workers are forked (gunicorn --preload), so workers share memory with
+    master process instead of loading styles themselves. Templates are kept
+    in memory only when cached template loader is used.
+
+    Unless *freeze* is False, objects are moved to permanent generation of
+    garbage collector (Py3.7+), so collections in workers don't touch
+    shared memory. Returns list of loaded templates.
+
+    """
+    styles.warmup(threads=threads)
+    seen = set()
+    for style in styles.values():
+        prepare_nodes([tmpl.template for tmpl in style.flatten().values()],
+                      seen)
+        if settings.FORME_COMPILE_STYLES:
+            compiler.get_renderer(style)
+
+    templates = []
+    for template_name in template_names:
+        template = loader.get_template(template_name)
+        # Dj1.8+ returns template of backend
+        prepare_nodes([getattr(template, 'template', template).nodelist],
+                      seen)
+        templates.append(template)
+
+    if freeze:
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            # Py3.7+
+            gc.freeze()
+    return templates
 
 
-# Needs to be lazy object since template tags aren't loaded yet.
-styles = preload_styles()
+# Styles are loaded on demand since template tags aren't loaded yet.
+styles = StyleRegistry()
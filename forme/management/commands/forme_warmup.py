@@ -0,0 +1,28 @@
+# coding: utf-8
+from __future__ import unicode_literals
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from forme import loader
+
+
+class Command(BaseCommand):
+    help = 'Loads all configured styles and prints load time of each.'
+
+    # Dj1.4 - Dj1.7
+    if hasattr(BaseCommand, 'option_list'):
+        option_list = BaseCommand.option_list + (
+            make_option('--threads', type='int', default=None,
+                        help='Number of threads used to load styles.'),
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=None,
+                            help='Number of threads used to load styles.')
+
+    def handle(self, *args, **options):
+        times = loader.styles.warmup(threads=options.get('threads'))
+        for name in sorted(times):
+            self.stdout.write('{0}: {1:.1f} ms'.format(name,
+                                                       times[name] * 1000))
@@ -1,12 +1,28 @@
 # coding: utf-8
 from __future__ import unicode_literals
+import hashlib
 
 from django import template
-from django.forms import Field
-
-from forme.context import Label, update_context
+from django.template import defaulttags
+from django.forms.fields import Field
+from django.forms.forms import BoundField
+from django.forms.formsets import BaseFormSet
+from django.forms.models import ModelChoiceIterator
+from django.forms.widgets import Widget
+from django.utils.encoding import force_text
+from django.utils.safestring import mark_safe
+from django.utils.timezone import get_current_timezone_name
+from django.utils.translation import get_language
+
+from forme.cache import LRUCache, get_cache, get_plan_cache
+from forme.context import (Fieldset, FormFields, Label, LazyList, RenderPlan,
+                           bind_template, get_form_fields, missing,
+                           render_frame, update_context)
 from forme.exceptions import FormeInvalidTemplate
-from forme.styles import Style
+from forme.styles import (Default, Style, Templates, get_variables,
+                          resolve_value, target_key)
+from forme.widgets import (PrefetchedChoices, cached_options,
+                           get_choices_cache, prefetch_choices)
 
 
 class FormeNodeBase(template.Node):
@@ -16,37 +32,82 @@ class FormeNodeBase(template.Node):
     template_nodes = ()
     all_forme_nodes = ()
 
-    def __init__(self, target=None, action=None, nodelist=None):
+    # Hash of tag source, set by parser.
+    signature = None
+
+    def __init__(self, target=None, action=None, nodelist=None,
+                 styles_config=None, style=None):
         self.target = target
         self.action = action or 'default'
         self.nodelist = nodelist or template.NodeList()
 
         self.parent = None
-        if self.tag_name == 'forme' and self.target:
+        self.root = self
+        self.templates = None
+        self.variables = None
+        if self.tag_name == 'forme' and self.target and style is not None:
+            # Base style given explicitly, e.g. by forme.render
+            self.styles = Style(base=style)
+        elif self.tag_name == 'forme' and self.target:
             # Rendering forme, load default style
             from forme import loader
-            styles = loader.get_default_style()
-
-            # Dj1.4, Dj1.5
-            # Workaround for unsubscriptable SimpleLazyObject
-            if hasattr(styles, '_wrapped'):
-                bool(styles)
-                self.styles = styles._wrapped
-            else:
-                self.styles = styles
+            self.styles = loader.get_default_style(styles_config)
         else:
             self.styles = Style()
 
         self.validate_child_nodes()
         self.update_styles()
 
+        if self.tag_name == 'forme' and self.action == 'using':
+            self.styles['forme'] = Style(template=self.nodelist)
+
+        # Styles are shared by all renders
+        self.styles.freeze()
+
         if self.tag_name == 'forme':
-            if self.action == 'using':
-                self.styles['forme'] = Style(template=self.nodelist)
+            # Collect nodes before cleanup, template nodes are removed.
+            nodes = self.nodelist.get_nodes_by_type(FormeNodeBase)
 
             # Trigger nodes cleanup
             self.clean_nodelist()
 
+            # Whole tree is built, precompute templates of all nodes.
+            for node in [self] + nodes:
+                node.build_templates()
+
+    def build_templates(self):
+        """
+        Flattens styles of ancestors (except the root one) into single dict
+        mapping (tag, target) to template. Root style is looked up at
+        render time since it might be overlaid by the rendered form style.
+
+        """
+        # Nodelist is already cleaned, find variables used by node itself.
+        if self.nodelist:
+            self.variables = get_variables(self.nodelist)
+
+        tables = []
+        node = self
+        while node.parent:
+            tables.append(node.styles.flatten())
+            node = node.parent
+        self.root = node
+
+        keys = set()
+        for table in tables:
+            keys.update(table)
+
+        templates = {}
+        for tag, target in keys:
+            for table in tables:
+                tmpl = table.get((tag, target))
+                if tmpl is None and target is not Default:
+                    tmpl = table.get((tag, Default))
+                if tmpl is not None:
+                    templates[tag, target] = tmpl
+                    break
+        self.templates = Templates(templates)
+
     def clean_nodelist(self):
         if self.action == 'replace':
             self.nodelist[:] = []
@@ -63,38 +124,108 @@ class FormeNodeBase(template.Node):
         return (node for node in self.nodelist if isinstance(node, nodetype))
 
     def get_template(self, tag, target, context):
-        self.styles.resolve(tag, context)
-
-        try:
-            tmpl = self.styles[tag, target]
-        except KeyError:
-            if self.parent:
-                tmpl = self.parent.get_template(tag, target, context)
-            else:
-                tmpl = None
+        if self.templates is None:
+            self.build_templates()
+
+        key = target_key(target)
+        tmpl = self.templates.lookup(tag, key, context)
+        if tmpl is not None:
+            return tmpl
+
+        # Nodes of style templates are shared by all forme tags, so templates
+        # are looked up in the style of currently rendered form first, which
+        # overlays the root one.
+        styles = self.root.styles
+        active = context.get('forme_style')
+        if active is not None and (active.extends(styles) or
+                                   self.root.has_dynamic_style()):
+            styles, active = active, None
+
+        tmpl = styles.flatten().lookup(tag, key, context)
+        if tmpl is None and active is not None:
+            tmpl = active.flatten().lookup(tag, key, context)
         return tmpl
 
+    def has_dynamic_style(self):
+        """
+        Returns True if style of node is selected at render time, so style
+        pushed by the node itself replaces its styles.
+
+        """
+        return False
+
     def is_template(self, node=None):
         return isinstance(node or self, self.template_nodes)
 
-    def render(self, context):
-        if not self.nodelist:
-            if isinstance(self.target, list):
-                target = self.target[0] if len(self.target) else None
-            else:
-                target = self.target
+    def find_node_template(self, context):
+        """
+        Returns nodelist of paired tag or template from style, None if
+        template is missing.
+
+        """
+        if self.nodelist:
+            return self.nodelist
+
+        # Templates which don't depend on context are looked up once per
+        # render plan.
+        fields = context.get('forme_fields')
+        plan = fields.plan if fields is not None else None
+        if (plan is None or plan.style is None or
+                plan.style is not context.get('forme_style')):
+            plan = None
+        else:
+            tmpl = plan.templates.get(self, missing)
+            if tmpl is not missing:
+                return tmpl
 
-            tmpl = self.get_template(self.tag_name, target, context)
+        if isinstance(self.target, list):
+            target = self.target[0] if len(self.target) else None
         else:
-            tmpl = self.nodelist
+            target = self.target
+        tmpl = self.get_template(self.tag_name, target, context)
+        if (plan is not None and not self.templates.variables and
+                not self.root.styles.flatten().variables):
+            plan.templates[self] = tmpl
+        return tmpl
 
+    def get_node_template(self, context):
+        tmpl = self.find_node_template(context)
         if not tmpl:
             msg = ('Missing template for tag {0}'
                    .format(self.tag_name))
             raise template.TemplateSyntaxError(msg)
+        return tmpl
+
+    def reads_variable(self, tmpl, name):
+        """
+        Returns False if template surely doesn't read context variable.
+
+        """
+        if tmpl is self.nodelist:
+            variables = self.variables
+        else:
+            variables = getattr(tmpl, 'variables', None)
+        return variables is None or name in variables
+
+    def render(self, context, tmpl=None):
+        if not tmpl:
+            tmpl = self.get_node_template(context)
+        return tmpl.render(context)
 
-        with update_context(context, {'forme_style': self.styles}):
-            return tmpl.render(context)
+    def render_iter(self, context):
+        """
+        Renders node as generator of chunks. Joined chunks are the same as
+        output of render. By default, whole node is rendered at once.
+
+        """
+        yield force_text(self.render(context))
+
+    def render_template_iter(self, context, tmpl=None):
+        if tmpl is None:
+            tmpl = self.get_node_template(context)
+        if isinstance(tmpl, Style):
+            tmpl = tmpl.template
+        return render_iter(tmpl, context)
 
     def update_styles(self):
         for node in self.get_direct_child_nodes(self.all_forme_nodes):
@@ -137,6 +268,9 @@ class InputNode(FormeNodeBase):
     Renders single input. It doesn't push any variables into context because
     'field' variable is already pushed by field node.
 
+    Options of select widgets with many choices are rendered from cache,
+    see forme.widgets.ChoicesCache.
+
     """
     tag_name = 'input'
 
@@ -149,7 +283,8 @@ class InputNode(FormeNodeBase):
                 'Missing *field* in context of FieldNode. Probably'
                 ' misplaced *input* tag?')
 
-        return super(InputNode, self).render(context)
+        with cached_options(context['field'], get_choices_cache()):
+            return super(InputNode, self).render(context)
 
 
 class ErrorsNode(FormeNodeBase):
@@ -170,22 +305,34 @@ class ErrorsNode(FormeNodeBase):
                 'Missing *field* in context of ErrorsNode. Probably'
                 ' misplaced *errors* tag?')
 
-        errors = getattr(field, 'errors', None)
+        fields = context.get('forme_fields')
+        if fields is not None:
+            errors = fields.get_errors(field)
+        else:
+            errors = getattr(field, 'errors', None)
         if not errors:
             return ''
 
-        with update_context(context, {'errors': errors}):
-            return super(ErrorsNode, self).render(context)
+        tmpl = self.find_node_template(context)
+        push = {}
+        if self.reads_variable(tmpl, 'errors'):
+            push['errors'] = errors
+
+        with update_context(context, push):
+            return super(ErrorsNode, self).render(context, tmpl)
 
 
 class LabelNode(FormeNodeBase):
     """
     Renders field's label. it pushes 'label' variable into context which is
-    a dict containing:
+    an object containing:
         id: alias for field.id_for_label
         label: alias for field.label
         tag: alias for field.label_tag
 
+    Attributes are evaluated only when they're used. Label isn't pushed at
+    all when template doesn't use it.
+
     """
     tag_name = 'label'
     # It's a bit tricky, will be added in future.
@@ -201,14 +348,20 @@ class LabelNode(FormeNodeBase):
                 'Missing *field* in context of LabelNode. Probably'
                 ' misplaced *label* tag?')
 
-        with update_context(context, {'label': Label.create(field)}):
-            return super(LabelNode, self).render(context)
+        tmpl = self.find_node_template(context)
+        push = {}
+        if self.reads_variable(tmpl, 'label'):
+            push['label'] = Label.create(field)
+
+        with update_context(context, push):
+            return super(LabelNode, self).render(context, tmpl)
 
 
 class FieldNode(FormeNodeBase):
     """
     Renders single field which usualy consists of field errors, label and input.
     It adds 'field' variable into context as reference to rendered field.
+    Targets are either names of fields in fieldset or bound fields.
 
     """
     tag_name = 'field'
@@ -217,32 +370,45 @@ class FieldNode(FormeNodeBase):
     def __repr__(self):
         return '<Field node>'
 
-    def render(self, context):
+    def get_fields(self, context):
         fieldset = context.get('fieldset')
         if not fieldset:
             raise FormeInvalidTemplate(
                 'Missing *fieldset* in context of RowNode. Probably'
                 ' misplaced *field* tag?')
 
-        if self.target:
-            fields = []
-            for target in self.target:
-                if isinstance(target, Field):
-                    fields.append(target)
-                else:
-                    # Find field in fieldset
-                    for field in fieldset:
-                        if field.name == field:
-                            fields.append(target)
-        else:
-            fields = fieldset
+        if not self.target:
+            return fieldset
+
+        fields = []
+        for target in self.target:
+            name = resolve_value(target_key(target), context)
+
+            if isinstance(name, BoundField):
+                fields.append(name)
+                continue
+
+            # Find field in fieldset
+            if not isinstance(fieldset, Fieldset):
+                fieldset = Fieldset(fieldset)
+            field = fieldset.index.get(name)
+            if field is not None:
+                fields.append(field)
+        return fields
 
-        output = ''
-        for field in fields:
+    def render(self, context):
+        output = []
+        for field in self.get_fields(context):
             with update_context(context, {'field': field}):
-                output += super(FieldNode, self).render(context)
+                output.append(super(FieldNode, self).render(context))
 
-        return output
+        return ''.join(output)
+
+    def render_iter(self, context):
+        for field in self.get_fields(context):
+            with update_context(context, {'field': field}):
+                for chunk in self.render_template_iter(context):
+                    yield chunk
 
 
 class FieldsetNode(FormeNodeBase):
@@ -258,26 +424,35 @@ class FieldsetNode(FormeNodeBase):
     def __repr__(self):
         return '<Fieldset node>'
 
-    def render(self, context):
+    def get_fieldset(self, context):
         form = context.get('form')
         if not form:
             raise FormeInvalidTemplate(
                 'Missing *form* in context of FieldsetNode. Probably'
                 ' misplaced *fieldset* tag?')
 
+        fields = get_form_fields(context, form)
         if self.target:
-            fields = [form[field.resolve(context)] for field in self.target]
+            return Fieldset(fields[resolve_value(field, context)]
+                            for field in self.target)
         else:
-            fields = list(form)
+            return fields.fieldset
 
-        with update_context(context, {'fieldset': fields}):
+    def render(self, context):
+        with update_context(context, {'fieldset': self.get_fieldset(context)}):
             return super(FieldsetNode, self).render(context)
 
+    def render_iter(self, context):
+        with update_context(context, {'fieldset': self.get_fieldset(context)}):
+            for chunk in self.render_template_iter(context):
+                yield chunk
+
 
 class HiddenFieldsNode(FormeNodeBase):
     """
     Renders all form's hidden fields, if any. Pushes 'hidden_fields' variable
-    into context as an alias for form.hidden_fields().
+    into context as an alias for form.hidden_fields(), which is evaluated
+    only when template uses it.
 
     """
     tag_name = 'hiddenfields'
@@ -292,12 +467,17 @@ class HiddenFieldsNode(FormeNodeBase):
                 'Missing *form* in context of HiddenFieldsNode. Probably'
                 ' misplaced *hiddenfields* tag?')
 
-        hidden_fields = form.hidden_fields()
-        if not hidden_fields:
+        fields = get_form_fields(context, form)
+        if not fields.has_hidden_fields():
             return ''
 
-        with update_context(context, {'hidden_fields': hidden_fields}):
-            return super(HiddenFieldsNode, self).render(context)
+        tmpl = self.find_node_template(context)
+        push = {}
+        if self.reads_variable(tmpl, 'hidden_fields'):
+            push['hidden_fields'] = LazyList(lambda: fields.hidden_fields)
+
+        with update_context(context, push):
+            return super(HiddenFieldsNode, self).render(context, tmpl)
 
 
 class NonFieldErrorsNode(FormeNodeBase):
@@ -322,8 +502,13 @@ class NonFieldErrorsNode(FormeNodeBase):
         if not errors:
             return ''
 
-        with update_context(context, {'non_field_errors': errors}):
-            return super(NonFieldErrorsNode, self).render(context)
+        tmpl = self.find_node_template(context)
+        push = {}
+        if self.reads_variable(tmpl, 'non_field_errors'):
+            push['non_field_errors'] = errors
+
+        with update_context(context, push):
+            return super(NonFieldErrorsNode, self).render(context, tmpl)
 
 
 class FormeNode(FormeNodeBase):
@@ -331,32 +516,351 @@ class FormeNode(FormeNodeBase):
     Top level tag to render form. Adds 'form' to context which represent
     rendered form.
 
+    When formset is rendered, management form is rendered first, followed
+    by all forms. Template is looked up once and reused for all forms.
+    Formset is available in context as 'formset'.
+
+    Empty forms of formsets (formset.empty_form) are rendered only once and
+    cached by the same key as rendered forms (see get_form_key), when
+    templates read only the form.
+
+    Each distinct queryset of model choice fields is evaluated only once
+    per render, e.g. for all forms of formset.
+
+    When FORME_CACHE is set, rendered unbound forms are cached too, see
+    get_cache_key.
+
     """
     tag_name = 'forme'
 
+    # Number of rendered empty forms kept by each node.
+    max_empty_forms = 100
+
+    # Variables pushed by forme tags. Output of templates which read only
+    # these variables depends only on rendered form.
+    form_variables = frozenset([
+        'form', 'forms', 'formset', 'fieldset', 'field', 'label', 'errors',
+        'hidden_fields', 'non_field_errors', 'forme_style', 'forme_fields'])
+
     child_nodes = HiddenFieldsNode, NonFieldErrorsNode, FieldsetNode
     template_nodes = FieldsetNode.child_nodes + FieldsetNode.template_nodes
 
-    def __init__(self, target=None, action=None, nodelist=None):
+    def __init__(self, target=None, action=None, nodelist=None,
+                 styles_config=None, style=None, style_target=None):
         if not target and not action:
             raise template.TemplateSyntaxError('Missing form parameter.')
-        super(FormeNode, self).__init__(target, action, nodelist)
+        super(FormeNode, self).__init__(target, action, nodelist,
+                                        styles_config, style)
+        # Registry of styles selected at render time. Explicit base style
+        # isn't replaced by FORME_STYLE_RESOLVER.
+        self.styles_config = styles_config
+        self.style_target = style if style_target is None else style_target
+        self.empty_forms = LRUCache(max_entries=self.max_empty_forms)
+        self.cacheable = None
 
     def __repr__(self):
         return '<Forme node>'
 
-    def render(self, context):
-        forms = [form.resolve(context) for form in self.target]
+    def __getstate__(self):
+        # Rendered empty forms aren't pickled, cache has lock.
+        state = self.__dict__.copy()
+        del state['empty_forms']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.empty_forms = LRUCache(max_entries=self.max_empty_forms)
+
+    def get_context(self, context):
+        forms = [resolve_value(form, context) for form in self.target]
         if not any(forms):
             raise template.TemplateSyntaxError('Need form to render.')
         elif len(self.target) > 1:
             context_variable = 'forms'
+        elif isinstance(forms[0], BaseFormSet):
+            context_variable = 'formset'
+            forms = forms[0]
         else:
             context_variable = 'form'
             forms = forms[0]
 
-        with update_context(context, {context_variable: forms}):
-            return super(FormeNode, self).render(context)
+        styles = self.get_styles(context)
+        push = {context_variable: forms, 'forme_style': styles}
+        if context_variable == 'form':
+            # Bound fields are shared by all nodes rendering the form.
+            push['forme_fields'] = FormFields(forms,
+                                              self.get_plan(forms, styles))
+        return push
+
+    def has_dynamic_style(self):
+        from forme import settings
+        return bool(self.target) and (self.style_target is not None or
+                                      bool(settings.FORME_STYLE_RESOLVER))
+
+    def get_styles(self, context):
+        """
+        Returns styles of rendered form. Base style is selected by style of
+        tag ({% forme form style name %}) or by FORME_STYLE_RESOLVER, the
+        default style is used otherwise. Style is either name of style or
+        Style.
+
+        """
+        if not self.has_dynamic_style():
+            return self.styles
+
+        from forme import loader
+        if self.style_target is not None:
+            style = resolve_value(self.style_target, context)
+        else:
+            style = loader.get_style_resolver()(context)
+        if not style:
+            return self.styles
+
+        if not isinstance(style, Style):
+            registry = self.styles_config or loader.styles
+            style = registry.get_style(style)
+        if style is self.styles.base:
+            return self.styles
+        if self.styles.is_empty():
+            return style
+        # Templates defined by tag overlay the selected style.
+        return self.styles.rebase(style)
+
+    def get_plan(self, form, styles=None):
+        """
+        Returns render plan of form, see forme.context.RenderPlan. Plans
+        are cached by shape of form: form class, names and widget classes
+        of fields and style of tag.
+
+        """
+        if styles is None:
+            styles = self.styles
+        plans = get_plan_cache()
+        if plans is None:
+            return RenderPlan(form, styles)
+
+        fields = tuple((name, field.widget.__class__)
+                       for name, field in form.fields.items())
+        key = (form.__class__, fields, styles)
+        plan = plans.get(key)
+        if plan is None:
+            plan = RenderPlan(form, styles)
+            plans.set(key, plan)
+        return plan
+
+    def get_empty_form_key(self, form):
+        """
+        Returns cache key for empty form of formset, None for other forms
+        and forms which can't be reused, see is_reusable.
+
+        """
+        prefix = getattr(form, 'prefix', None)
+        if (not prefix or not prefix.endswith('__prefix__') or
+                not self.is_reusable(form)):
+            return None
+        return self.get_form_key(form)
+
+    def is_reusable(self, form):
+        """
+        Returns True if output of form can be reused by other renders. Form
+        must be unbound, without callable initial values of fields or form,
+        fields must not be modified since form class was created and form
+        class must not disable caching using forme_cache = False. All
+        templates, which might be rendered, must read only variables pushed
+        by forme tags, so for example {% csrf_token %} is never reused.
+
+        """
+        if (form is None or form.is_bound or
+                not getattr(form, 'forme_cache', True)):
+            return False
+
+        if any(callable(field.initial) for field in form.fields.values()):
+            return False
+        # E.g. initial={'date': date.today}, evaluated on every render.
+        if any(callable(value) for value in form.initial.values()):
+            return False
+
+        # E.g. choices or labels set per request in __init__ of form.
+        if not fields_unchanged(form):
+            return False
+
+        # Computing is idempotent, concurrent renders get the same result.
+        if self.cacheable is None:
+            self.cacheable = self.templates_read_form_only()
+        return self.cacheable
+
+    def is_cacheable(self, form):
+        """
+        Returns True if rendered form can be stored in fragment cache, see
+        is_reusable.
+
+        """
+        return self.signature is not None and self.is_reusable(form)
+
+    def templates_read_form_only(self):
+        nodelists = [self.nodelist]
+        for style in self.styles.flatten().values():
+            nodelists.append(style.template)
+
+        seen = set()
+        while nodelists:
+            nodelist = nodelists.pop()
+            if nodelist is None or id(nodelist) in seen:
+                continue
+            seen.add(id(nodelist))
+
+            variables = get_variables(nodelist, FormeNodeBase)
+            if variables is None or not variables <= self.form_variables:
+                return False
+
+            # Templates of nested nodes are defined in their styles.
+            for node in nodelist.get_nodes_by_type(FormeNodeBase):
+                for style in node.styles.flatten().values():
+                    nodelists.append(style.template)
+        return True
+
+    def get_form_key(self, form, *args):
+        """
+        Returns key of rendered form computed from form class, prefix,
+        auto_id, label suffix, fields, initial data, active language, time
+        zone and args.
+
+        """
+        cls = form.__class__
+        fields = [(name, field.__class__.__name__,
+                   field.widget.__class__.__name__, field.initial)
+                  for name, field in form.fields.items()]
+        initial = sorted(form.initial.items())
+
+        key = (cls.__module__, cls.__name__, form.prefix, form.auto_id,
+               form.label_suffix, fields, initial, get_language(),
+               get_current_timezone_name()) + args
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def get_cache_key(self, form):
+        """
+        Returns key of rendered form in fragment cache, see get_form_key.
+        Source of forme tag and style are part of the key.
+
+        """
+        styles = []
+        style = self.styles
+        while style is not None:
+            styles.append(style.signature)
+            style = style.base
+        return self.get_form_key(form, self.signature, styles)
+
+    def get_renderer(self, styles=None):
+        """
+        Returns compiled render function of style, when form is rendered
+        only by templates of style, None otherwise.
+
+        """
+        from forme import compiler, settings
+        if (not settings.FORME_COMPILE_STYLES or self.nodelist or
+                not self.target or len(self.target) != 1 or
+                not isinstance(self.target[0], template.Variable)):
+            return None
+        return compiler.get_renderer(styles or self.styles)
+
+    def prefetch_choices(self, push):
+        """
+        Returns block in which each distinct queryset of model choice fields
+        of rendered forms is evaluated only once, see
+        forme.widgets.prefetch_choices.
+
+        """
+        from forme import settings
+        forms = []
+        if settings.FORME_PREFETCH_CHOICES:
+            for form in push.get('forms', [push.get('formset'),
+                                           push.get('form')]):
+                if isinstance(form, BaseFormSet):
+                    forms.extend(form)
+                elif hasattr(form, 'fields'):
+                    forms.append(form)
+        return prefetch_choices(forms)
+
+    def render(self, context):
+        push = self.get_context(context)
+        with self.prefetch_choices(push):
+            if 'formset' in push:
+                with render_frame(context, push):
+                    return ''.join(self.render_formset_iter(context, push))
+            return self.render_form(context, push)
+
+    def render_form(self, context, push):
+        form = push.get('form')
+        styles = push['forme_style']
+        # Forms rendered by styles selected at render time aren't cached.
+        static = styles is self.styles
+        key = self.get_empty_form_key(form) if static else None
+        if key is not None:
+            output = self.empty_forms.get(key)
+            if output is not None:
+                return output
+
+        fragments = get_cache()
+        cache_key = None
+        if fragments is not None and static and self.is_cacheable(form):
+            cache_key = self.get_cache_key(form)
+            output = fragments.get(cache_key)
+            if output is not None:
+                return mark_safe(output)
+
+        with render_frame(context, push):
+            renderer = self.get_renderer(styles)
+            if renderer is not None:
+                output = renderer(context, form, get_choices_cache())
+            else:
+                output = super(FormeNode, self).render(context)
+
+        if key is not None:
+            self.empty_forms.set(key, output)
+        if cache_key is not None:
+            fragments.set(cache_key, force_text(output))
+        return output
+
+    def render_iter(self, context):
+        push = self.get_context(context)
+        form = push.get('form')
+        with self.prefetch_choices(push):
+            if 'formset' in push:
+                with render_frame(context, push):
+                    for chunk in self.render_formset_iter(context, push,
+                                                          True):
+                        yield chunk
+            elif push['forme_style'] is self.styles and (
+                    self.get_empty_form_key(form) is not None or
+                    get_cache() is not None and self.is_cacheable(form)):
+                yield force_text(self.render_form(context, push))
+            else:
+                with render_frame(context, push):
+                    for chunk in self.render_template_iter(context):
+                        yield chunk
+
+    def render_formset_iter(self, context, push, stream=False):
+        formset = push['formset']
+        yield force_text(formset.management_form)
+
+        # Forms are rendered using the same template, only form in context
+        # is replaced.
+        context['form'] = context['forme_fields'] = None
+        styles = push['forme_style']
+        tmpl = self.get_node_template(context)
+        renderer = None if stream else self.get_renderer(styles)
+        choices_cache = get_choices_cache()
+        for form in formset:
+            context['form'] = form
+            context['forme_fields'] = FormFields(form,
+                                                 self.get_plan(form, styles))
+            if stream:
+                for chunk in self.render_template_iter(context, tmpl):
+                    yield chunk
+            elif renderer is not None:
+                yield force_text(renderer(context, form, choices_cache))
+            else:
+                yield force_text(tmpl.render(context))
 
 
 forme_nodes = (FormeNode, NonFieldErrorsNode, HiddenFieldsNode, FieldsetNode,
@@ -366,6 +870,226 @@ tag_map = dict((node.tag_name, node) for node in forme_nodes)
 FormeNodeBase.all_forme_nodes = forme_nodes
 
 
+def same_value(value, base):
+    """
+    Returns True if attribute of field or widget equals attribute of base
+    field. Fields, widgets and choices are copied for each form instance,
+    so they're compared by their state.
+
+    """
+    if value is base:
+        return True
+    if isinstance(value, PrefetchedChoices):
+        value = value.choices
+    if isinstance(value, ModelChoiceIterator):
+        return (isinstance(base, ModelChoiceIterator) and
+                value.queryset is base.queryset)
+    try:
+        if value == base:
+            return True
+    except Exception:
+        return False
+
+    if isinstance(value, (Field, Widget)):
+        return same_state(value, base)
+    if (isinstance(value, (list, tuple)) and
+            isinstance(base, (list, tuple)) and len(value) == len(base)):
+        return all(same_value(item, base_item)
+                   for item, base_item in zip(value, base))
+    return False
+
+
+def same_state(obj, base):
+    if obj.__class__ is not base.__class__:
+        return False
+    state, base_state = obj.__dict__, base.__dict__
+    if len(state) != len(base_state):
+        return False
+    for key, value in state.items():
+        if key not in base_state or not same_value(value, base_state[key]):
+            return False
+    return True
+
+
+def fields_unchanged(form):
+    """
+    Returns True if fields of form are the same as fields of form class,
+    i.e. form didn't change labels, choices, widgets, … of its fields.
+
+    """
+    base_fields = getattr(form, 'base_fields', None)
+    if base_fields is None or list(form.fields) != list(base_fields):
+        return False
+    for name, field in form.fields.items():
+        if not same_state(field, base_fields[name]):
+            return False
+    return True
+
+
+def render_iter(nodelist, context):
+    """
+    Renders template or nodelist as generator of chunks, e.g. for
+    StreamingHttpResponse. Forme nodes are rendered incrementally, also
+    inside extends, block, if, for and with tags. All other nodes are
+    rendered at once.
+
+    """
+    # Dj1.8+ templates of backend wrap Django template.
+    if isinstance(getattr(nodelist, 'template', None), template.Template):
+        nodelist = nodelist.template
+    if isinstance(nodelist, template.Template):
+        with bind_template(nodelist, context):
+            for chunk in render_iter(nodelist.nodelist, context):
+                yield chunk
+        return
+
+    for node in nodelist:
+        if isinstance(node, FormeNodeBase):
+            chunks = node.render_iter(context)
+        elif node.__class__ in get_block_renderers():
+            chunks = block_renderers[node.__class__](node, context)
+        elif hasattr(nodelist, 'render_node'):
+            # Dj1.4 - Dj1.8
+            chunks = [force_text(nodelist.render_node(node, context))]
+        else:
+            chunks = [force_text(node.render_annotated(context))]
+        for chunk in chunks:
+            yield chunk
+
+
+def render_extends_iter(node, context):
+    from django.template.loader_tags import (BLOCK_CONTEXT_KEY, BlockContext,
+                                             BlockNode, ExtendsNode)
+    parent = node.get_parent(context)
+
+    if BLOCK_CONTEXT_KEY not in context.render_context:
+        context.render_context[BLOCK_CONTEXT_KEY] = BlockContext()
+    block_context = context.render_context[BLOCK_CONTEXT_KEY]
+    block_context.add_blocks(node.blocks)
+
+    # Blocks of root template are added too, see ExtendsNode.render.
+    for parent_node in parent.nodelist:
+        if not isinstance(parent_node, template.TextNode):
+            if not isinstance(parent_node, ExtendsNode):
+                block_context.add_blocks(dict(
+                    (block.name, block) for block in
+                    parent.nodelist.get_nodes_by_type(BlockNode)))
+            break
+
+    render_context = context.render_context
+    if hasattr(render_context, 'push_state'):
+        # Dj1.11+
+        with render_context.push_state(parent, isolated_context=False):
+            for chunk in render_iter(parent.nodelist, context):
+                yield chunk
+    else:
+        for chunk in render_iter(parent.nodelist, context):
+            yield chunk
+
+
+def render_block_iter(node, context):
+    from django.template.loader_tags import BLOCK_CONTEXT_KEY
+    block_context = context.render_context.get(BLOCK_CONTEXT_KEY)
+    push = None
+    if block_context is None:
+        block = node
+    else:
+        push = block = block_context.pop(node.name)
+        if block is None:
+            block = node
+        # New block keeps context for block.super, see BlockNode.render.
+        block = node.__class__(block.name, block.nodelist)
+        block.context = context
+
+    with update_context(context, {'block': block}):
+        for chunk in render_iter(block.nodelist, context):
+            yield chunk
+    if push is not None:
+        block_context.push(node.name, push)
+
+
+def render_if_iter(node, context):
+    for condition, nodelist in node.conditions_nodelists:
+        if condition is not None:
+            try:
+                match = condition.eval(context)
+            except template.VariableDoesNotExist:
+                match = None
+        else:
+            match = True
+        if match:
+            return render_iter(nodelist, context)
+    return []
+
+
+def render_for_iter(node, context):
+    parentloop = context['forloop'] if 'forloop' in context else {}
+    try:
+        values = node.sequence.resolve(context, True)
+    except template.VariableDoesNotExist:
+        values = []
+    if values is None:
+        values = []
+    if not hasattr(values, '__len__'):
+        values = list(values)
+    if not values:
+        return render_iter(node.nodelist_empty, context)
+    return render_loop_iter(node, context, values, parentloop)
+
+
+def render_loop_iter(node, context, values, parentloop):
+    length = len(values)
+    if node.is_reversed:
+        values = reversed(values)
+    unpack = len(node.loopvars) > 1
+
+    loop = {'parentloop': parentloop}
+    with update_context(context, {'forloop': loop}):
+        for i, item in enumerate(values):
+            loop.update(counter0=i, counter=i + 1, revcounter=length - i,
+                        revcounter0=length - i - 1, first=i == 0,
+                        last=i == length - 1)
+            if unpack:
+                variables = dict(zip(node.loopvars, item))
+            else:
+                variables = {node.loopvars[0]: item}
+            with update_context(context, variables):
+                for chunk in render_iter(node.nodelist_loop, context):
+                    yield chunk
+
+
+def render_with_iter(node, context):
+    variables = dict((key, value.resolve(context))
+                     for key, value in node.extra_context.items())
+    with update_context(context, variables):
+        for chunk in render_iter(node.nodelist, context):
+            yield chunk
+
+
+block_renderers = None
+
+
+def get_block_renderers():
+    """
+    Returns renderers of block tags whose nodelists may contain forme tags
+    by class of node. Subclasses of these nodes might render differently,
+    so they're rendered at once.
+
+    """
+    global block_renderers
+    if block_renderers is None:
+        # Loader tags import template loaders, which import template tags.
+        from django.template.loader_tags import BlockNode, ExtendsNode
+        block_renderers = {
+            ExtendsNode: render_extends_iter,
+            BlockNode: render_block_iter,
+            defaulttags.IfNode: render_if_iter,
+            defaulttags.ForNode: render_for_iter,
+            defaulttags.WithNode: render_with_iter,
+        }
+    return block_renderers
+
+
 def node_factory(tag_name, *args, **kwargs):
     try:
         return tag_map[tag_name](*args, **kwargs)
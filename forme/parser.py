@@ -2,69 +2,285 @@
 from __future__ import unicode_literals
 
 import copy
+import hashlib
+import re
+
 from django import template
+from django.utils import six
+
+from forme.cache import LRUCache
+from forme.context import missing
+from forme.nodes import FormeNodeBase, node_factory, tag_map
+
+filter_re = re.compile(r'\|\s*(\w+)')
+
+_tokens_reversed = None
+
+
+def tokens_reversed():
+    """
+    Returns True if parser keeps tokens in reversed order (newer Django
+    versions), so the next token is the last one.
+
+    """
+    global _tokens_reversed
+    if _tokens_reversed is None:
+        parser = template.Parser(['first', 'last'])
+        _tokens_reversed = parser.tokens[0] == 'last'
+    return _tokens_reversed
+
+
+_parse_cache = missing
+
+
+def get_parse_cache():
+    """
+    Returns cache of parsed forme tags, None when it's disabled.
+
+    """
+    global _parse_cache
+    if _parse_cache is missing:
+        from forme import settings
+        if settings.FORME_PARSE_CACHE:
+            _parse_cache = LRUCache(max_entries=settings.FORME_PARSE_CACHE)
+        else:
+            _parse_cache = None
+    return _parse_cache
+
+
+common_actions = 'using replace'.split()
+
+
+def get_valid_actions(tag_name):
+    if tag_name == 'field':
+        return common_actions + ['hide']
+    else:
+        return common_actions
+
+
+def parse_action(tag_name, parts):
+    """
+    Returns action of tag and whether tag is paired. Action is removed from
+    parts. Grammar of tags is shared by Django and Jinja2 templates.
+
+    """
+    try:
+        action = parts[-1]
+    except IndexError:
+        action = 'default'
+    else:
+        if action in get_valid_actions(tag_name):
+            # Last token is action, remove it
+            parts.pop()
+        else:
+            # Last token is target, action isn't specified
+            action = 'default'
+
+    paired = action != 'default'
+    return action, paired
+
+
+def parse_style(tag_name, parts):
+    """
+    Returns style of forme tag given as ``style <name>`` after targets,
+    None when it's missing. Style is removed from parts.
+
+    """
+    if tag_name != 'forme' or len(parts) < 3 or parts[-2] != 'style':
+        return None
+    style = compile_target(parts.pop())
+    parts.pop()
+    return style
+
+
+def parse_target(parts):
+    targets = []
+    for part in parts:
+        if ' ' in part:
+            # Only string can contain a space. Strip quotes, split strings
+            # and surround them with quotes so they resolve properly later.
+            stripped_parts = part.strip('"\'').split(' ')
+            targets.extend('"{0}"'.format(p) for p in stripped_parts)
+        else:
+            # Either variable or string with single name
+            targets.append(part)
 
-from forme.nodes import node_factory, tag_map
+    return [compile_target(target) for target in targets]
+
+
+def compile_target(target):
+    """
+    Returns string literals as constants, other targets as variables
+    resolved at render time.
+
+    """
+    variable = template.Variable(target)
+    if (isinstance(variable.literal, six.string_types) and
+            not variable.translate):
+        return variable.literal
+    return variable
 
 
 class FormeParser(object):
     valid_tags = tag_map.keys()
-    common_actions = 'using replace'.split()
+    common_actions = common_actions
 
     def __init__(self, parser, token):
         self.parser = parser
+        self.token = token
         self.parts = token.split_contents()
         self.tag_name = self.parts.pop(0)
+        # Tokens of nested template, used to compute node signature.
+        self.tokens = []
 
     @property
     def valid_actions(self):
-        actions = self.common_actions
-
-        if self.tag_name == 'field':
-            return actions + ['hide']
-        else:
-            return actions
+        return get_valid_actions(self.tag_name)
 
     def parse(self):
         parts = copy.copy(self.parts)
         action, paired = self.parse_action(parts)
+        style = parse_style(self.tag_name, parts)
         target = self.parse_target(parts)
+
+        # Identical forme tags share one node tree. Nested tags can't be
+        # shared, because they're linked to their parents. Styles are loaded
+        # only once anyway.
+        parse_cache = get_parse_cache()
+        key = tokens = None
+        if (self.tag_name == 'forme' and target and
+                parse_cache is not None and not self.is_debug()):
+            tokens = self.find_nested_tokens() if paired else []
+            if tokens is not None:
+                key = self.get_cache_key(tokens)
+                node = parse_cache.get(key)
+                if node is not None:
+                    # Skip nested template and end tag.
+                    self.skip_tokens(len(tokens) + 1 if paired else 0)
+                    self.tokens = tokens
+                    return node
+
         nodelist = self.parse_nodelist() if paired else []
 
-        return node_factory(self.tag_name, target, action, nodelist)
+        kwargs = {'style_target': style} if style is not None else {}
+        node = node_factory(self.tag_name, target, action, nodelist,
+                            **kwargs)
+        node.signature = self.get_signature()
 
-    def parse_action(self, parts):
-        try:
-            action = parts[-1]
-        except IndexError:
-            action = 'default'
-        else:
-            if action in self.valid_actions:
-                # Last token is action, remove it
-                parts.pop()
-            else:
-                # Last token is target, action isn't specified
-                action = 'default'
+        # Nested template might be parsed differently than found (e.g. end
+        # tag inside comment), such tags aren't cached.
+        if (key is not None and self.tokens == tokens and
+                isinstance(node, FormeNodeBase)):
+            parse_cache.set(key, node)
+        return node
 
-        paired = action != 'default'
-        return action, paired
+    def parse_action(self, parts):
+        return parse_action(self.tag_name, parts)
 
     def parse_target(self, parts):
-        targets = []
-        for part in parts:
-            if ' ' in part:
-                # Only string can contain a space. Strip quotes, split strings
-                # and surround them with quotes so they resolve properly later.
-                stripped_parts = part.strip('"\'').split(' ')
-                targets.extend('"{0}"'.format(p) for p in stripped_parts)
-            else:
-                # Either variable or string with single name
-                targets.append(part)
-
-        return [template.Variable(target) for target in targets]
+        return parse_target(parts)
+
+    def compile_target(self, target):
+        return compile_target(target)
 
     def parse_nodelist(self):
         end_node = 'end' + self.tag_name
+        tokens = list(self.parser.tokens)
         nodelist = self.parser.parse((end_node,))
+        self.tokens = self.get_consumed_tokens(tokens, self.parser.tokens)
         self.parser.delete_first_token()
         return nodelist
+
+    def is_debug(self):
+        """
+        Returns True if nodes keep their position in template for error
+        reporting, such nodes can't be shared.
+
+        """
+        try:
+            # Dj1.4 - Dj1.8
+            from django.template.debug import DebugParser
+        except ImportError:
+            origin = getattr(self.parser, 'origin', None)
+            engine = getattr(getattr(origin, 'loader', None), 'engine', None)
+            return getattr(engine, 'debug', False)
+        return isinstance(self.parser, DebugParser)
+
+    def get_consumed_tokens(self, before, after):
+        consumed = len(before) - len(after)
+        if tokens_reversed():
+            return list(reversed(before[len(after):]))
+        return before[:consumed]
+
+    def iter_tokens(self):
+        tokens = self.parser.tokens
+        return reversed(tokens) if tokens_reversed() else iter(tokens)
+
+    def skip_tokens(self, count):
+        if not count:
+            return
+        tokens = self.parser.tokens
+        if tokens_reversed():
+            del tokens[len(tokens) - count:]
+        else:
+            del tokens[:count]
+
+    def find_nested_tokens(self):
+        """
+        Returns tokens of nested template without parsing them, None when
+        end tag is missing.
+
+        """
+        end_node = 'end' + self.tag_name
+        depth = 0
+        tokens = []
+        for token in self.iter_tokens():
+            if token.token_type == template.TOKEN_BLOCK:
+                command = token.contents.split()[:1]
+                if command == [end_node]:
+                    if not depth:
+                        return tokens
+                    depth -= 1
+                elif command == [self.tag_name]:
+                    nested = FormeParser(self.parser, token)
+                    if nested.parse_action(nested.parts)[1]:
+                        depth += 1
+            tokens.append(token)
+        return None
+
+    def get_cache_key(self, tokens):
+        """
+        Returns key of parsed tag, which consists of signature, tags and
+        filters used by tag (libraries loaded in templates differ) and style
+        of rendered form.
+
+        """
+        libraries = set()
+        for token in [self.token] + tokens:
+            if token.token_type == template.TOKEN_BLOCK:
+                for command in token.contents.split()[:1]:
+                    libraries.add(('tag', command,
+                                   self.parser.tags.get(command)))
+            if token.token_type in (template.TOKEN_BLOCK, template.TOKEN_VAR):
+                for name in filter_re.findall(token.contents):
+                    libraries.add(('filter', name,
+                                   self.parser.filters.get(name)))
+
+        from forme import loader, settings
+        style = loader.styles[settings.FORME_DEFAULT_STYLE]
+        return self.get_signature(tokens), frozenset(libraries), style
+
+    def get_signature(self, tokens=None):
+        """
+        Returns hash of tag and its nested template, which is the same for
+        equal tags in all processes.
+
+        """
+        if tokens is None:
+            tokens = self.tokens
+        signature = hashlib.sha1(self.token.contents.encode('utf-8'))
+        for token in tokens:
+            signature.update('\n{0}:{1}'.format(token.token_type,
+                                                token.contents)
+                             .encode('utf-8'))
+        return signature.hexdigest()
@@ -0,0 +1,244 @@
+# coding: utf-8
+"""
+Opt-in timing of rendered forme nodes.
+
+Render methods of nodes are wrapped only while some profiler is active, so
+rendering isn't slowed down at all when profiling is disabled. Profiled
+forms are rendered by nodes even when their style is compiled::
+
+  with profile() as profiler:
+      tmpl.render(context)
+  print(profiler.format_report())
+
+"""
+from __future__ import unicode_literals
+import logging
+import threading
+from collections import namedtuple
+from timeit import default_timer
+
+from django.utils.encoding import force_text
+
+from forme.nodes import FormeNodeBase
+
+logger = logging.getLogger('forme.profiling')
+
+# Times are in seconds, *own* time excludes nested forme nodes and *lookup*
+# is time spent looking up templates in styles.
+Record = namedtuple('Record', 'tag target source duration own lookup size')
+
+_local = threading.local()
+_lock = threading.Lock()
+_active = 0
+_originals = []
+
+
+def get_subclasses(cls):
+    subclasses = [cls]
+    for subclass in cls.__subclasses__():
+        subclasses.extend(get_subclasses(subclass))
+    return subclasses
+
+
+def format_target(target):
+    if not target:
+        return ''
+    if not isinstance(target, list):
+        target = [target]
+    return ' '.join(force_text(getattr(item, 'var', item)) for item in target)
+
+
+def get_source(node):
+    """
+    Returns name of template which contains node, None when it's unknown
+    (Django keeps origin of nodes only in debug mode).
+
+    """
+    # Dj1.4 - Dj1.8
+    source = getattr(node, 'source', None)
+    origin = source[0] if source else getattr(node, 'origin', None)
+    return getattr(origin, 'name', None)
+
+
+def timed_render(render):
+    def wrapper(self, context, *args, **kwargs):
+        profiler = getattr(_local, 'profiler', None)
+        if profiler is None:
+            return render(self, context, *args, **kwargs)
+        return profiler.record(self, render, context, *args, **kwargs)
+    return wrapper
+
+
+def timed_lookup(get_template):
+    def wrapper(self, *args, **kwargs):
+        profiler = getattr(_local, 'profiler', None)
+        if profiler is None or not profiler.stack:
+            return get_template(self, *args, **kwargs)
+        start = default_timer()
+        try:
+            return get_template(self, *args, **kwargs)
+        finally:
+            profiler.stack[-1][3] += default_timer() - start
+    return wrapper
+
+
+def node_renderer(get_renderer):
+    def wrapper(self, *args, **kwargs):
+        # Compiled styles render forms without nodes, so profiled forms are
+        # rendered by nodes.
+        if getattr(_local, 'profiler', None) is not None:
+            return None
+        return get_renderer(self, *args, **kwargs)
+    return wrapper
+
+
+def install():
+    """
+    Wraps render methods of all node classes, called when first profiler
+    is activated.
+
+    """
+    global _active
+    with _lock:
+        _active += 1
+        if _active > 1:
+            return
+        for cls in get_subclasses(FormeNodeBase):
+            for name, wrap in (('render', timed_render),
+                               ('get_template', timed_lookup),
+                               ('get_renderer', node_renderer)):
+                method = cls.__dict__.get(name)
+                if method is not None:
+                    _originals.append((cls, name, method))
+                    setattr(cls, name, wrap(method))
+
+
+def uninstall():
+    global _active
+    with _lock:
+        _active -= 1
+        if _active:
+            return
+        while _originals:
+            cls, name, method = _originals.pop()
+            setattr(cls, name, method)
+
+
+class profile(object):
+    """
+    Records render time of forme nodes rendered in current thread.
+
+    """
+    def __init__(self):
+        self.records = []
+        # Stack of [node, start, nested time, lookup time]
+        self.stack = []
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = getattr(_local, 'profiler', None)
+        _local.profiler = self
+        install()
+        return self
+
+    def __exit__(self, *exc_info):
+        uninstall()
+        _local.profiler = self.previous
+
+    def record(self, node, render, context, *args, **kwargs):
+        # Subclasses call render of base class for the same node.
+        if self.stack and self.stack[-1][0] is node:
+            return render(node, context, *args, **kwargs)
+
+        frame = [node, default_timer(), 0, 0]
+        self.stack.append(frame)
+        output = None
+        try:
+            output = render(node, context, *args, **kwargs)
+            return output
+        finally:
+            duration = default_timer() - frame[1]
+            self.stack.pop()
+            if self.stack:
+                self.stack[-1][2] += duration
+            self.records.append(Record(
+                node.tag_name, format_target(node.target), get_source(node),
+                duration, duration - frame[2], frame[3],
+                len(output) if output is not None else 0))
+
+    def report(self, limit=None):
+        """
+        Returns list of dicts with times aggregated by tag, target and source,
+        the slowest nodes (by own time) first.
+
+        """
+        rows = {}
+        for record in self.records:
+            key = (record.tag, record.target, record.source)
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = {
+                    'tag': record.tag, 'target': record.target,
+                    'source': record.source, 'calls': 0, 'total': 0,
+                    'own': 0, 'lookup': 0, 'size': 0}
+            row['calls'] += 1
+            row['total'] += record.duration
+            row['own'] += record.own
+            row['lookup'] += record.lookup
+            row['size'] += record.size
+
+        rows = sorted(rows.values(), key=lambda row: -row['own'])
+        return rows[:limit] if limit else rows
+
+    def format_report(self, limit=20):
+        lines = ['{0:<14} {1:<20} {2:>6} {3:>10} {4:>10} {5:>10} {6:>9}'
+                 .format('Tag', 'Target', 'Calls', 'Total ms', 'Own ms',
+                         'Lookup ms', 'Size')]
+        for row in self.report(limit):
+            lines.append(
+                '{0:<14} {1:<20} {2:>6} {3:>10.3f} {4:>10.3f} {5:>10.3f} '
+                '{6:>9} {7}'.format(
+                    row['tag'], row['target'][:20], row['calls'],
+                    row['total'] * 1000, row['own'] * 1000,
+                    row['lookup'] * 1000, row['size'], row['source'] or ''))
+        return '\n'.join(lines)
+
+
+class ProfilingMiddleware(object):
+    """
+    Logs hot spots of forme nodes rendered in each request to logger
+    ``forme.profiling``. Works both as old style and new style (Dj1.10+)
+    middleware.
+
+    """
+    limit = 20
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        self.process_request(request)
+        try:
+            return self.get_response(request)
+        finally:
+            self.finish(request)
+
+    def process_request(self, request):
+        request.forme_profiler = profile().__enter__()
+
+    def process_exception(self, request, exception):
+        self.finish(request)
+
+    def process_response(self, request, response):
+        self.finish(request)
+        return response
+
+    def finish(self, request):
+        profiler = getattr(request, 'forme_profiler', None)
+        if profiler is None:
+            return
+        del request.forme_profiler
+        profiler.__exit__(None, None, None)
+        if profiler.records:
+            logger.debug('Forme nodes rendered in %s:\n%s', request.path,
+                         profiler.format_report(self.limit))
@@ -11,3 +11,63 @@ FORME_STYLES = default('FORME_STYLES', {
 })
 
 FORME_DEFAULT_STYLE = default('FORME_DEFAULT_STYLE', 'bare')
+
+# Cache of rendered unbound forms. None disables cache, 'lru' stores rendered
+# forms in process memory, other values are names of Django caches.
+FORME_CACHE = default('FORME_CACHE', None)
+
+# Limits of in-process cache, number of rendered forms and their total length.
+FORME_CACHE_MAX_ENTRIES = default('FORME_CACHE_MAX_ENTRIES', 1000)
+FORME_CACHE_MAX_SIZE = default('FORME_CACHE_MAX_SIZE', 10 * 1024 * 1024)
+
+# Options of select widgets with at least this number of choices are rendered
+# once and cached, only selected options are rendered per request. None
+# disables the cache.
+FORME_CHOICES_CACHE_MIN = default('FORME_CHOICES_CACHE_MIN', 100)
+FORME_CHOICES_CACHE_ENTRIES = default('FORME_CHOICES_CACHE_ENTRIES', 100)
+
+# Evaluate each distinct queryset of model choice fields only once per
+# rendered form or formset.
+FORME_PREFETCH_CHOICES = default('FORME_PREFETCH_CHOICES', True)
+
+# Remove comments, collapse whitespace-only text and merge adjacent text in
+# templates of styles when they're loaded, see forme.loader.compact_style.
+FORME_COMPACT_STYLES = default('FORME_COMPACT_STYLES', False)
+
+# Load all styles when Django starts (Dj1.7+), so first request doesn't have
+# to parse them. Number of threads used for loading, None loads them serially.
+FORME_WARMUP = default('FORME_WARMUP', False)
+FORME_WARMUP_THREADS = default('FORME_WARMUP_THREADS', None)
+
+# Styles selected at render time which aren't configured in FORME_STYLES
+# (e.g. per tenant) are loaded by template name and kept in LRU cache. Limits
+# of the cache, number of styles and their approximate size in bytes.
+FORME_STYLE_CACHE_MAX_ENTRIES = default('FORME_STYLE_CACHE_MAX_ENTRIES', 1000)
+FORME_STYLE_CACHE_MAX_SIZE = default('FORME_STYLE_CACHE_MAX_SIZE',
+                                     50 * 1024 * 1024)
+
+# Function (or its dotted path) called with context of each rendered forme
+# tag without explicit style. It returns name of style (or Style), None
+# selects the default style.
+FORME_STYLE_RESOLVER = default('FORME_STYLE_RESOLVER', None)
+
+# Directory where compiled styles are stored, so they're parsed only once
+# for all processes. None disables the cache.
+FORME_STYLE_CACHE_DIR = default('FORME_STYLE_CACHE_DIR', None)
+
+# Number of parsed forme tags kept in memory, identical tags in all templates
+# share one node tree. None disables the cache.
+FORME_PARSE_CACHE = default('FORME_PARSE_CACHE', 1000)
+
+# Number of nodes of forme tags in Jinja2 templates kept in memory by each
+# environment. Evicted nodes are parsed again from source of template when
+# it's rendered. None keeps all nodes.
+FORME_JINJA_CACHE_MAX_ENTRIES = default('FORME_JINJA_CACHE_MAX_ENTRIES', 1000)
+
+# Number of render plans kept in memory. Plan is computed once for all forms
+# with the same class, fields, widgets and style. None disables the cache.
+FORME_PLAN_CACHE = default('FORME_PLAN_CACHE', 1000)
+
+# Compile styles of forms rendered without inline templates into Python
+# functions, see forme.compiler.
+FORME_COMPILE_STYLES = default('FORME_COMPILE_STYLES', True)
@@ -0,0 +1,137 @@
+# coding: utf-8
+"""
+Rendering of forms from Python code, e.g. in views, API endpoints or tests,
+without parsing ``{% forme form %}`` template.
+
+Nodes are built once per style and overrides and kept in the parse cache,
+so forms are rendered by the same (compiled) styles as forme tags.
+
+"""
+from __future__ import unicode_literals
+import hashlib
+
+from django import template
+from django.utils.safestring import mark_safe
+
+from forme import loader, settings
+from forme.context import Fieldset, FormFields, render_frame, update_context
+from forme.nodes import FieldNode, FormeNode
+from forme.parser import get_parse_cache
+from forme.styles import Style
+
+form_variable = template.Variable('form')
+
+
+def resolve_style(style, context):
+    """
+    Returns style given by name or Style. When style isn't given, it's
+    selected by FORME_STYLE_RESOLVER, the default style is used otherwise.
+
+    """
+    if style is None:
+        resolver = loader.get_style_resolver()
+        if resolver is not None:
+            style = resolver(context)
+    if isinstance(style, Style):
+        return style
+    return loader.styles.get_style(style or settings.FORME_DEFAULT_STYLE)
+
+
+def get_style(style, overrides=None):
+    """
+    Returns style overlaid by *overrides* mapping tag names or (tag, target)
+    pairs to template sources.
+
+    """
+    if not overrides:
+        return style
+
+    style = Style(base=style)
+    for key, source in overrides.items():
+        tmpl = template.Template('{% load forme %}' + source)
+        style[key] = Style(template=tmpl.nodelist)
+    style.freeze()
+    return style
+
+
+def get_overrides_key(overrides):
+    return tuple(sorted(((repr(key), source)
+                         for key, source in (overrides or {}).items())))
+
+
+def get_node(style, overrides=None):
+    """
+    Returns forme node rendering form by style. Nodes are shared by all
+    calls with the same style and overrides.
+
+    """
+    overrides_key = get_overrides_key(overrides)
+    key = ('forme.shortcuts', style, overrides_key)
+
+    parse_cache = get_parse_cache()
+    node = parse_cache.get(key) if parse_cache is not None else None
+    if node is None:
+        node = FormeNode([form_variable], style=get_style(style, overrides))
+        # Signature of overrides, so rendered forms can be cached.
+        node.signature = hashlib.sha1(
+            repr(overrides_key).encode('utf-8')).hexdigest()
+        if parse_cache is not None:
+            parse_cache.set(key, node)
+    return node
+
+
+def get_field_node(name):
+    """
+    Returns field node rendering field of given name. Templates are looked
+    up in style of rendered form, so nodes are shared by all styles.
+
+    """
+    key = ('forme.shortcuts', name)
+    parse_cache = get_parse_cache()
+    node = parse_cache.get(key) if parse_cache is not None else None
+    if node is None:
+        node = FieldNode([name])
+        if parse_cache is not None:
+            parse_cache.set(key, node)
+    return node
+
+
+def get_context(context):
+    if isinstance(context, template.Context):
+        return context
+    return template.Context(context)
+
+
+def render(form, style=None, overrides=None, context=None):
+    """
+    Renders form or formset the same way as ``{% forme form %}`` tag.
+    *style* is name of style (see StyleRegistry.get_style) or Style, by
+    default it's selected by FORME_STYLE_RESOLVER. *overrides* maps tag names
+    (or (tag, target) pairs) to template sources of tags, e.g.
+    ``{'label': '<b>{{ label.label }}</b>'}``. Template variables are
+    looked up in *context*.
+
+    """
+    context = get_context(context)
+    node = get_node(resolve_style(style, context), overrides)
+    with update_context(context, {'form': form}):
+        return mark_safe(node.render(context))
+
+
+def render_field(form, name, style=None, overrides=None, context=None):
+    """
+    Renders single field of form by the ``field`` template of style, e.g.
+    to render field with errors again while validating it.
+
+    """
+    context = get_context(context)
+    node = get_node(resolve_style(style, context), overrides)
+    fields = FormFields(form, node.get_plan(form))
+    push = {
+        'form': form,
+        'forme_style': node.styles,
+        'forme_fields': fields,
+        'fieldset': Fieldset([fields[name]]),
+    }
+    with render_frame(context, push):
+        return mark_safe(get_field_node(name).render(context))
@@ -3,63 +3,343 @@ from __future__ import unicode_literals
 from collections import namedtuple, defaultdict
 
 from django import template
+from django.template import defaulttags, smartif
+
+from forme.context import RenderFrame
 
 Variant = namedtuple('Variant', 'tag target')
 
+# Nodes which read context only through variables and filter expressions.
+analyzable_nodes = (template.TextNode, template.VariableNode) + tuple(
+    getattr(defaulttags, name) for name in (
+        'AutoEscapeControlNode', 'CommentNode', 'FilterNode', 'FirstOfNode',
+        'ForNode', 'IfEqualNode', 'IfNode', 'LoadNode', 'SpacelessNode',
+        'VerbatimNode', 'WidthRatioNode', 'WithNode')
+    if hasattr(defaulttags, name))
+
 
 class Default: pass
 
 
+def target_key(target):
+    """
+    Returns key under which template for target is looked up. Quoted strings
+    are looked up by their literal value, other targets as they are. Parser
+    stores literals as constants already.
+
+    """
+    if not target:
+        return Default
+    literal = getattr(target, 'literal', None)
+    if literal is not None:
+        return literal
+    return target
+
+
+def get_variables(nodelist, transparent=()):
+    """
+    Returns set of names of context variables read by nodelist or None,
+    when it can't be determined (nodelist contains other tags). Variables
+    defined by for and with tags aren't included.
+
+    Nodes of *transparent* types are analyzed only by their targets and
+    nodelists.
+
+    """
+    variables = set()
+    stack = [nodelist]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, transparent):
+            stack.extend(item.target or [])
+            stack.append(item.nodelist)
+        elif isinstance(item, template.Node):
+            if not isinstance(item, analyzable_nodes):
+                return None
+
+            # Variables defined by tag are read only by its nodelist.
+            if isinstance(item, defaulttags.ForNode):
+                defined = set(item.loopvars)
+                defined.add('forloop')
+                scoped, body = item.nodelist_loop, [item.sequence,
+                                                    item.nodelist_empty]
+            elif isinstance(item, defaulttags.WithNode):
+                defined = set(item.extra_context)
+                scoped, body = item.nodelist, [item.extra_context]
+            else:
+                stack.extend(item.__dict__.values())
+                continue
+
+            scoped = get_variables(scoped, transparent)
+            if scoped is None:
+                return None
+            variables.update(scoped - defined)
+            stack.extend(body)
+        elif isinstance(item, template.Variable):
+            if item.lookups:
+                variables.add(item.lookups[0])
+        elif isinstance(item, template.FilterExpression):
+            stack.append(item.var)
+            stack.extend(item.filters)
+        elif isinstance(item, smartif.TokenBase):
+            stack.extend(item.__dict__.values())
+        elif isinstance(item, dict):
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            stack.extend(item)
+    return variables
+
+
+def resolve_value(target, context):
+    """
+    Resolves target variable in context, constants are returned as they are.
+
+    """
+    if isinstance(target, template.Variable):
+        return target.resolve(context)
+    return target
+
+
+def resolve_target(key, context):
+    """
+    Resolves target variable in context. Returns None when target can't be
+    used as a key.
+
+    """
+    value = key.resolve(context)
+    try:
+        hash(value)
+    except TypeError:
+        return None
+    return value
+
+
 class VariableDict(dict):
     def resolve(self, context):
-        update = {}
+        """
+        Returns dict mapping resolved variables to templates. Dict itself
+        isn't modified since it's shared by all renders.
+
+        """
+        resolved = {}
         for variable, tmpl in self.items():
             if isinstance(variable, template.Variable):
-                update[variable.resolve(context)] = tmpl
-        self.update(**update)
+                resolved[resolve_target(variable, context)] = tmpl
+        resolved.pop(None, None)
+        return resolved
+
+
+class Templates(dict):
+    """
+    Flattened dict mapping (tag, target) to template. Targets which are
+    template variables are resolved once per render of forme tag and kept
+    in its render frame, the dict is never modified after creation.
+
+    """
+    def __init__(self, *args, **kwargs):
+        super(Templates, self).__init__(*args, **kwargs)
+        self.variables = [(key, tmpl) for key, tmpl in self.items()
+                          if isinstance(key[1], template.Variable)]
+        # Context variables read by targets.
+        self.names = set(key[1].lookups[0] for key, tmpl in self.variables
+                         if key[1].lookups)
+
+    def lookup(self, tag, key, context):
+        if self.variables:
+            value = key
+            if isinstance(key, template.Variable):
+                value = resolve_target(key, context)
+            tmpl = self.resolve(context).get((tag, value))
+            if tmpl is not None:
+                return tmpl
+
+        tmpl = self.get((tag, key))
+        if tmpl is None and key is not Default:
+            tmpl = self.get((tag, Default))
+        return tmpl
+
+    def resolve(self, context):
+        # Targets can't change while render frame of forme tag is on top of
+        # context and doesn't contain them. Variables pushed by loops or
+        # forme tags resolve targets again.
+        frame = context.dicts[-1]
+        if (isinstance(frame, RenderFrame) and
+                self.names.isdisjoint(frame)):
+            resolved = frame.targets.get(id(self))
+            if resolved is None:
+                resolved = frame.targets[id(self)] = self.resolve_all(context)
+            return resolved
+        return self.resolve_all(context)
+
+    def resolve_all(self, context):
+        resolved = {}
+        for (tag, variable), tmpl in self.variables:
+            value = resolve_target(variable, context)
+            if value is not None:
+                resolved.setdefault((tag, value), tmpl)
+        return resolved
 
 
 class Style(object):
-    def __init__(self, template=None):
+    """
+    Mapping of (tag, target) pairs to templates.
+
+    Style can overlay another *base* style. Lookups fall back to the base
+    style, while all writes go to the overlay, so the base style can be
+    shared by many overlays without copying.
+
+    Styles are frozen once the forme tag is parsed, because they're shared
+    by all renders of compiled template.
+
+    """
+    def __init__(self, template=None, base=None):
         self._data = defaultdict(VariableDict)
         self.template = template
+        # Variables read by template, None if unknown.
+        self.variables = (get_variables(template) if template is not None
+                          else None)
+        self.base = base
+        # Hash of template which defines style, see FormeParser.get_signature
+        self.signature = None
+        self.frozen = False
+        self._flat = None
+        # Compiled render function, False if style can't be compiled, see
+        # forme.compiler.
+        self.renderer = None
+        # Overlays of other styles rebased onto this one, see rebase.
+        self._overlays = {}
 
     def __contains__(self, key):
         key = self._normalize_key(key)
-        if isinstance(key.target, slice):
-            return key.tag in self._data
-        else:
-            return key.tag in self._data and key.target in self._data[key.tag]
+        style = self
+        while style is not None:
+            variants = style._data.get(key.tag)
+            if variants is not None:
+                if isinstance(key.target, slice) or key.target in variants:
+                    return True
+            style = style.base
+        return False
 
     def __getitem__(self, key):
         key = self._normalize_key(key)
         if isinstance(key.target, slice):
-            return self._data[key.tag]
+            return self._variants(key.tag)
 
-        variants = self._data[key.tag]
-        if key.target != Default and key.target in variants:
-            return variants[key.target]
-        else:
-            return variants[Default]
+        if key.target != Default:
+            try:
+                return self._lookup(key.tag, key.target)
+            except KeyError:
+                pass
+        return self._lookup(key.tag, Default)
 
     def __setitem__(self, key, value):
+        self._check_frozen()
         key = self._normalize_key(key)
         self._data[key.tag][key.target] = value
+        self._flat = None
 
     def __delitem__(self, key):
+        self._check_frozen()
         key = self._normalize_key(key)
         if isinstance(key.target, slice):
             del self._data[key.tag]
         else:
             del self._data[key.tag][key.target]
+        self._flat = None
 
     def __repr__(self):
         return "<Style {0}".format(self._data)
 
+    def __getstate__(self):
+        # Compiled functions can't be pickled, they're compiled again.
+        state = self.__dict__.copy()
+        state['renderer'] = None
+        state['_overlays'] = {}
+        return state
+
     def render(self, context):
         if self.template:
             return self.template.render(context)
 
+    def extends(self, style):
+        """
+        Returns True if style is either this style or one of its bases.
+
+        """
+        base = self
+        while base is not None:
+            if base is style:
+                return True
+            base = base.base
+        return False
+
+    def rebase(self, base):
+        """
+        Returns frozen style with the same templates as this one, which
+        overlays another *base* style. Styles are kept in base, so each
+        pair is created once (concurrent renders may only replace it with
+        an equal one) and released together with base.
+
+        """
+        style = base._overlays.get(self)
+        if style is None:
+            style = Style(template=self.template, base=base)
+            style._data = self._data
+            style.signature = self.signature
+            style.freeze()
+            base._overlays[self] = style
+        return style
+
+    def is_empty(self):
+        """
+        Returns True if style doesn't define any templates itself.
+
+        """
+        return not any(self._data.values())
+
+    def freeze(self):
+        self.frozen = True
+
+    def flatten(self):
+        """
+        Returns Templates mapping (tag, target) to template, including
+        templates of base styles. Targets are converted using target_key.
+        Missing targets fall back to (tag, Default) key.
+
+        """
+        # Computing flat dict is idempotent, concurrent renders may only
+        # replace it with an equal one.
+        if self._flat is None:
+            flat = {}
+            style = self
+            while style is not None:
+                for tag, variants in style._data.items():
+                    for target, tmpl in variants.items():
+                        flat.setdefault((tag, target_key(target)), tmpl)
+                style = style.base
+            self._flat = Templates(flat)
+        return self._flat
+
+    def _check_frozen(self):
+        if self.frozen:
+            raise TypeError("Style is frozen and can't be modified.")
+
+    def _lookup(self, tag, target):
+        style = self
+        while style is not None:
+            variants = style._data.get(tag)
+            if variants is not None and target in variants:
+                return variants[target]
+            style = style.base
+        raise KeyError(Variant(tag, target))
+
+    def _variants(self, tag):
+        variants = VariableDict()
+        if self.base is not None:
+            variants.update(self.base._variants(tag))
+        variants.update(self._data.get(tag, {}))
+        return variants
+
     @classmethod
     def _normalize_key(cls, key):
         if not isinstance(key, tuple):
@@ -72,4 +352,13 @@ class Style(object):
         return Variant(*key)
 
     def resolve(self, tag, context):
-        self._data[tag].resolve(context)
+        """
+        Returns dict mapping resolved variable targets of tag to templates.
+
+        """
+        resolved = {}
+        if self.base is not None:
+            resolved.update(self.base.resolve(tag, context))
+        if tag in self._data:
+            resolved.update(self._data[tag].resolve(context))
+        return resolved
@@ -0,0 +1,272 @@
+# coding: utf-8
+from __future__ import unicode_literals
+from itertools import chain
+
+from django.forms.models import ModelChoiceIterator
+from django.forms.widgets import Select
+from django.utils import six
+from django.utils.encoding import force_text
+from django.utils.html import format_html
+
+from forme.cache import LRUCache
+from forme.context import missing
+
+simple_types = (six.text_type, six.binary_type, type(None)) + six.integer_types
+
+
+class Options(object):
+    """
+    Rendered options of select widget. Each option is rendered as not
+    selected, only selected options are rendered again per request.
+
+    """
+    def __init__(self, chunks, index):
+        self.chunks = chunks
+        # Maps value to list of (position, value, label) of options.
+        self.index = index
+        self.html = '\n'.join(chunks)
+
+    def __len__(self):
+        return len(self.html)
+
+    def render(self, widget, selected_choices):
+        selected_choices = set(force_text(v) for v in selected_choices)
+        selected = [value for value in selected_choices
+                    if value in self.index]
+        if not selected:
+            return self.html
+
+        chunks = list(self.chunks)
+        for value in selected:
+            options = self.index[value]
+            if not widget.allow_multiple_selected:
+                # Only the first option is selected.
+                options = options[:1]
+            for position, option_value, option_label in options:
+                chunks[position] = widget.render_option(
+                    set([value]), option_value, option_label)
+        return '\n'.join(chunks)
+
+
+class ChoicesCache(object):
+    """
+    Cache of rendered options of select widgets with many choices. Options
+    are cached per widget class and choices, so changed choices (e.g. new
+    object in queryset) are rendered and cached again.
+
+    """
+    def __init__(self, min_choices=None, max_entries=None):
+        self.min_choices = min_choices or 0
+        self.options = LRUCache(max_entries=max_entries)
+
+    def is_cacheable(self, widget):
+        cls = widget.__class__
+        # Dj1.11+ renders widgets using templates.
+        if not hasattr(cls, 'render_options'):
+            return False
+
+        render_options = six.get_unbound_function(cls.render_options)
+        if render_options is not six.get_unbound_function(
+                Select.render_options):
+            return False
+
+        # Choices of model fields are counted only when rendered, see render.
+        choices = widget.choices
+        if isinstance(choices, (list, tuple)):
+            return len(choices) >= self.min_choices
+        return True
+
+    def get_key(self, choices):
+        # Values are normalized only if they aren't simple, type is part of
+        # key since e.g. True and 1 are equal but rendered differently.
+        key = []
+        for value, label in choices:
+            if isinstance(label, (list, tuple)):
+                key.append((force_text(value), self.get_key(label)))
+                continue
+
+            value_type, label_type = value.__class__, label.__class__
+            if value_type not in simple_types:
+                value = force_text(value)
+            if label_type not in simple_types:
+                label = force_text(label)
+            key.append((value_type, value, label_type, label))
+        return tuple(key)
+
+    def get_options(self, widget, choices):
+        key = (widget.__class__, self.get_key(choices))
+        options = self.options.get(key)
+        if options is None:
+            options = self.render_options(widget, choices)
+            self.options.set(key, options)
+        return options
+
+    def render_options(self, widget, choices):
+        chunks = []
+        index = {}
+
+        def add_option(value, label):
+            index.setdefault(force_text(value), []).append(
+                (len(chunks), value, label))
+            chunks.append(widget.render_option(set(), value, label))
+
+        for value, label in choices:
+            if isinstance(label, (list, tuple)):
+                chunks.append(format_html('<optgroup label="{0}">',
+                                          force_text(value)))
+                for option in label:
+                    add_option(*option)
+                chunks.append('</optgroup>')
+            else:
+                add_option(value, label)
+        return Options(chunks, index)
+
+    def render(self, widget, choices, selected_choices):
+        choices = list(chain(widget.choices, choices))
+        if len(choices) < self.min_choices:
+            # E.g. model choices, which are counted only when rendered.
+            options = self.render_options(widget, choices)
+        else:
+            options = self.get_options(widget, choices)
+        return options.render(widget, selected_choices)
+
+
+class cached_options(object):
+    """
+    Renders options of field's select widget from cache in block. Widget
+    belongs to single form instance and it's restored at the end of block.
+
+    """
+    def __init__(self, field, choices_cache):
+        self.widget = None
+        widget = getattr(getattr(field, 'field', None), 'widget', None)
+        if (choices_cache is not None and widget is not None and
+                'render_options' not in widget.__dict__ and
+                choices_cache.is_cacheable(widget)):
+            self.widget = widget
+            self.choices_cache = choices_cache
+
+    def __enter__(self):
+        if self.widget is not None:
+            widget, choices_cache = self.widget, self.choices_cache
+            widget.render_options = lambda choices, selected: \
+                choices_cache.render(widget, choices, selected)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.widget is not None:
+            del self.widget.render_options
+
+
+class PrefetchedChoices(object):
+    """
+    Choices of model choice field, which are iterated over objects shared
+    by all fields with equal queryset, see prefetch_choices. Other
+    attributes (queryset, field, choice, …) are read from original choices.
+
+    """
+    def __init__(self, choices, prefetch):
+        self.choices = choices
+        self.prefetch = prefetch
+
+    def __getattr__(self, name):
+        if name in ('choices', 'prefetch'):
+            # Not set yet, e.g. when unpickled.
+            raise AttributeError(name)
+        return getattr(self.choices, name)
+
+    def __iter__(self):
+        field = self.choices.field
+        if field.empty_label is not None:
+            yield ('', field.empty_label)
+        for obj in self.prefetch.get_objects(self.choices.queryset):
+            yield self.choices.choice(obj)
+
+    def __len__(self):
+        empty = 1 if self.choices.field.empty_label is not None else 0
+        return len(self.prefetch.get_objects(self.choices.queryset)) + empty
+
+
+class prefetch_choices(object):
+    """
+    Evaluates each distinct queryset of model choice fields of forms only
+    once in block, objects are shared by all fields and forms (e.g. the
+    same field in all forms of formset). Querysets are evaluated lazily,
+    when choices are rendered, and original choices are restored at the end
+    of block.
+
+    """
+    def __init__(self, forms):
+        self.forms = forms
+        self.widgets = []
+        # Objects by queryset key and keys by id of queryset.
+        self.objects = {}
+        self.keys = {}
+
+    def __enter__(self):
+        for form in self.forms:
+            for field in form.fields.values():
+                widget = field.widget
+                choices = getattr(widget, 'choices', None)
+                # Dj1.4 - Dj1.6, fields with cache_choices cache them itself.
+                if (type(choices) is ModelChoiceIterator and
+                        not getattr(field, 'cache_choices', False)):
+                    self.widgets.append((widget, choices))
+                    widget.choices = PrefetchedChoices(choices, self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for widget, choices in reversed(self.widgets):
+            widget.choices = choices
+        self.widgets = []
+        self.objects = {}
+        self.keys = {}
+
+    def get_key(self, queryset):
+        """
+        Returns key of queryset, which is the same for querysets running
+        the same query.
+
+        """
+        try:
+            return self.keys[id(queryset)][1]
+        except KeyError:
+            pass
+
+        try:
+            sql, params = queryset.query.sql_with_params()
+            key = (queryset.model, queryset.db, sql, tuple(params))
+            hash(key)
+        except Exception:
+            # E.g. empty querysets, evaluate them separately.
+            key = id(queryset)
+        # Queryset is kept, so its id isn't reused.
+        self.keys[id(queryset)] = (queryset, key)
+        return key
+
+    def get_objects(self, queryset):
+        key = self.get_key(queryset)
+        objects = self.objects.get(key)
+        if objects is None:
+            # Queryset of field isn't evaluated, since it's shared by forms.
+            objects = self.objects[key] = list(queryset.all())
+        return objects
+
+
+_choices_cache = missing
+
+
+def get_choices_cache():
+    """
+    Returns cache of rendered options configured in settings, None when
+    it's disabled.
+
+    """
+    global _choices_cache
+    if _choices_cache is missing:
+        from forme import settings
+        if settings.FORME_CHOICES_CACHE_MIN is None:
+            _choices_cache = None
+        else:
+            _choices_cache = ChoicesCache(settings.FORME_CHOICES_CACHE_MIN,
+                                          settings.FORME_CHOICES_CACHE_ENTRIES)
+    return _choices_cache
@@ -35,12 +35,16 @@ setup(
     install_requires=[
         'django',
     ],
+    extras_require={
+        'jinja2': ['jinja2'],
+    },
 
     cmdclass={'test': PyTest},
     tests_require=[
         'pytest',
         'beautifulsoup4',
         'mock',
+        'jinja2',
     ],
 
     classifiers=(
@@ -13,7 +13,9 @@ from forme.parser import FormeParser
 def pytest_configure():
     settings.configure(
         TEMPLATE_DEBUG=True, DEBUG=True,
-        INSTALLED_APPS=('forme',)
+        INSTALLED_APPS=('forme',),
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3',
+                               'NAME': ':memory:'}},
     )
 
     import django
@@ -28,6 +30,11 @@ def node_mock(request):
     p = patch('forme.parser.node_factory', m)
     p.start()
     request.addfinalizer(p.stop)
+
+    # Parsed nodes must not be cached
+    p = patch('forme.parser.get_parse_cache', Mock(return_value=None))
+    p.start()
+    request.addfinalizer(p.stop)
     return m
 
 
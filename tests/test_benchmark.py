@@ -0,0 +1,51 @@
+# coding: utf-8
+from __future__ import unicode_literals
+import json
+
+from forme import benchmark
+
+
+def test_percentile():
+    values = [5, 1, 4, 2, 3]
+    assert benchmark.percentile(values, 0) == 1
+    assert benchmark.percentile(values, 50) == 3
+    assert benchmark.percentile(values, 100) == 5
+    assert benchmark.percentile([], 50) is None
+
+
+def test_compare():
+    def results(render, parse):
+        return {'results': {'form': {'render': {'p50': render},
+                                     'parse': {'p50': parse}}}}
+
+    baseline = results(10.0, 1.0)
+    assert benchmark.compare(results(11.0, 1.0), baseline, 0.2) == []
+    assert benchmark.compare(results(13.0, 0.5), baseline, 0.2) == [
+        ('form', 'render', 10.0, 13.0)]
+    # Scenarios missing in baseline are ignored
+    assert benchmark.compare(results(13.0, 1.0), {'results': {}}) == []
+
+
+def test_synthetic_forms():
+    form = benchmark.make_form_class(20)()
+    assert len(form.fields) == 20
+    widgets = set(field.widget.__class__ for field in form.fields.values())
+    assert len(widgets) == len(benchmark.WIDGETS)
+
+
+def test_main(tmpdir):
+    output = str(tmpdir.join('results.json'))
+    assert benchmark.main(['-n', '2', '-o', output, 'fields-10']) == 0
+
+    with open(output) as results:
+        results = json.load(results)
+    stats = results['results']['fields-10']
+    assert set(stats) == set(['parse', 'first_render', 'render'])
+    assert stats['render']['n'] == 2
+
+    # Every phase is slower than baseline
+    for phase in stats.values():
+        phase['p50'] /= 100
+    with open(output, 'w') as baseline:
+        json.dump(results, baseline)
+    assert benchmark.main(['-n', '2', '-b', output, 'fields-10']) == 1
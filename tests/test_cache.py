@@ -0,0 +1,95 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import mock
+
+from forme import cache
+
+
+def test_lru_entries():
+    lru = cache.LRUCache(max_entries=2)
+    lru.set('a', 'A')
+    lru.set('b', 'B')
+    # Lookup marks value as recently used
+    assert lru.get('a') == 'A'
+    lru.set('c', 'C')
+
+    assert len(lru) == 2
+    assert lru.get('b') is None
+    assert lru.get('a') == 'A'
+    assert lru.get('c') == 'C'
+
+
+def test_lru_size():
+    lru = cache.LRUCache(max_size=5)
+    lru.set('a', 'AA')
+    lru.set('b', 'BB')
+    lru.set('a', 'A')
+    assert lru.size == 3
+
+    lru.set('c', 'CCC')
+    assert lru.get('b') is None
+    assert lru.size == 4
+
+    # Values larger than limit aren't cached at all
+    lru.set('d', 'DDDDDD')
+    assert lru.get('d') is None
+    assert lru.size == 4
+
+    lru.clear()
+    assert len(lru) == 0
+    assert lru.size == 0
+
+
+def test_lru_evict():
+    evicted = []
+    lru = cache.LRUCache(max_entries=2, max_size=5, on_evict=evicted.extend)
+    lru.set('a', 'A')
+    lru.set('b', 'B')
+    lru.set('c', 'C')
+    lru.set('d', 'DDDDDD')
+    assert evicted == ['A', 'DDDDDD']
+
+    lru.discard(lambda key: key == 'b')
+    assert lru.get('b') is None
+    assert lru.get('c') == 'C'
+    assert lru.size == 1
+
+
+def test_fragment_cache_stats():
+    fragments = cache.FragmentCache(cache.LRUCache())
+    assert fragments.get('key') is None
+    fragments.set('key', 'value')
+    assert fragments.get('key') == 'value'
+    assert fragments.get('key') == 'value'
+    assert fragments.stats() == {'hits': 2, 'misses': 1, 'hit_rate': 2 / 3.0}
+
+    fragments.reset_stats()
+    assert fragments.stats() == {'hits': 0, 'misses': 0, 'hit_rate': 0.0}
+
+
+def test_plan_cache_stats():
+    plans = cache.PlanCache(max_entries=1)
+    assert plans.get(('a',)) is None
+    plans.set(('a',), 'A')
+    assert plans.get(('a',)) == 'A'
+    plans.set(('b',), 'B')
+    assert plans.stats() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5,
+                             'size': 1, 'max_entries': 1}
+
+    plans.clear()
+    assert plans.stats()['size'] == 0
+
+
+def test_create_cache():
+    with mock.patch('forme.settings.FORME_CACHE', None):
+        assert cache.create_cache() is None
+
+    fragments = cache.create_cache('lru')
+    assert isinstance(fragments.backend, cache.LRUCache)
+
+    # Django cache backend, keys are prefixed
+    fragments = cache.create_cache('default')
+    fragments.set('key', 'value')
+    assert cache.get_django_cache('default').get('forme:key') == 'value'
+    assert fragments.get('key') == 'value'
@@ -0,0 +1,104 @@
+# coding: utf-8
+from __future__ import unicode_literals
+import pickle
+import threading
+
+import mock
+import pytest
+from django import forms, template
+from django.forms.formsets import formset_factory
+
+from forme import compiler, loader
+from forme.loader import load_style
+from forme.styles import Style
+
+
+class Form(forms.Form):
+    username = forms.CharField(label='User <name>')
+    token = forms.CharField(widget=forms.HiddenInput, initial='x')
+    choice = forms.ChoiceField(choices=[(1, 'One'), (2, 'Two')])
+
+    def clean(self):
+        raise forms.ValidationError('Invalid <login>')
+
+
+def render(template_string, **context):
+    tmpl = template.Template('{% load forme %}' + template_string)
+    return tmpl.render(template.Context(context))
+
+
+@pytest.mark.parametrize('template_string, context', [
+    ('{% forme form %}', {'form': Form()}),
+    ('{% forme form %}', {'form': Form(data={'username': '<b>'})}),
+    ('{% forme formset %}', {'formset': formset_factory(Form)()}),
+    ('{% autoescape off %}{% forme form %}{% endautoescape %}',
+     {'form': Form(data={'username': '<b>'})}),
+])
+def test_same_output(template_string, context):
+    with mock.patch('forme.settings.FORME_COMPILE_STYLES', False):
+        expected = render(template_string, **context)
+    with mock.patch.object(compiler, 'render_variable',
+                           wraps=compiler.render_variable) as render_variable:
+        # Renderer is compiled again, so it uses the mock.
+        with mock.patch.object(loader.styles['bare'], 'renderer', None):
+            assert render(template_string, **context) == expected
+    assert render_variable.called
+
+
+def test_renderer_shared():
+    tmpl = template.Template('{% load forme %}{% forme form %}')
+    node = tmpl.nodelist[1]
+    renderer = node.get_renderer()
+    assert renderer is not None
+    # Style of tag overlays the shared one without changes.
+    assert node.styles is not loader.styles['bare']
+    assert loader.styles['bare'].renderer is renderer
+
+    tmpl = template.Template('{% load forme %}{% forme form using %}'
+                             '{% fieldset %}{% endforme %}')
+    assert tmpl.nodelist[1].get_renderer() is None
+
+
+def test_lock_per_style():
+    style, other = [load_style(template.Template(
+        '{% load forme %}{% forme using %}'
+        '{% fieldset using %}{% field %}{% endfieldset %}'
+        '{% field using %}{% label %}{% input %}{% endfield %}'
+        '{% label using %}' + label + '{% endlabel %}'
+        '{% input using %}{{ field }}{% endinput %}{% endforme %}'))
+        for label in ['{{ label }}', '<b>{{ label }}</b>']]
+    lock = threading.Lock()
+    compiler._compile_locks[id(other)] = lock
+    try:
+        with lock:
+            # Style compiles while other style is being compiled.
+            assert compiler.get_renderer(style) is not None
+    finally:
+        del compiler._compile_locks[id(other)]
+    assert id(style) not in compiler._compile_locks
+
+
+@pytest.mark.parametrize('template_string', [
+    '{% label using %}{{ label|upper }}{% endlabel %}',
+    '{% label using %}{{ label.id }}{% endlabel %}',
+    '{% label using %}{% if label %}{{ label }}{% endif %}{% endlabel %}',
+    '{% label using %}{{ forloop }}{% endlabel %}',
+    '{% label using %}{% endlabel %}',
+    '{% fieldset using %}{% field "username" %}{% endfieldset %}',
+])
+def test_not_compilable(template_string):
+    style = load_style(template.Template(
+        '{% load forme %}{% forme using %}'
+        '{% fieldset using %}{% field %}{% endfieldset %}'
+        '{% field using %}{% label %}{% input %}{% endfield %}'
+        '{% label using %}{{ label }}{% endlabel %}'
+        '{% input using %}{{ field }}{% endinput %}' + template_string +
+        '{% endforme %}'))
+    assert compiler.get_renderer(style) is None
+    assert style.renderer is False
+
+
+def test_pickle():
+    style = Style()
+    style.renderer = lambda context, form, choices_cache: ''
+    assert pickle.loads(pickle.dumps(style)).renderer is None
@@ -1,11 +1,14 @@
 # coding: utf-8
 from __future__ import unicode_literals
 
+import mock
 import pytest
 from django import forms
 from django import template
 
-from forme.context import Label, update_context
+from forme.context import (Fieldset, FormFields, Label, LazyList,
+                           RenderFrame, get_form_fields, render_frame,
+                           update_context)
 
 
 def test_push_context():
@@ -15,6 +18,55 @@ def test_push_context():
     assert context['field'] == 'Foo'
 
 
+def test_push_context_exception():
+    context = template.Context({'field': 'Foo'})
+    depth = len(context.dicts)
+    with pytest.raises(ValueError):
+        with update_context(context, {'field': 'Bar'}):
+            # Simulate node which failed to pop context
+            context.update({'field': 'Baz'})
+            raise ValueError
+    assert len(context.dicts) == depth
+    assert context['field'] == 'Foo'
+
+
+def test_render_frame():
+    context = template.Context({'field': 'Foo'})
+    depth = len(context.dicts)
+    with render_frame(context, {'form': 'Form'}):
+        frame = context.dicts[-1]
+        assert isinstance(frame, RenderFrame)
+
+        with update_context(context, {'field': 'Bar', 'label': 'Label'}):
+            # Variables are set in frame, no dict is pushed
+            assert context.dicts[-1] is frame
+            assert context['field'] == 'Bar'
+            assert context['label'] == 'Label'
+
+            with update_context(context, {'field': 'Baz'}):
+                assert context['field'] == 'Baz'
+            assert context['field'] == 'Bar'
+
+        assert context['field'] == 'Foo'
+        assert 'label' not in context
+
+        # Frame isn't on top, dict is pushed
+        context.update({'loop': 1})
+        with update_context(context, {'field': 'Bar'}):
+            assert len(context.dicts) == depth + 3
+            assert context['field'] == 'Bar'
+        assert 'field' not in frame
+        context.pop()
+
+        with pytest.raises(ValueError):
+            with update_context(context, {'field': 'Bar'}):
+                raise ValueError
+        assert 'field' not in frame
+
+    assert len(context.dicts) == depth
+    assert context['field'] == 'Foo'
+
+
 class TestLabel:
     @pytest.fixture
     def field(self):
@@ -36,3 +88,69 @@ class TestLabel:
         rendered = template.Template('{{ label }}').render(ctx)
         rendered_tag = template.Template('{{ label.tag }}').render(ctx)
         assert rendered == rendered_tag == str(label)
+
+    def test_label_lazy(self, field):
+        with mock.patch.object(field, 'label_tag') as label_tag:
+            label = Label.create(field)
+            assert label.label == 'Field'
+            assert not label_tag.called
+
+            label.tag
+            label.tag
+            assert label_tag.call_count == 1
+
+
+def test_lazy_list():
+    func = mock.Mock(return_value=iter([1, 2]))
+    items = LazyList(func)
+    assert not func.called
+
+    ctx = template.Context({'items': items})
+    rendered = template.Template('{% if items %}{{ items|length }}:'
+                                 '{% for i in items %}{{ i }}{% endfor %}'
+                                 '{% endif %}').render(ctx)
+    assert rendered == '2:12'
+    assert func.call_count == 1
+
+
+def test_fieldset_index():
+    form = forms.Form()
+    form.fields['username'] = forms.Field()
+    form.fields['password'] = forms.Field()
+
+    fieldset = Fieldset(form)
+    assert [field.name for field in fieldset] == ['username', 'password']
+    assert fieldset.index['password'].name == 'password'
+    # Index is built only once
+    assert fieldset.index is fieldset.index
+
+
+def test_form_fields():
+    class Form(forms.Form):
+        username = forms.CharField()
+        token = forms.CharField(widget=forms.HiddenInput)
+
+    form = Form(data={})
+    fields = FormFields(form)
+    username = fields['username']
+    # Bound fields are created only once
+    assert fields['username'] is username
+    assert list(fields)[0] is username
+    assert fields.fieldset.index['token'] is fields['token']
+    assert fields.hidden_fields == [fields['token']]
+    assert fields.visible_fields == [username]
+    assert fields.has_hidden_fields()
+    with pytest.raises(KeyError):
+        fields['missing']
+
+    errors = fields.get_errors(username)
+    assert errors == username.errors
+    assert fields.get_errors(username) is errors
+    # Fields of other forms aren't cached
+    other = Form()['username']
+    assert fields.get_errors(other) == other.errors
+    assert 'username' in fields.errors and len(fields.errors) == 1
+
+    context = template.Context({'forme_fields': fields})
+    assert get_form_fields(context, form) is fields
+    assert get_form_fields(context, Form()) is not fields
@@ -0,0 +1,187 @@
+# coding: utf-8
+from __future__ import unicode_literals
+import re
+
+import pytest
+from django import forms, template
+from django.forms.formsets import formset_factory
+
+from forme import benchmark, loader
+
+jinja2 = pytest.importorskip('jinja2')
+
+from forme.jinja import FormeExtension
+
+
+class Form(forms.Form):
+    username = forms.CharField(label='User <name>')
+    token = forms.CharField(widget=forms.HiddenInput, initial='x')
+    choice = forms.ChoiceField(choices=[(1, 'One'), (2, 'Two')])
+
+    def clean(self):
+        raise forms.ValidationError('Invalid <login>')
+
+
+def get_environment(**options):
+    return jinja2.Environment(loader=jinja2.PackageLoader('forme', 'jinja2'),
+                              extensions=[FormeExtension], **options)
+
+
+def get_extension(environment):
+    return list(environment.extensions.values())[0]
+
+
+def normalize(output):
+    # Whitespace of Jinja2 style differs.
+    return re.sub(r'>\s+<', '><', output.strip())
+
+
+def render(template_string, **context):
+    tmpl = template.Template('{% load forme %}' + template_string)
+    return tmpl.render(template.Context(context))
+
+
+@pytest.mark.parametrize('template_string, context', [
+    ('{% forme form %}', {'form': Form()}),
+    ('{% forme form %}', {'form': Form(data={'username': '<b>'})}),
+    ('{% forme formset %}', {'formset': formset_factory(Form)()}),
+    ('{% forme form using %}{% fieldset "choice username" %}{% endforme %}',
+     {'form': Form()}),
+] + [(source.replace('{% load forme %}', ''), context_factory())
+     for name, source, context_factory in benchmark.get_scenarios()
+     if name in ('bound-100', 'overrides-100')])
+def test_same_output(template_string, context):
+    environment = get_environment(autoescape=True)
+    output = environment.from_string(template_string).render(context)
+    assert normalize(output) == normalize(render(template_string, **context))
+
+
+def test_jinja_templates():
+    environment = get_environment(autoescape=True)
+    tmpl = environment.from_string(
+        '{% forme form using %}'
+        '{% fieldset using %}'
+        '{% for name in names %}<p>{% field name %}</p>{% endfor %}'
+        '{% endfieldset %}'
+        '{% field using %}{% label %}{% endfield %}'
+        '{% label using %}{{ label.label|upper }}{% endlabel %}'
+        '{% endforme %}')
+    output = tmpl.render(form=Form(), names=['choice', 'username'])
+    assert output == '<p>CHOICE</p><p>USER &lt;NAME&gt;</p>'
+
+    # Loop variables are visible to forme tags.
+    tmpl = environment.from_string(
+        '{% for form in forms %}{% forme form %}{% endfor %}')
+    output = tmpl.render(forms=[Form(), Form()])
+    assert output.count('name="username"') == 2
+
+
+def test_styles():
+    environment = get_environment()
+    extension = get_extension(environment)
+    tmpl = environment.from_string('{% forme form %}')
+    count = len(extension.nodes)
+    # Identical tags share one node
+    environment.from_string('<div>{% forme form %}</div>')
+    assert len(extension.nodes) == count
+
+    tmpl.render(form=Form())
+    style = extension.styles['bare']
+    assert style is not loader.styles['bare']
+    # Jinja2 style is translated to Django nodes and compiled.
+    assert style.renderer
+
+
+def test_nested_tags_shared():
+    environment = get_environment()
+    extension = get_extension(environment)
+    source = ('{% forme form using %}{% if form %}{% fieldset using %}'
+              '<f>{% field %}</f>{% endfieldset %}{% endif %}'
+              '{% fieldset %}{% endforme %}')
+    tmpl = environment.from_string(source)
+    count = len(extension.nodes)
+    # Identical tags with nested tags share one node in other templates.
+    for header in ('<h1>Title</h1>', '<h2>Other</h2>\n'):
+        other = environment.from_string(header + source)
+        assert other.render(form=Form()) == header + tmpl.render(form=Form())
+    assert len(extension.nodes) == count
+
+
+def test_style_target():
+    environment = get_environment()
+    environment.loader = jinja2.ChoiceLoader([
+        jinja2.DictLoader({'tenant.html': (
+            '{% forme using %}<t>{% fieldset using %}{% field %}'
+            '{% endfieldset %}</t>{% field using %}{{ field.name }},'
+            '{% endfield %}{% endforme %}')}),
+        environment.loader])
+    tmpl = environment.from_string('{% forme form style name %}')
+    assert tmpl.render(form=Form(), name='tenant.html') == (
+        '<t>username,token,choice,</t>')
+    assert 'type="hidden"' in tmpl.render(form=Form(), name=None)
+
+
+@pytest.mark.parametrize('template_string', [
+    '{% forme 1 %}',
+    '{% forme form using %}{% forme form %}{% endforme %}',
+])
+def test_syntax_error(template_string):
+    with pytest.raises(jinja2.TemplateSyntaxError):
+        get_environment().from_string(template_string)
+
+
+def test_missing_node():
+    environment = get_environment()
+    tmpl = environment.from_string(
+        '{% for form in forms %}<p>{% forme form %}</p>{% endfor %}')
+    expected = tmpl.render(forms=[Form()])
+    # Nodes are parsed again from source of template.
+    get_extension(environment).nodes.clear()
+    assert tmpl.render(forms=[Form()]) == expected
+
+
+def test_nodes_limit():
+    environment = get_environment()
+    extension = get_extension(environment)
+    extension.nodes.max_entries = 2
+
+    templates = [environment.from_string(
+        '{{% forme form using %}}<{0}>{{% fieldset %}}{{% endforme %}}'
+        .format(i)) for i in range(5)]
+    assert len(extension.nodes) == 2
+    for i, tmpl in enumerate(templates):
+        assert tmpl.render(form=Form()).startswith('<{0}>'.format(i))
+    assert len(extension.nodes) == 2
+
+
+def test_bytecode_cache():
+    class BytecodeCache(jinja2.BytecodeCache):
+        def __init__(self):
+            self.cache = {}
+
+        def load_bytecode(self, bucket):
+            if bucket.key in self.cache:
+                bucket.bytecode_from_string(self.cache[bucket.key])
+
+        def dump_bytecode(self, bucket):
+            self.cache[bucket.key] = bucket.bytecode_to_string()
+
+    bytecode_cache = BytecodeCache()
+    templates = jinja2.DictLoader({'form.html': '<p>{% forme form %}</p>'})
+
+    def render():
+        environment = get_environment(bytecode_cache=bytecode_cache)
+        environment.loader = jinja2.ChoiceLoader([templates,
+                                                  environment.loader])
+        return environment.get_template('form.html').render(form=Form())
+
+    expected = render()
+    assert len(bytecode_cache.cache) == 1
+    # Template is loaded from bytecode cache by new environment.
+    assert render() == expected
+
+
+def test_benchmark():
+    results = benchmark.run(repeat=1, names=['jinja2:fields-10'])
+    assert list(results['results']) == ['jinja2:fields-10']
+    assert results['meta']['jinja2'] == jinja2.__version__
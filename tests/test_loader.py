@@ -1,11 +1,27 @@
 # coding: utf-8
 from __future__ import unicode_literals
+import os
+import pickle
+import re
+import subprocess
+import sys
+import threading
+import time
 
+import mock
 import pytest
-from django.template import Template, TemplateDoesNotExist
+from django import forms
+from django.core.management import call_command
+from django.forms.formsets import formset_factory
+from django.template import (Context, Node, NodeList, Template,
+                             TemplateDoesNotExist, TextNode, defaulttags)
+from django.test.utils import override_settings
+from django.utils.six import StringIO
 
+from forme import compiler, loader
 from forme.exceptions import FormeInvalidTemplate
-from forme.loader import load_style, preload_styles
+from forme.loader import get_default_style, load_style, preload_styles
+from forme.nodes import FormeNode
 from forme.styles import Style
 
 
@@ -39,14 +55,414 @@ def test_load_style_missing_tag():
         load_style(template)
 
 
+class CompactForm(forms.Form):
+    username = forms.CharField(label='User <name>')
+    token = forms.CharField(widget=forms.HiddenInput, initial='x')
+    choice = forms.ChoiceField(choices=[(1, 'One'), (2, 'Two')])
+
+    def clean(self):
+        raise forms.ValidationError('Invalid <login>')
+
+
+def iter_text_nodes(style):
+    for tmpl in style.flatten().values():
+        for node in tmpl.template.get_nodes_by_type(TextNode):
+            yield node
+        for node in tmpl.template.get_nodes_by_type(defaulttags.CommentNode):
+            yield node
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+@pytest.mark.parametrize('form', [
+    CompactForm(), CompactForm(data={'username': '<b>'}),
+    formset_factory(CompactForm, extra=2)(),
+])
+def test_compact_style(compiled, form):
+    from forme import shortcuts
+    style = load_style('forme/bare.html')
+    compact = load_style('forme/bare.html', compact=True)
+    assert len(list(iter_text_nodes(compact))) < len(
+        list(iter_text_nodes(style)))
+
+    with mock.patch('forme.settings.FORME_COMPILE_STYLES', compiled):
+        expected = shortcuts.render(form, style=style)
+        output = shortcuts.render(form, style=compact)
+    # The same markup, only whitespace between tags is collapsed.
+    assert len(output) < len(expected)
+    assert re.sub(r'\s+', ' ', output) == re.sub(r'\s+', ' ', expected)
+
+
+def test_compact_nodelist():
+    template = Template(
+        '{% load forme %}{% forme using %}{% label using %}'
+        '  {# comment #} {% comment %}x{% endcomment %}\n  '
+        '{% for i in label %} {{ i }} {% endfor %}'
+        '{% filter upper %}a  {# comment #}  b{% endfilter %}'
+        '{% endlabel %}{% endforme %}')
+    style = load_style(template, compact=True)
+    nodelist = style['label'].template
+    assert [node.s for node in nodelist.get_nodes_by_type(TextNode)] == [
+        '\n', ' ', ' ', 'a  ', '  b']
+
+
+def test_compact_custom_tag():
+    class PreNode(Node):
+        def __init__(self, nodelist):
+            self.nodelist = nodelist
+
+        def render(self, context):
+            return '<pre>{0}</pre>'.format(self.nodelist.render(context))
+
+    template = Template(
+        '{% load forme %}{% forme using %}{% label using %}'
+        '{{ label }}{% endlabel %}{% endforme %}')
+    forme = template.nodelist.get_nodes_by_type(FormeNode)[0]
+    forme.styles['label'].template[:] = [
+        PreNode(NodeList([TextNode('a\n  '), TextNode('  \n  b')]))]
+
+    style = load_style(template, compact=True)
+    nodelist = style['label'].template
+    # Unknown tag is kept as it is.
+    assert [node.s for node in nodelist.get_nodes_by_type(TextNode)] == [
+        'a\n  ', '  \n  b']
+
+
+def test_compact_copy():
+    template = Template(
+        '{% load forme %}{% forme using %}{% fieldset using %}<p>  '
+        '{% field %}  </p>{% endfieldset %}{% field using %}  {# x #}  '
+        '{{ field.name }}{% endfield %}{% endforme %}')
+    text = [node.s for node in template.nodelist.get_nodes_by_type(TextNode)]
+
+    compact = load_style(template, compact=True)
+    # Template (e.g. from cached loader) isn't modified.
+    assert [node.s for node in template.nodelist.get_nodes_by_type(
+        TextNode)] == text
+    style = load_style(template)
+    assert style['field'].template is not compact['field'].template
+    assert len(list(iter_text_nodes(compact))) < len(
+        list(iter_text_nodes(style)))
+
+    from forme import shortcuts
+    form = CompactForm()
+    output = shortcuts.render(form, style=compact)
+    assert output == '<p>   username token choice  </p>'
+    assert shortcuts.render(form, style=style) == (
+        '<p>      username    token    choice  </p>')
+
+
 def test_preload_styles_invalid_template():
     styles = preload_styles({'default': 'unknown/template'})
     with pytest.raises(TemplateDoesNotExist):
-        # Force evaluation on lazy object
-        bool(styles['default'])
+        styles['default']
 
 
 def test_preload_styles():
     styles = preload_styles()
     for node in styles.values():
         assert isinstance(node, Style)
+
+
+def test_get_default_style():
+    styles = preload_styles()
+    style = get_default_style(styles)
+    assert isinstance(style, Style)
+    assert style.extends(styles['bare'])
+
+    # Default style is shared, not copied.
+    another_style = get_default_style(styles)
+    assert another_style is not style
+    assert another_style.base is style.base
+
+
+def style_template(name):
+    return Template('{% load forme %}{% forme using %}' + name +
+                    '{% endforme %}')
+
+
+def test_registry():
+    templates = dict((name, style_template(name))
+                     for name in ('first', 'second', 'third'))
+    styles = preload_styles(templates)
+    assert sorted(styles.keys()) == ['first', 'second', 'third']
+    assert not styles.is_loaded('first')
+
+    # Each name has its own style
+    for name in templates:
+        assert styles[name]['forme'].template.render(None) == name
+
+    # Style is loaded only once
+    with mock.patch('forme.loader.load_style') as load:
+        styles['first']
+        assert styles.load('second') == 0.0
+    assert not load.called
+
+
+def load_named_style(name):
+    if isinstance(name, Template):
+        return load_style(name)
+    return load_style(style_template(name))
+
+
+def test_registry_loaded_styles():
+    load = mock.Mock(side_effect=load_named_style)
+    styles = loader.StyleRegistry({'first': style_template('first')},
+                                  load_style=load)
+    with mock.patch('forme.settings.FORME_STYLE_CACHE_MAX_ENTRIES', 2):
+        # Configured styles aren't evicted
+        assert styles.get_style('first') is styles['first']
+        a = styles.get_style('a')
+        assert a['forme'].template.render(None) == 'a'
+        assert styles.get_style('a') is a
+        assert load.call_count == 2
+
+        styles.get_style('b')
+        styles.get_style('c')
+        assert styles.get_style('a') is not a
+        assert load.call_count == 5
+
+    stats = styles.stats()
+    assert stats['styles'] == 1
+    assert stats['loaded'] == 2
+    assert stats['loaded_size'] == 2 * loader.get_style_size(a)
+
+
+def test_registry_loaded_size():
+    styles = loader.StyleRegistry({}, load_style=load_named_style)
+    size = loader.get_style_size(styles.get_style('a'))
+    assert size > 0
+
+    styles = loader.StyleRegistry({}, load_style=load_named_style)
+    with mock.patch('forme.settings.FORME_STYLE_CACHE_MAX_SIZE', size + 1):
+        styles.get_style('a')
+        styles.get_style('b')
+    assert styles.stats()['loaded'] == 1
+    assert styles.stats()['loaded_size'] == size
+
+
+def test_registry_loaded_once():
+    loaded = []
+
+    def load(name):
+        loaded.append(name)
+        time.sleep(0.05)
+        return load_named_style(name)
+
+    styles = loader.StyleRegistry({}, load_style=load)
+    with mock.patch.object(compiler, 'StyleCompiler',
+                           wraps=compiler.StyleCompiler) as compile_style:
+        threads = [threading.Thread(target=styles.get_style, args=('a',))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    # Concurrent renders wait for the first one to load and compile style.
+    assert loaded == ['a']
+    assert compile_style.call_count == 1
+    assert styles.get_style('a').renderer
+    assert not styles._style_locks
+
+
+@pytest.mark.parametrize('threads', [None, 4])
+def test_warmup(threads):
+    templates = dict((str(i), style_template(str(i))) for i in range(8))
+    styles = preload_styles(templates)
+    times = styles.warmup(threads=threads)
+
+    assert sorted(times) == sorted(templates)
+    assert all(styles.is_loaded(name) for name in templates)
+    assert all(time >= 0 for time in times.values())
+
+
+def test_warmup_command():
+    stdout = StringIO()
+    styles = preload_styles({'bare': 'forme/bare.html'})
+    with mock.patch.object(loader, 'styles', styles):
+        call_command('forme_warmup', stdout=stdout)
+    assert stdout.getvalue().startswith('bare: ')
+    assert styles.is_loaded('bare')
+
+
+class TestCompiledStyles(object):
+    template_name = 'forme/bare.html'
+
+    def render(self, style):
+        form = forms.Form()
+        form.fields['name'] = forms.CharField()
+        with mock.patch.object(loader, 'styles', {'bare': style}):
+            tmpl = Template('{% load forme %}{% forme form %}')
+            return tmpl.render(Context({'form': form}))
+
+    def test_load(self, tmpdir):
+        compiled = loader.CompiledStyles(str(tmpdir))
+        style = compiled.load(self.template_name)
+        assert len(tmpdir.listdir()) == 1
+
+        with mock.patch('forme.loader.load_style') as load:
+            cached_style = compiled.load(self.template_name)
+        assert not load.called
+        assert cached_style is not style
+        assert self.render(cached_style) == self.render(style)
+
+    def test_source_changed(self, tmpdir):
+        compiled = loader.CompiledStyles(str(tmpdir))
+        compiled.load(self.template_name)
+
+        source = loader.get_template_source(self.template_name)
+        with mock.patch('forme.loader.get_template_source',
+                        return_value=source.replace('{{ label }}', 'Label')):
+            style = compiled.load(self.template_name)
+        assert len(tmpdir.listdir()) == 2
+        assert 'Label' in self.render(style)
+
+    def test_broken_file(self, tmpdir):
+        compiled = loader.CompiledStyles(str(tmpdir))
+        source = loader.get_template_source(self.template_name)
+        with open(compiled.get_path(source), 'wb') as cache_file:
+            cache_file.write(b'broken')
+
+        style = compiled.load(self.template_name)
+        assert isinstance(style, Style)
+        with open(compiled.get_path(source), 'rb') as cache_file:
+            assert cache_file.read() != b'broken'
+
+    def test_unsigned_file(self, tmpdir):
+        compiled = loader.CompiledStyles(str(tmpdir))
+        source = loader.get_template_source(self.template_name)
+        planted = Style()
+        planted.signature = 'planted'
+        with open(compiled.get_path(source), 'wb') as cache_file:
+            cache_file.write(pickle.dumps(planted))
+        assert compiled.load(self.template_name).signature != 'planted'
+
+        # Signed by other key.
+        with open(compiled.get_path(source), 'wb') as cache_file:
+            data = pickle.dumps(({}, planted))
+            cache_file.write(compiled.sign(b'other') + data)
+        assert compiled.load(self.template_name).signature != 'planted'
+
+    def test_included_changed(self, tmpdir):
+        templates = tmpdir.mkdir('templates')
+        templates.join('style.html').write(
+            '{% load forme %}{% forme using %}{% fieldset using %}'
+            '{% include "part.html" %}{% endfieldset %}{% endforme %}')
+        templates.join('part.html').write('first')
+        compiled = loader.CompiledStyles(str(tmpdir.mkdir('cache')))
+
+        # Origins of debug templates can't be serialized.
+        with override_settings(TEMPLATE_DIRS=[str(templates)],
+                               TEMPLATE_DEBUG=False):
+            assert 'first' in self.render(compiled.load('style.html'))
+            assert len(tmpdir.join('cache').listdir()) == 1
+            templates.join('part.html').write('second')
+            assert 'second' in self.render(compiled.load('style.html'))
+
+    def test_not_serializable(self, tmpdir):
+        source = ('{% load forme %}{% forme using %}'
+                  '{% if form and form.prefix %}{% endif %}{% endforme %}')
+        compiled = loader.CompiledStyles(str(tmpdir))
+        with mock.patch('forme.loader.get_template_source',
+                        return_value=source):
+            assert isinstance(compiled.load('style.html'), Style)
+        assert len(tmpdir.listdir()) == 0
+
+    def test_registry(self, tmpdir):
+        styles = preload_styles({'bare': self.template_name})
+        with mock.patch('forme.settings.FORME_STYLE_CACHE_DIR', str(tmpdir)):
+            styles.warmup()
+        assert len(tmpdir.listdir()) == 1
+
+
+def test_preload():
+    tmpl = Template('{% load forme %}{% forme form %}')
+    node = tmpl.nodelist.get_nodes_by_type(FormeNode)[0]
+    styles = preload_styles({'bare': 'forme/bare.html'})
+    get_template = loader.loader.get_template
+
+    def get_template_mock(name):
+        return tmpl if name == 'form.html' else get_template(name)
+
+    with mock.patch.object(loader, 'styles', styles), \
+            mock.patch('forme.loader.gc') as gc, \
+            mock.patch('django.template.loader.get_template',
+                       side_effect=get_template_mock):
+        assert loader.preload(['form.html']) == [tmpl]
+
+    assert styles.is_loaded('bare')
+    assert styles['bare']._flat is not None
+    assert styles['bare'].renderer
+    assert node.cacheable is not None
+    assert gc.freeze.called
+
+
+PRELOAD_BENCHMARK = '''
+import os
+import sys
+
+from django.conf import settings
+settings.configure(INSTALLED_APPS=('forme',))
+import django
+if hasattr(django, 'setup'):
+    django.setup()
+
+from django import forms, template
+from forme import compiler, loader
+
+
+class Form(forms.Form):
+    name = forms.CharField()
+    email = forms.EmailField()
+
+
+def private_memory():
+    total = 0
+    with open('/proc/self/smaps') as smaps:
+        for line in smaps:
+            if line.startswith(('Private_Clean', 'Private_Dirty')):
+                total += int(line.split()[1])
+    return total
+
+
+if sys.argv[1] == 'preload':
+    loader.preload()
+
+tmpl = template.Template('{% load forme %}{% forme form %}')
+memory = []
+for i in range(4):
+    read, write = os.pipe()
+    pid = os.fork()
+    if not pid:
+        before = private_memory()
+        tmpl.render(template.Context({'form': Form()}))
+        os.write(write, str(private_memory() - before).encode())
+        os._exit(0)
+    os.close(write)
+    os.waitpid(pid, 0)
+    memory.append(int(os.read(read, 64)))
+    os.close(read)
+print(sum(memory) // len(memory))
+'''
+
+
+@pytest.mark.profiling
+@pytest.mark.skipif(not hasattr(os, 'fork') or
+                    not os.path.exists('/proc/self/smaps'),
+                    reason='Requires fork and /proc/self/smaps')
+def test_profiling_preload():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+
+    memory = {}
+    for mode in ('lazy', 'preload'):
+        output = subprocess.check_output(
+            [sys.executable, '-c', PRELOAD_BENCHMARK, mode], env=env)
+        memory[mode] = int(output)
+
+    print('-' * 40)
+    print('Private memory of worker after first render')
+    for mode in ('lazy', 'preload'):
+        print('{0:<8} {1} kB'.format(mode, memory[mode]))
+    print('Saved    {0} kB per worker'.format(memory['lazy'] -
+                                              memory['preload']))
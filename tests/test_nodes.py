@@ -1,14 +1,19 @@
 # coding: utf-8
 from __future__ import unicode_literals
 import copy
+import gc
+import threading
+import weakref
 
 import mock
 import pytest
 from django import forms
 from django import template
+from django.utils import translation
 
-from forme import nodes
-from forme.context import Label
+import forme
+from forme import cache, loader, nodes, styles
+from forme.context import Fieldset, Label
 from forme.parser import FormeParser
 from forme.nodes import FormeNode
 from forme.styles import Default
@@ -170,6 +175,31 @@ class TestNodeTemplates:
         assert text_node(forme) == 'Parent'
         assert text_node(fieldset) == 'Child'
 
+    def test_flattened_templates(self):
+        tmpl = ('{% forme using %}'
+                '{% field using %}Parent{% endfield %}'
+                '{% fieldset "username" using %}'
+                '{% label using %}Child{% endlabel %}'
+                '{% endfieldset %}{% endforme %}')
+
+        forme = tag2nodes(tmpl)[0]
+        fieldset = forme.nodelist.get_nodes_by_type(nodes.FieldsetNode)[0]
+        assert fieldset.root is forme
+        assert list(fieldset.templates) == [('label', Default)]
+
+        context = template.Context()
+        with mock.patch.object(styles.Style, 'resolve') as resolve:
+            label = fieldset.get_template('label', None, context)
+            field = fieldset.get_template('field', None, context)
+            # Literal targets are looked up by value.
+            target = template.Variable('"username"')
+            username = fieldset.get_template('fieldset', target, context)
+        assert not resolve.called
+
+        assert label.template[0].s == 'Child'
+        assert field.template[0].s == 'Parent'
+        assert username is forme.styles.flatten()['fieldset', 'username']
+
 
 class TestNodeBase(object):
     @pytest.fixture
@@ -238,6 +268,74 @@ class TestLabelNode(TestNodeBase):
         assert label == Label.create(field)
 
 
+class TestLazyValues(TestNodeBase):
+    def render(self, template_string, **context):
+        tmpl = template.Template('{% load forme %}' + template_string)
+        return tmpl.render(template.Context(context))
+
+    def test_label_tag_not_rendered(self):
+        class Form(forms.Form):
+            name = forms.CharField()
+
+        with mock.patch.object(forms.forms.BoundField, 'label_tag') as tag:
+            rendered = self.render(
+                '{% forme form replace %}'
+                '{% field using %}{% label %}{% endfield %}'
+                '{% label using %}{{ label.label }}{% endlabel %}'
+                '{% endforme %}', form=Form())
+        assert not tag.called
+        assert rendered.strip() == 'Name'
+
+    def test_unused_values(self):
+        class Form(forms.Form):
+            name = forms.CharField(widget=forms.HiddenInput)
+
+        with mock.patch.object(nodes, 'Label') as label, \
+                mock.patch.object(Form, 'hidden_fields') as hidden_fields:
+            rendered = self.render(
+                '{% forme form using %}'
+                '{% hiddenfields using %}hidden{% endhiddenfields %}'
+                '{% fieldset %}{% label using %}label{% endlabel %}'
+                '{% endforme %}', form=Form())
+        assert not label.create.called
+        assert not hidden_fields.called
+        assert rendered.startswith('hidden')
+        assert 'label' in rendered
+
+
+class TestFieldNode(TestNodeBase):
+    @pytest.fixture
+    def fieldset(self):
+        form = forms.Form()
+        for name in ('username', 'email', 'password'):
+            form.fields[name] = forms.Field()
+        return Fieldset(form)
+
+    def render(self, tag, **context):
+        node = tag2nodes(tag + '{{ field.name }},{% endfield %}')[0]
+        return node.render(template.Context(context))
+
+    def test_all_fields(self, fieldset):
+        rendered = self.render('{% field using %}', fieldset=fieldset)
+        assert rendered == 'username,email,password,'
+
+    def test_targets(self, fieldset):
+        rendered = self.render('{% field "password username" using %}',
+                               fieldset=fieldset)
+        assert rendered == 'password,username,'
+
+    def test_variable_targets(self, fieldset):
+        rendered = self.render('{% field name "email" bound using %}',
+                               fieldset=fieldset, name='password',
+                               bound=fieldset.index['username'])
+        assert rendered == 'password,email,username,'
+
+    def test_unknown_target(self, fieldset):
+        rendered = self.render('{% field "missing email" using %}',
+                               fieldset=fieldset)
+        assert rendered == 'email,'
+
+
 class TestHiddenFieldsNode(TestNodeBase):
     def test_hiddenfields_no_fields(self):
         node = nodes.HiddenFieldsNode('hiddenfields', '', '')
@@ -248,3 +346,528 @@ class TestErrorsNoErrors(TestNodeBase):
     def test_errors_no_errors(self):
         node = nodes.NonFieldErrorsNode('nonfielderrors', '', '')
         assert node.render(template.Context({'form': forms.Form()})) == ''
+
+
+class TestFormFields(object):
+    class Form(forms.Form):
+        username = forms.CharField()
+        password = forms.CharField()
+        token = forms.CharField(widget=forms.HiddenInput)
+
+    @pytest.mark.parametrize('compiled', [True, False])
+    @pytest.mark.parametrize('template_string', [
+        '{% forme form %}',
+        '{% forme form using %}{% hiddenfields %}'
+        '{% fieldset "username" %}{% fieldset %}'
+        '{% field using %}{% errors %}{% errors %}{% input %}{% endfield %}'
+        '{% endforme %}',
+    ])
+    def test_computed_once(self, compiled, template_string):
+        form = self.Form(data={})
+        tmpl = template.Template('{% load forme %}' + template_string)
+        getitem = mock.patch.object(
+            self.Form, '__getitem__', autospec=True,
+            side_effect=forms.Form.__getitem__)
+        errors = mock.Mock(side_effect=forms.forms.BoundField.errors.fget)
+        with mock.patch('forme.settings.FORME_COMPILE_STYLES', compiled), \
+                mock.patch.object(forms.forms.BoundField, 'errors',
+                                  property(errors)), getitem as getitem:
+            rendered = tmpl.render(template.Context({'form': form}))
+        assert 'required' in rendered
+        assert getitem.call_count == len(form.fields)
+        assert errors.call_count == len(form.fields)
+
+    def test_formset(self):
+        formset = forms.formsets.formset_factory(self.Form, extra=3)()
+        tmpl = template.Template('{% load forme %}{% forme formset %}')
+        with mock.patch.object(self.Form, '__getitem__', autospec=True,
+                               side_effect=forms.Form.__getitem__) as getitem:
+            tmpl.render(template.Context({'formset': formset}))
+        assert getitem.call_count == 3 * len(formset.forms[0].fields)
+
+
+class TestRenderPlan(object):
+    class Form(forms.Form):
+        username = forms.CharField()
+        token = forms.CharField(widget=forms.HiddenInput)
+
+    @pytest.fixture(autouse=True)
+    def plans(self, request):
+        plans = cache.PlanCache()
+        p = mock.patch('forme.nodes.get_plan_cache', return_value=plans)
+        p.start()
+        request.addfinalizer(p.stop)
+        return plans
+
+    def render(self, tmpl, **context):
+        with mock.patch('forme.settings.FORME_COMPILE_STYLES', False):
+            return tmpl.render(template.Context(context))
+
+    def test_plan_shared(self, plans):
+        tmpl = template.Template('{% load forme %}{% forme form %}')
+        with mock.patch.object(FormeNode, 'get_template', autospec=True,
+                               side_effect=FormeNode.get_template) as lookup:
+            output = self.render(tmpl, form=self.Form())
+            count = lookup.call_count
+            assert self.render(tmpl, form=self.Form(data={})) != output
+            # Templates are looked up only once.
+            assert lookup.call_count == count
+
+        formset = forms.formsets.formset_factory(self.Form, extra=3)()
+        self.render(tmpl, form=formset)
+        assert plans.stats()['size'] == 1
+        assert plans.stats()['hits'] == 4
+
+        # Changed fields have different plan.
+        form = self.Form()
+        form.fields['token'].widget = forms.TextInput()
+        assert 'type="hidden"' not in self.render(tmpl, form=form)
+        assert plans.stats()['size'] == 2
+
+    def test_variable_targets(self, plans):
+        tmpl = template.Template(
+            '{% load forme %}{% forme form using %}'
+            '{% fieldset name using %}[{{ name }}]{% endfieldset %}'
+            '|{% fieldset "username" replace %}{% endfieldset %}'
+            '{% endforme %}')
+        form = self.Form()
+        rendered = self.render(tmpl, form=form, name='username')
+        assert rendered == '[username]|[username]'
+        # Templates depending on context aren't stored in plan.
+        rendered = self.render(tmpl, form=form, name='token').split('|')[1]
+        assert rendered.strip().startswith('<label for="id_username">')
+        assert plans.stats()['hits'] == 1
+
+
+TENANT_STYLE = (
+    '{{% load forme %}}{{% forme using %}}'
+    '<{0}>{{% fieldset using %}}{{% field %}}{{% endfieldset %}}</{0}>'
+    '{{% field using %}}{{% label %}}{{% endfield %}}'
+    '{{% label using %}}{{{{ label }}}}{{% endlabel %}}{{% endforme %}}')
+
+
+def load_tenant_style(template_name):
+    if template_name.startswith('tenants/'):
+        name = template_name.split('/')[1]
+        return loader.load_style(template.Template(TENANT_STYLE.format(name)))
+    return loader.load_style(template_name)
+
+
+def resolve_tenant(context):
+    return context.get('tenant')
+
+
+class TestStyleSelection(object):
+    class Form(forms.Form):
+        username = forms.CharField()
+
+    @pytest.fixture(autouse=True)
+    def registry(self, request):
+        registry = loader.StyleRegistry({'bare': 'forme/bare.html'},
+                                        load_style=load_tenant_style)
+        p = mock.patch.object(loader, 'styles', registry)
+        p.start()
+        request.addfinalizer(p.stop)
+        return registry
+
+    def render(self, template_string, **context):
+        tmpl = template.Template('{% load forme %}' + template_string)
+        context['form'] = self.Form()
+        return tmpl.render(template.Context(context))
+
+    @pytest.mark.parametrize('compiled', [True, False])
+    def test_style_target(self, registry, compiled):
+        with mock.patch('forme.settings.FORME_COMPILE_STYLES', compiled):
+            tag = '{% forme form style tenant %}'
+            assert '<a><label' in self.render(tag, tenant='tenants/a')
+            assert '<b><label' in self.render(tag, tenant='tenants/b')
+            assert '<a>' in self.render(tag, tenant='tenants/a')
+            # Default style
+            default = self.render('{% forme form %}')
+            assert self.render(tag, tenant=None) == default
+            assert self.render(tag, tenant='bare') == default
+            assert self.render('{% forme form style "tenants/a" %}') == (
+                self.render(tag, tenant='tenants/a'))
+        assert bool(registry.get_style('tenants/a').renderer) == compiled
+
+    def test_inline_templates(self, registry):
+        tmpl = template.Template(
+            '{% load forme %}{% forme form style tenant using %}'
+            '{% label using %}!{% endlabel %}[{% fieldset %}]'
+            '{% endforme %}')
+
+        def render(tenant):
+            context = {'form': self.Form(), 'tenant': tenant}
+            return tmpl.render(template.Context(context))
+
+        assert render('tenants/a') == '[!]'
+        assert render('tenants/a') == '[!]'
+        # Templates of tag overlay the selected style, overlay is shared.
+        assert len(registry.get_style('tenants/a')._overlays) == 1
+        assert 'type="text"' in render(None)
+
+    @pytest.mark.parametrize('resolver', [
+        resolve_tenant, 'test_nodes.resolve_tenant'])
+    def test_resolver(self, resolver):
+        with mock.patch('forme.settings.FORME_STYLE_RESOLVER', resolver):
+            assert '<a>' in self.render('{% forme form %}', tenant='tenants/a')
+            assert '<a>' not in self.render('{% forme form %}')
+            # Style of tag takes precedence.
+            assert '<b>' in self.render('{% forme form style "tenants/b" %}',
+                                        tenant='tenants/a')
+
+    @pytest.mark.parametrize('compiled', [True, False])
+    def test_evicted_styles(self, registry, compiled):
+        refs = []
+        with mock.patch('forme.settings.FORME_STYLE_CACHE_MAX_ENTRIES', 2), \
+                mock.patch('forme.settings.FORME_COMPILE_STYLES', compiled):
+            for i in range(10):
+                name = 'tenants/t{0}'.format(i)
+                assert '<t{0}>'.format(i) in self.render(
+                    '{% forme form style tenant %}', tenant=name)
+                self.render('{% forme form style tenant using %}'
+                            '{% label using %}!{% endlabel %}{% fieldset %}'
+                            '{% endforme %}', tenant=name)
+                assert '<t{0}>'.format(i) in forme.render(self.Form(),
+                                                          style=name)
+                refs.append(weakref.ref(registry.get_style(name)))
+
+        # Plans and nodes of evicted styles are released with them.
+        gc.collect()
+        assert [ref() is not None for ref in refs] == [False] * 8 + [True] * 2
+
+    def test_not_cached(self):
+        fragments = cache.FragmentCache(cache.LRUCache())
+        with mock.patch('forme.nodes.get_cache', return_value=fragments):
+            self.render('{% forme form style tenant %}', tenant='tenants/a')
+        assert fragments.stats()['misses'] == 0
+
+
+class TestThreadSafety(object):
+    class Form(forms.Form):
+        username = forms.CharField()
+        password = forms.CharField()
+
+    def test_variable_targets(self):
+        tmpl = template.Template(
+            '{% load forme %}{% forme form using %}'
+            '{% fieldset name using %}[{{ name }}]{% endfieldset %}'
+            '|{% fieldset "username" replace %}{% endfieldset %}'
+            '{% endforme %}')
+        forme = tmpl.nodelist.get_nodes_by_type(FormeNode)[0]
+        size = len(forme.styles.flatten())
+
+        def render(name):
+            context = template.Context({'form': self.Form(), 'name': name})
+            return tmpl.render(context)
+
+        expected = dict((name, render(name))
+                        for name in ('username', 'password'))
+        assert expected['username'] == '[username]|[username]'
+        rendered, fieldset = expected['password'].split('|')
+        assert rendered == '[password]'
+        assert fieldset.strip().startswith('<label for="id_username">')
+
+        errors = []
+
+        def worker(name):
+            for i in range(200):
+                if render(name) != expected[name]:
+                    errors.append(name)
+
+        threads = [threading.Thread(target=worker, args=(name,))
+                   for name in list(expected) * 4]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert not errors
+        assert len(forme.styles.flatten()) == size
+
+    def test_variable_targets_loop(self):
+        tmpl = template.Template(
+            '{% load forme %}{% for name in names %}{% forme form using %}'
+            '{% fieldset name using %}[{{ name }}]{% endfieldset %}'
+            '{% fieldset "username" replace %}{% endfieldset %}'
+            '{% fieldset "password" replace %}{% endfieldset %}'
+            '{% endforme %}|{% endfor %}')
+        output = tmpl.render(template.Context({
+            'form': self.Form(), 'names': ['username', 'password']}))
+        # Targets are resolved again in each iteration.
+        first, second = output.split('|')[:2]
+        assert first.startswith('[username][username]')
+        assert second.startswith('[password]')
+        assert second.endswith('[password]')
+        assert 'id_username' in second
+
+
+class TestRenderIter(object):
+    class Form(forms.Form):
+        username = forms.CharField()
+        password = forms.CharField()
+        next = forms.CharField(widget=forms.HiddenInput)
+
+        def clean(self):
+            raise forms.ValidationError('Invalid login')
+
+    @pytest.mark.parametrize('template_string', [
+        '{% forme form %}',
+        '{% forme form replace %}{% field using %}[{{ field.name }}]'
+        '{% endfield %}{% endforme %}',
+        '{% forme form using %}<div>{% fieldset "password username" %}</div>'
+        '{% hiddenfields %}{% nonfielderrors %}{% endforme %}',
+        '{% forme form using %}{% fieldset using %}'
+        '{% field "password" %}|{% field %}{% endfieldset %}'
+        '{% fieldset %}{% endforme %}',
+    ])
+    def test_render_iter(self, template_string):
+        tmpl = template.Template('{% load forme %}' + template_string)
+        context = lambda: template.Context({
+            'form': self.Form({'username': 'user'}),
+        })
+
+        chunks = list(nodes.render_iter(tmpl, context()))
+        assert ''.join(chunks) == tmpl.render(context())
+
+    @pytest.mark.parametrize('template_string', [
+        '{% extends base %}{% load forme %}{% block content %}'
+        '<b>{{ block.super }}</b>{% forme form %}{% endblock %}',
+        '{% if not form %}-{% elif form %}{% forme form %}{% endif %}',
+        '{% for form in forms %}{{ forloop.counter }}{% forme form %}'
+        '{% endfor %}',
+        '{% for form, title in titled %}{{ title }}{% forme form %}'
+        '{% empty %}-{% endfor %}',
+        '{% for form in forms reversed %}{% for item in items %}'
+        '{{ forloop.parentloop.revcounter }}{% forme form %}{% endfor %}'
+        '{% endfor %}',
+        '{% for form in missing %}{% empty %}{% forme forms.0 %}'
+        '{% endfor %}',
+        '{% with first=forms.0 %}{% forme first %}{% endwith %}',
+    ])
+    def test_render_iter_blocks(self, template_string):
+        if 'load' not in template_string:
+            template_string = '{% load forme %}' + template_string
+        tmpl = template.Template(template_string)
+        base = template.Template('<main>{% block content %}base'
+                                 '{% endblock %}</main>')
+        context = lambda: template.Context({
+            'base': base,
+            'form': self.Form({'username': 'user'}),
+            'forms': [self.Form(), self.Form({'username': 'user'})],
+            'titled': [(self.Form(), 'first'), (self.Form(), 'second')],
+            'items': [1],
+        })
+
+        chunks = list(nodes.render_iter(tmpl, context()))
+        assert ''.join(chunks) == tmpl.render(context())
+        # Form is streamed by fields.
+        assert len(chunks) > 5
+
+    def test_render_iter_backend_template(self):
+        class BackendTemplate(object):
+            # Template of Dj1.8+ backend.
+            def __init__(self, tmpl):
+                self.template = tmpl
+
+        tmpl = template.Template('{% load forme %}{% forme form %}')
+        context = lambda: template.Context({'form': self.Form()})
+        chunks = list(nodes.render_iter(BackendTemplate(tmpl), context()))
+        assert ''.join(chunks) == tmpl.render(context())
+
+
+class TestFormset(object):
+    class Form(forms.Form):
+        name = forms.CharField()
+        email = forms.EmailField()
+
+    @pytest.fixture
+    def formset(self):
+        FormSet = forms.formsets.formset_factory(self.Form, extra=3)
+        return FormSet(prefix='people')
+
+    def render(self, template_string, **context):
+        tmpl = template.Template('{% load forme %}' + template_string)
+        return tmpl.render(template.Context(context))
+
+    def test_formset(self, formset):
+        rendered = self.render('{% forme formset %}', formset=formset)
+
+        expected = [str(formset.management_form)]
+        expected.extend(self.render('{% forme form %}', form=form)
+                        for form in formset)
+        assert rendered == ''.join(expected)
+
+    def test_formset_render_iter(self, formset):
+        tmpl = template.Template('{% load forme %}{% forme formset %}')
+        context = lambda: template.Context({'formset': formset})
+
+        chunks = list(nodes.render_iter(tmpl, context()))
+        assert ''.join(chunks) == tmpl.render(context())
+
+    def test_formset_context(self, formset):
+        rendered = self.render(
+            '{% forme formset replace %}{% field using %}'
+            '{{ formset.prefix }}:{{ form.prefix }}:{{ field.name }};'
+            '{% endfield %}{% endforme %}', formset=formset)
+        rendered = ''.join(rendered.split())
+        assert rendered.endswith(
+            'people:people-0:name;people:people-0:email;'
+            'people:people-1:name;people:people-1:email;'
+            'people:people-2:name;people:people-2:email;')
+
+    def test_empty_form(self, formset):
+        tmpl = template.Template('{% load forme %}'
+                                 '{% forme formset.empty_form %}')
+        forme = tmpl.nodelist.get_nodes_by_type(FormeNode)[0]
+        context = lambda: template.Context({'formset': formset})
+
+        expected = self.render('{% forme form %}', form=formset.empty_form)
+        assert tmpl.render(context()) == expected
+        assert len(forme.empty_forms) == 1
+
+        with mock.patch.object(nodes.FormeNodeBase, 'render') as render:
+            assert tmpl.render(context()) == expected
+            assert ''.join(nodes.render_iter(tmpl, context())) == expected
+        assert not render.called
+
+    def test_empty_form_key(self):
+        class Form(forms.Form):
+            day = forms.CharField()
+            current = None
+
+            def __init__(self, *args, **kwargs):
+                super(Form, self).__init__(*args, **kwargs)
+                self.initial['day'] = self.current
+
+        FormSet = forms.formsets.formset_factory(Form)
+        tmpl = template.Template('{% load forme %}'
+                                 '{% forme formset.empty_form %}')
+        forme = tmpl.nodelist.get_nodes_by_type(FormeNode)[0]
+        render = lambda formset: tmpl.render(template.Context({
+            'formset': formset}))
+
+        # Initial values are set per instance.
+        for day in ('day-1', 'day-2'):
+            Form.current = day
+            assert day in render(FormSet(prefix='days'))
+        output = render(FormSet(prefix='days', auto_id='field_%s'))
+        assert 'id="field_days-__prefix__-day"' in output
+        assert 'id_days' not in output
+        assert len(forme.empty_forms) == 3
+
+    def test_empty_form_context(self, formset):
+        tmpl = template.Template(
+            '{% load forme %}{% forme formset.empty_form using %}'
+            '{% fieldset %}<u>{{ user }}</u>{% endforme %}')
+        forme = tmpl.nodelist.get_nodes_by_type(FormeNode)[0]
+
+        for user in ('alice', 'bob'):
+            output = tmpl.render(template.Context({'formset': formset,
+                                                   'user': user}))
+            assert '<u>{0}</u>'.format(user) in output
+        assert not forme.empty_forms
+
+
+class TestFragmentCache(object):
+    class Form(forms.Form):
+        name = forms.CharField()
+        email = forms.EmailField()
+
+    @pytest.fixture
+    def fragments(self, request):
+        fragments = cache.FragmentCache(cache.LRUCache())
+        p = mock.patch('forme.nodes.get_cache', return_value=fragments)
+        p.start()
+        request.addfinalizer(p.stop)
+        return fragments
+
+    def render(self, tmpl, **context):
+        return tmpl.render(template.Context(context))
+
+    def template(self, template_string='{% forme form %}'):
+        return template.Template('{% load forme %}' + template_string)
+
+    def test_unbound_form(self, fragments):
+        tmpl = self.template()
+        expected = self.render(tmpl, form=self.Form())
+
+        with mock.patch.object(nodes.FormeNodeBase, 'render') as render:
+            assert self.render(tmpl, form=self.Form()) == expected
+            assert ''.join(nodes.render_iter(
+                tmpl, template.Context({'form': self.Form()}))) == expected
+        assert not render.called
+        assert fragments.stats()['hits'] == 2
+        assert fragments.stats()['misses'] == 1
+
+    def test_key(self, fragments):
+        tmpl = self.template()
+        self.render(tmpl, form=self.Form())
+        rendered = self.render(tmpl, form=self.Form(initial={'name': 'Joe'}))
+        assert 'Joe' in rendered
+        self.render(tmpl, form=self.Form(prefix='other'))
+        with translation.override('cs'):
+            self.render(tmpl, form=self.Form())
+        with mock.patch('forme.nodes.get_current_timezone_name',
+                        return_value='Europe/Prague'):
+            self.render(tmpl, form=self.Form())
+        assert len(fragments.backend) == 5
+
+    def test_bound_form(self, fragments):
+        tmpl = self.template()
+        self.render(tmpl, form=self.Form(data={'name': 'Joe'}))
+        self.render(tmpl, form=self.Form(data={'name': 'Joe'}))
+        assert len(fragments.backend) == 0
+
+    def test_fields_per_instance(self, fragments):
+        class Form(forms.Form):
+            account = forms.ChoiceField(choices=[])
+
+            def __init__(self, tenant, user, *args, **kwargs):
+                super(Form, self).__init__(*args, **kwargs)
+                self.fields['account'].choices = [(tenant, tenant)]
+                self.fields['account'].label = user
+
+        tmpl = self.template()
+        first = self.render(tmpl, form=Form('tenantA-secret', 'Alice'))
+        second = self.render(tmpl, form=Form('tenantB', 'Bob'))
+        assert 'tenantA-secret' in first and 'Alice' in first
+        assert 'tenantA-secret' not in second and 'Alice' not in second
+        assert len(fragments.backend) == 0
+
+        # Fields modified in place aren't cached either.
+        form = self.Form()
+        form.fields['name'].widget.attrs['placeholder'] = 'Alice'
+        assert 'Alice' in self.render(tmpl, form=form)
+        assert 'Alice' not in self.render(tmpl, form=self.Form())
+        assert len(fragments.backend) == 1
+
+    def test_callable_initial(self, fragments):
+        tmpl = self.template()
+        for stamp in ['stamp-1', 'stamp-2']:
+            form = self.Form(initial={'name': lambda: stamp})
+            assert 'value="{0}"'.format(stamp) in self.render(tmpl,
+                                                              form=form)
+        assert len(fragments.backend) == 0
+
+    def test_form_disables_cache(self, fragments):
+        class Form(self.Form):
+            forme_cache = False
+
+        self.render(self.template(), form=Form())
+        assert len(fragments.backend) == 0
+
+    @pytest.mark.parametrize('template_string', [
+        '{% forme form using %}{% csrf_token %}{% endforme %}',
+        '{% forme form replace %}{% field using %}{{ user }}{% endfield %}'
+        '{% endforme %}',
+        '{% forme form using %}{% fieldset fields %}{% endforme %}',
+    ])
+    def test_request_values(self, fragments, template_string):
+        tmpl = self.template(template_string)
+        first = self.render(tmpl, form=self.Form(), csrf_token='first',
+                            user='Joe', fields='name')
+        second = self.render(tmpl, form=self.Form(), csrf_token='second',
+                             user='Bob', fields='email')
+        assert first != second
+        assert len(fragments.backend) == 0
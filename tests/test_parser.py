@@ -1,9 +1,11 @@
 # coding: utf-8
 from __future__ import unicode_literals
 
+import mock
 import pytest
 from django import template
 
+from forme.cache import LRUCache
 from forme.parser import FormeParser
 
 
@@ -31,14 +33,24 @@ class TestFormeParse:
         assert nodelist == []
 
     def test_parse_target(self, forme):
-        vars = lambda variables: [variable.var for variable in variables]
+        # Variables are compiled, string literals are kept as constants
+        vars = lambda targets: [getattr(target, 'var', target)
+                                for target in targets]
         assert vars(forme.parse_target(['form'])) == ['form']
         assert vars(forme.parse_target(['form1', 'form2'])) \
                == ['form1', 'form2']
         assert vars(forme.parse_target(['"form1 form2"'])) \
-               == ['"form1"', '"form2"']
+               == ['form1', 'form2']
         assert vars(forme.parse_target(['"form1 form2"', 'form3'])) \
-                == ['"form1"', '"form2"', 'form3']
+                == ['form1', 'form2', 'form3']
+
+    def test_parse_target_types(self, forme):
+        form, literal, translated = forme.parse_target(
+            ['form', '"name"', '_("name")'])
+        assert isinstance(form, template.Variable)
+        assert literal == 'name'
+        assert not isinstance(literal, template.Variable)
+        assert isinstance(translated, template.Variable)
 
     def test_parse_action(self, forme):
         assert forme.parse_action(['using']) == ('using', True)
@@ -61,3 +73,82 @@ class TestFormeParse:
         assert tag == 'forme'
         assert action == 'using'
         assert nodelist != []
+
+    @pytest.mark.parametrize('tpl, style, action', [
+        ('{% forme form style tenant_style %}', 'tenant_style', 'default'),
+        ('{% forme form style "bare" using %}{% endforme %}', 'bare',
+         'using'),
+    ])
+    def test_parse_style(self, node_mock, tpl, style, action):
+        parser, token = parse_template(tpl)
+        FormeParser(parser, token).parse()
+        args, kwargs = node_mock.call_args
+        assert [target.var for target in args[1]] == ['form']
+        assert args[2] == action
+        assert getattr(kwargs['style_target'], 'var',
+                       kwargs['style_target']) == style
+
+    def test_parse_style_target(self, node_mock):
+        # Form called style
+        parser, token = parse_template('{% forme form style %}')
+        FormeParser(parser, token).parse()
+        args, kwargs = node_mock.call_args
+        assert [target.var for target in args[1]] == ['form', 'style']
+        assert 'style_target' not in kwargs
+
+    def test_signature(self):
+        def signature(tpl):
+            return FormeParser(*parse_template(tpl)).parse().signature
+
+        tpl = '{% forme form using %}{{ test }}{% endforme %}'
+        assert signature(tpl) == signature(tpl)
+        assert signature(tpl) != signature(tpl.replace('test', 'other'))
+        assert signature('{% forme form %}') != signature('{% forme other %}')
+
+
+class TestParseCache:
+    @pytest.fixture(autouse=True)
+    def parse_cache(self, request):
+        parse_cache = LRUCache()
+        p = mock.patch('forme.parser.get_parse_cache',
+                       return_value=parse_cache)
+        p.start()
+        request.addfinalizer(p.stop)
+        return parse_cache
+
+    def parse(self, tpl):
+        parser, token = parse_template(tpl)
+        node = FormeParser(parser, token).parse()
+        return node, parser.tokens
+
+    def test_identical_tags(self, parse_cache):
+        tpl = '{% forme form using %}<b>{{ form }}</b>{% endforme %}after'
+        node, tokens = self.parse(tpl)
+        cached_node, cached_tokens = self.parse(tpl)
+
+        assert cached_node is node
+        assert len(parse_cache) == 1
+        # Nested template is skipped
+        assert [token.contents for token in cached_tokens] == ['after']
+
+    @pytest.mark.parametrize('other', [
+        '{% forme form using %}<i>{{ form }}</i>{% endforme %}',
+        '{% forme other_form using %}<b>{{ form }}</b>{% endforme %}',
+        '{% forme form %}',
+    ])
+    def test_different_tags(self, other):
+        tpl = '{% forme form using %}<b>{{ form }}</b>{% endforme %}'
+        assert self.parse(tpl)[0] is not self.parse(other)[0]
+
+    def test_debug(self, parse_cache):
+        tpl = '{% load forme %}{% forme form %}'
+        with mock.patch.object(FormeParser, 'is_debug', return_value=True):
+            template.Template(tpl)
+        assert len(parse_cache) == 0
+
+    def test_end_tag_in_comment(self, parse_cache):
+        tpl = ('{% forme form using %}{% comment %}{% endforme %}'
+               '{% endcomment %}{% endforme %}')
+        node, tokens = self.parse(tpl)
+        assert tokens == []
+        assert len(parse_cache) == 0
@@ -0,0 +1,101 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import mock
+from django import forms, template
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+
+from forme import nodes, profiling
+
+
+class Form(forms.Form):
+    username = forms.CharField()
+    password = forms.CharField()
+
+
+def render(template_string, **context):
+    tmpl = template.Template('{% load forme %}' + template_string)
+    return tmpl.render(template.Context(context))
+
+
+def test_profile():
+    template_string = ('{% forme form using %}'
+                       '{% fieldset "username" %}{% endforme %}')
+    expected = render(template_string, form=Form())
+    original = nodes.FieldNode.__dict__['render']
+
+    with profiling.profile() as profiler:
+        assert nodes.FieldNode.__dict__['render'] is not original
+        assert render(template_string, form=Form()) == expected
+
+    # Nodes aren't instrumented when profiler isn't active.
+    assert nodes.FieldNode.__dict__['render'] is original
+    assert profiling._originals == []
+
+    records = dict((record.tag, record) for record in profiler.records)
+    assert set(records) == set(['forme', 'fieldset', 'field', 'errors',
+                                'label', 'input'])
+    assert records['forme'].target == 'form'
+    assert records['fieldset'].target == 'username'
+    assert records['forme'].size == len(expected)
+    # Nested nodes are excluded from own time.
+    assert records['forme'].own < records['forme'].duration
+    assert records['input'].own == records['input'].duration
+
+    report = profiler.report()
+    assert len(report) == 6
+    assert report[0]['own'] >= report[-1]['own']
+    assert profiler.format_report(limit=2).count('\n') == 2
+
+
+def test_compiled_styles():
+    tmpl = template.Template('{% load forme %}{% forme form %}')
+    node = tmpl.nodelist.get_nodes_by_type(nodes.FormeNode)[0]
+    original = nodes.FormeNode.__dict__['get_renderer']
+    expected = render('{% forme form %}', form=Form())
+
+    with mock.patch('forme.settings.FORME_COMPILE_STYLES', True):
+        assert node.get_renderer() is not None
+        with profiling.profile() as profiler:
+            assert node.get_renderer() is None
+            assert tmpl.render(template.Context({'form': Form()})) == expected
+
+    # Nested nodes are rendered and recorded.
+    tags = set(record.tag for record in profiler.records)
+    assert set(['forme', 'fieldset', 'field', 'label', 'input']) <= tags
+    assert nodes.FormeNode.__dict__['get_renderer'] is original
+
+
+def test_nested_profiles():
+    with profiling.profile() as outer:
+        with profiling.profile() as inner:
+            render('{% forme form %}', form=Form())
+        assert profiling._originals
+        render('{% forme form %}', form=Form())
+
+    assert not profiling._originals
+    assert len(outer.records) == len(inner.records)
+
+
+def test_middleware():
+    request = RequestFactory().get('/login/')
+
+    def view(request):
+        return HttpResponse(render('{% forme form %}', form=Form()))
+
+    with mock.patch.object(profiling, 'logger') as logger:
+        response = profiling.ProfilingMiddleware(view)(request)
+    assert response.status_code == 200
+    assert not hasattr(request, 'forme_profiler')
+    assert not profiling._originals
+    assert logger.debug.call_args[0][1] == '/login/'
+
+    # Old style middleware
+    middleware = profiling.ProfilingMiddleware()
+    middleware.process_request(request)
+    view(request)
+    with mock.patch.object(profiling, 'logger') as logger:
+        assert middleware.process_response(request, response) is response
+    assert logger.debug.called
+    assert not profiling._originals
@@ -0,0 +1,104 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import mock
+import pytest
+from django import forms, template
+from django.forms.formsets import formset_factory
+
+import forme
+from forme import compiler, loader, shortcuts
+from forme.cache import LRUCache
+from forme.styles import Style
+
+
+class Form(forms.Form):
+    username = forms.CharField(label='User <name>')
+    token = forms.CharField(widget=forms.HiddenInput, initial='x')
+
+
+def render(template_string, **context):
+    tmpl = template.Template('{% load forme %}' + template_string)
+    return tmpl.render(template.Context(context))
+
+
+@pytest.fixture(autouse=True)
+def parse_cache(request):
+    parse_cache = LRUCache()
+    p = mock.patch('forme.shortcuts.get_parse_cache',
+                   return_value=parse_cache)
+    p.start()
+    request.addfinalizer(p.stop)
+    return parse_cache
+
+
+@pytest.mark.parametrize('form', [
+    Form(), Form(data={'username': '<b>'}), formset_factory(Form)(),
+])
+def test_same_output(form):
+    assert forme.render(form) == render('{% forme form %}', form=form)
+
+
+def test_no_parsing(parse_cache):
+    form = Form()
+    forme.render(form)
+    forme.render_field(form, 'username')
+    with mock.patch.object(template, 'Template') as parse:
+        with mock.patch.object(compiler, 'StyleCompiler') as compile_style:
+            forme.render(form)
+            forme.render_field(form, 'username')
+    assert not parse.called
+    assert not compile_style.called
+    assert len(parse_cache) == 2
+
+
+def test_overrides():
+    form = Form()
+    overrides = {'label': '<b>{{ label.label }}{{ suffix }}</b>'}
+    output = forme.render(form, overrides=overrides,
+                          context={'suffix': '!'})
+    assert '<b>User &lt;name&gt;!</b>' in output
+    assert '<label' not in output
+    assert '<b>' not in forme.render(form, style='bare')
+
+
+def test_render_field():
+    form = Form(data={})
+    output = forme.render_field(form, 'username')
+    assert output == render(
+        '{% forme form using %}{% fieldset "username" %}{% endforme %}',
+        form=form)
+    assert 'required' in output
+
+    # Templates of fields are looked up by field name.
+    overrides = {('field', 'token'): '[{{ field.name }}]'}
+    assert forme.render_field(form, 'token', overrides=overrides) == '[token]'
+    assert '[' not in forme.render_field(form, 'username',
+                                         overrides=overrides)
+
+    with pytest.raises(KeyError):
+        forme.render_field(form, 'missing')
+
+
+def test_style_resolver():
+    form = Form()
+    tenant = Style(base=loader.styles['bare'])
+    tenant['label'] = Style(
+        template=template.Template('[{{ label.label }}]').nodelist)
+    with mock.patch('forme.settings.FORME_STYLE_RESOLVER',
+                    lambda context: context.get('style')):
+        output = forme.render(form, context={'style': tenant})
+        assert '[User &lt;name&gt;]' in output
+        assert forme.render_field(form, 'username',
+                                  context={'style': tenant}) in output
+        # Explicit style takes precedence.
+        assert forme.render(form, style='bare',
+                            context={'style': tenant}) == forme.render(form)
+
+
+def test_context():
+    context = template.Context({'form': 'other'}, autoescape=False)
+    output = shortcuts.render(Form(), context=context,
+                              overrides={'label': '{{ label.label }}'})
+    assert 'User <name>' in output
+    assert context['form'] == 'other'
@@ -4,6 +4,7 @@ import pytest
 from django import template
 
 from forme import styles
+from forme.context import render_frame
 
 
 def test_indexing():
@@ -30,3 +31,95 @@ def test_ellipsis():
 
     del style['forme', :]
     assert 'forme' not in style
+
+
+def test_overlay():
+    base = styles.Style()
+    base['forme'] = 'Foo'
+    base['forme', 'test'] = 'Bar'
+
+    style = styles.Style(base=base)
+    assert style['forme'] == 'Foo'
+    assert style['forme', 'test'] == 'Bar'
+    assert 'forme' in style
+    assert style.extends(base)
+    assert not base.extends(style)
+
+    style['forme'] = 'Fubar'
+    style['field', 'test'] = 'Baz'
+    assert style['forme'] == 'Fubar'
+    # Target template in base takes precedence over default one in overlay.
+    assert style['forme', 'test'] == 'Bar'
+    assert style['field', 'test'] == 'Baz'
+    assert len(style['forme', :]) == 2
+
+    # Base style is never modified
+    assert base['forme'] == 'Foo'
+    assert 'field' not in base
+
+
+def test_frozen():
+    style = styles.Style()
+    style['forme'] = 'Foo'
+    style.freeze()
+
+    with pytest.raises(TypeError):
+        style['forme'] = 'Bar'
+    with pytest.raises(TypeError):
+        del style['forme']
+    assert style['forme'] == 'Foo'
+
+
+def test_resolve_variables():
+    style = styles.Style()
+    style['field', template.Variable('name')] = 'Foo'
+    style.freeze()
+
+    context = template.Context({'name': 'username'})
+    assert style.resolve('field', context) == {'username': 'Foo'}
+    # Resolved targets aren't written back into shared style.
+    assert len(style['field', :]) == 1
+
+    # Variables are resolved once per render of forme tag
+    templates = style.flatten()
+    with render_frame(context, {}):
+        assert templates.lookup('field', 'username', context) == 'Foo'
+        context.dicts[-2]['name'] = 'password'
+        assert templates.lookup('field', 'username', context) == 'Foo'
+
+        # Variables pushed above render frame are resolved again.
+        context.push()
+        context['name'] = 'password'
+        assert templates.lookup('field', 'password', context) == 'Foo'
+        assert templates.lookup('field', 'username', context) is None
+        context.pop()
+
+    assert templates.lookup('field', 'password', context) == 'Foo'
+    with render_frame(context, {}):
+        assert templates.lookup('field', 'password', context) == 'Foo'
+
+
+@pytest.mark.parametrize('template_string,variables', [
+    ('', []),
+    ('{{ label }}', ['label']),
+    ('{{ label.tag|default:field }}', ['label', 'field']),
+    ('{% if errors %}{% for error in errors %}{{ error }}{% endfor %}'
+     '{% endif %}', ['errors']),
+    ('{% for error in errors %}{{ forloop.counter }}{% endfor %}{{ error }}',
+     ['errors', 'error']),
+    ('{% with name=field.name %}{{ name }}{% endwith %}', ['field']),
+])
+def test_variables(template_string, variables):
+    tmpl = template.Template(template_string)
+    style = styles.Style(template=tmpl.nodelist)
+    assert style.variables == set(variables)
+
+
+@pytest.mark.parametrize('template_string', [
+    '{% load forme %}{% errors %}',
+    '{% csrf_token %}',
+    '{% include template_name %}',
+])
+def test_variables_unknown(template_string):
+    tmpl = template.Template(template_string)
+    assert styles.get_variables(tmpl.nodelist) is None
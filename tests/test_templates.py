@@ -5,6 +5,8 @@ import glob
 import os
 import os.path
 import sys
+import threading
+import time
 import timeit
 import pytest
 from bs4 import BeautifulSoup
@@ -73,6 +75,74 @@ class TestTemplates:
             assert given.attrib == should_be.attrib
             assert given.text == should_be.text
 
+    def test_render_iter(self, case, template_name):
+        """
+        Streamed template must be the same as rendered one.
+
+        """
+        from forme.nodes import render_iter
+
+        tmpl = self.load_template(template_name)
+        expected = tmpl.render(self.load_context(case))
+        chunks = list(render_iter(tmpl, self.load_context(case)))
+        assert len(chunks) > 1
+        assert ''.join(chunks) == expected
+
+    def render_threads(self, case, nodelist, threads, n):
+        """
+        Renders nodelist n times in each thread. Returns all outputs and
+        elapsed time.
+
+        """
+        output = []
+
+        def worker():
+            for i in range(n):
+                output.append(nodelist.render(self.load_context(case)))
+
+        workers = [threading.Thread(target=worker) for i in range(threads)]
+        start = time.time()
+        for worker_ in workers:
+            worker_.start()
+        for worker_ in workers:
+            worker_.join()
+        return output, time.time() - start
+
+    def test_threads(self, case, template_name):
+        """
+        Compiled template is shared by threads, render it concurrently and
+        check it always gives the same output.
+
+        """
+        tmpl = self.load_template(template_name)
+
+        from django.template.loader_tags import BlockNode
+        nodes = tmpl.nodelist.get_nodes_by_type(BlockNode)
+        nodelist = dict([(node.name, node.nodelist) for node in nodes])
+        expected = nodelist['template'].render(self.load_context(case))
+
+        output, _ = self.render_threads(case, nodelist['template'], 8, 50)
+        assert len(output) == 8 * 50
+        assert set(output) == set([expected])
+
+    @pytest.mark.profiling
+    def test_profiling_threads(self, case, template_name):
+        tmpl = self.load_template(template_name)
+
+        from django.template.loader_tags import BlockNode
+        nodes = tmpl.nodelist.get_nodes_by_type(BlockNode)
+        nodelist = dict([(node.name, node.nodelist) for node in nodes])
+
+        n = 1000
+
+        print('-' * 40)
+        print('Template: {0}/{1}'.format(case, os.path.basename(template_name)))
+        print('--- Rendering in threads')
+        for threads in (1, 2, 4, 8):
+            _, elapsed = self.render_threads(case, nodelist['template'],
+                                             threads, n // threads)
+            print('{0:^8} {1:.0f} renders/s'.format(threads, n / elapsed))
+
     @pytest.mark.profiling
     def test_profiling(self, case, template_name):
         ctx = self.load_context(case)
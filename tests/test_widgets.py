@@ -0,0 +1,214 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import mock
+import pytest
+from django import forms
+from django import template
+from django.db import connection, models
+from django.forms.formsets import formset_factory
+from django.test import TestCase
+from django.utils.safestring import mark_safe
+
+from forme.widgets import ChoicesCache, cached_options, prefetch_choices
+
+CHOICES = [
+    ('', '---'),
+    (1, 'One & only'),
+    ('Group', [(2, 'Two'), (3, mark_safe('<b>Three</b>'))]),
+    ('Other', [(1, 'One again'), (4, 'Four')]),
+    (True, 'True'),
+]
+
+
+class Form(forms.Form):
+    single = forms.ChoiceField(choices=CHOICES, required=False)
+    multiple = forms.MultipleChoiceField(choices=CHOICES, required=False)
+
+
+@pytest.fixture
+def choices_cache(request):
+    choices_cache = ChoicesCache(max_entries=10)
+    p = mock.patch('forme.nodes.get_choices_cache',
+                   return_value=choices_cache)
+    p.start()
+    request.addfinalizer(p.stop)
+    return choices_cache
+
+
+def render(form):
+    tmpl = template.Template('{% load forme %}{% forme form %}')
+    return tmpl.render(template.Context({'form': form}))
+
+
+def render_field(field, choices_cache):
+    with cached_options(field, choices_cache):
+        return str(field)
+
+
+@pytest.mark.parametrize('data', [
+    {},
+    {'single': '1', 'multiple': ['1']},
+    {'single': '3', 'multiple': ['2', '3', '4']},
+    {'single': 'True', 'multiple': ['True', '1', 'unknown']},
+])
+def test_selected(choices_cache, data):
+    form = Form(data=data)
+    for name in form.fields:
+        # Repeated to render from cache
+        for i in range(2):
+            assert (render_field(form[name], choices_cache) ==
+                    str(Form(data=data)[name]))
+        assert 'render_options' not in form.fields[name].widget.__dict__
+    assert len(choices_cache.options) == 2
+
+
+def test_forme(choices_cache):
+    form = Form(data={'single': '2', 'multiple': ['2', '4']})
+    with mock.patch('forme.nodes.get_choices_cache', return_value=None):
+        expected = render(form)
+    assert render(form) == expected
+    assert render(form) == expected
+    assert len(choices_cache.options) == 2
+
+
+def test_choices_changed(choices_cache):
+    form = Form()
+    render_field(form['single'], choices_cache)
+
+    form.fields['single'].choices = CHOICES + [(5, 'Five')]
+    assert 'Five' in render_field(form['single'], choices_cache)
+    assert len(choices_cache.options) == 2
+
+
+def test_not_cacheable():
+    class Select(forms.Select):
+        def render_options(self, choices, selected_choices):
+            return 'custom'
+
+    choices_cache = ChoicesCache(min_choices=10)
+    assert not choices_cache.is_cacheable(forms.Select(choices=CHOICES))
+    assert not choices_cache.is_cacheable(Select(choices=CHOICES * 2))
+    assert choices_cache.is_cacheable(forms.Select(choices=CHOICES * 2))
+
+
+def test_min_choices():
+    class Choices(object):
+        def __iter__(self):
+            return iter(CHOICES)
+
+    choices_cache = ChoicesCache(min_choices=10)
+    form = Form(data={'single': '1'})
+    widget = form.fields['single'].widget
+    widget.choices = Choices()
+    # Choices which aren't list are counted when rendered.
+    assert choices_cache.is_cacheable(widget)
+    assert (render_field(form['single'], choices_cache) ==
+            str(Form(data={'single': '1'})['single']))
+    assert len(choices_cache.options) == 0
+
+    widget.choices = Choices()
+    choices_cache.min_choices = 5
+    render_field(form['single'], choices_cache)
+    assert len(choices_cache.options) == 1
+
+
+class Color(models.Model):
+    name = models.CharField(max_length=10)
+
+    class Meta:
+        app_label = 'forme'
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
+class ColorForm(forms.Form):
+    color = forms.ModelChoiceField(Color.objects.all())
+    colors = forms.ModelMultipleChoiceField(Color.objects.all(),
+                                            required=False)
+    other = forms.ModelChoiceField(Color.objects.filter(name='red'))
+
+
+class PrefetchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(PrefetchTest, cls).setUpClass()
+        if hasattr(connection, 'schema_editor'):
+            # Dj1.7+
+            with connection.schema_editor() as editor:
+                editor.create_model(Color)
+        else:
+            from django.core.management.color import no_style
+            sql, references = connection.creation.sql_create_model(
+                Color, no_style())
+            cursor = connection.cursor()
+            for statement in sql:
+                cursor.execute(statement)
+
+    def setUp(self):
+        for name in ('red', 'green', 'blue'):
+            Color.objects.create(name=name)
+
+    def render(self, template_string, **context):
+        tmpl = template.Template('{% load forme %}' + template_string)
+        return tmpl.render(template.Context(context))
+
+    def test_formset(self):
+        formset_class = formset_factory(ColorForm, extra=1)
+        with mock.patch('forme.settings.FORME_PREFETCH_CHOICES', False):
+            expected = self.render('{% forme formset %}',
+                                   formset=formset_class())
+
+        # Two distinct querysets, regardless of formset size.
+        for extra in (1, 10):
+            formset_class = formset_factory(ColorForm, extra=extra)
+            formset = formset_class()
+            with self.assertNumQueries(2):
+                output = self.render('{% forme formset %}', formset=formset)
+            if extra == 1:
+                self.assertEqual(output, expected)
+            self.assertEqual(output.count('>blue</option>'), 2 * extra)
+
+        with mock.patch('forme.settings.FORME_PREFETCH_CHOICES', False):
+            with self.assertNumQueries(30):
+                self.render('{% forme formset %}', formset=formset)
+
+    def test_form(self):
+        with self.assertNumQueries(2):
+            self.render('{% forme form %}', form=ColorForm())
+        # Querysets of fields which aren't rendered aren't evaluated.
+        with self.assertNumQueries(1):
+            self.render('{% forme form using %}{% fieldset "color colors" %}'
+                        '{% endforme %}', form=ColorForm())
+
+    def test_custom_widget(self):
+        class CountSelect(forms.Select):
+            def render(self, name, value, attrs=None, **kwargs):
+                output = super(CountSelect, self).render(name, value, attrs,
+                                                         **kwargs)
+                return mark_safe('{0}({1})'.format(
+                    output, self.choices.queryset.count()))
+
+        form = ColorForm()
+        form.fields['color'].widget = CountSelect()
+        form.fields['color'].widget.choices = form.fields['color'].choices
+        output = self.render('{% forme form %}', form=form)
+        self.assertIn('>blue</option>', output)
+        self.assertIn('</select>(3)', output)
+
+    def test_restored(self):
+        form = ColorForm()
+        widget = form.fields['color'].widget
+        choices = widget.choices
+        with prefetch_choices([form]):
+            self.assertIsNot(widget.choices, choices)
+            self.assertEqual(len(widget.choices), 4)
+            self.assertEqual(list(widget.choices), list(choices))
+            # Custom widgets may read attributes of original choices.
+            self.assertIs(widget.choices.queryset, choices.queryset)
+            self.assertIs(widget.choices.field, choices.field)
+            self.assertEqual(widget.choices.choice(Color.objects.get(
+                name='red')), choices.choice(Color.objects.get(name='red')))
+        self.assertIs(widget.choices, choices)